@@ -0,0 +1,99 @@
+"""
+Benchmark del arranque en frío de la CLI (cli.py) con `python -X importtime`.
+
+Flujo:
+1) Lanza cada caso de CASOS (`cli.py --help`, `cli.py listar`, `cli.py <subcomando> --help`) en un intérprete
+   nuevo con -X importtime, REPETICIONES veces (tras una ejecución de calentamiento que deja los .pyc escritos).
+2) De la traza de importtime suma el tiempo acumulado de los imports de primer nivel (incluye los del arranque de
+   Python: site, encodings...) y anota qué módulos se cargaron.
+3) Muestra por caso el mínimo de tiempo de imports y de tiempo total del proceso, y los imports más costosos.
+4) Falla (código 1) si algún caso supera PRESUPUESTO_MS de imports o carga alguna dependencia pesada (PESADOS):
+   ningún caso de CASOS necesita numpy/OpenCV/scipy/scikit-image/pandas para ejecutarse.
+Se compara el mínimo porque es mucho menos sensible a la carga de la máquina que la mediana.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+CLI = Path(__file__).with_name("cli.py")
+CASOS = {
+    "cli --help": ["--help"],
+    "listar": ["listar"],
+    "segmentar --help": ["segmentar", "--help"],
+    "evaluar --help": ["evaluar", "--help"],
+    "visualizar --help": ["visualizar", "--help"],
+}
+PESADOS = ("numpy", "cv2", "scipy", "skimage", "pandas", "pyarrow", "matplotlib")
+PRESUPUESTO_MS = 150                # Tiempo de imports máximo por caso (mínimo de las repeticiones)
+REPETICIONES = 5
+
+
+def leer_importtime(traza: str):
+    #Devuelve (ms totales de imports de primer nivel, {módulo: ms acumulados}) de la salida de -X importtime
+    acumulados = {}
+    total_us = 0
+    for linea in traza.splitlines():
+        if not linea.startswith("import time:") or "imported package" in linea:
+            continue
+        _, acumulado, nombre = linea[len("import time:"):].split("|")
+        acumulados[nombre.strip()] = int(acumulado) / 1000
+        if not nombre[1:].startswith(" "):  # sin sangría: import de primer nivel
+            total_us += int(acumulado)
+    return total_us / 1000, acumulados
+
+
+def medir_caso(argumentos: list[str], repeticiones: int = REPETICIONES) -> dict:
+    #Lanza `python -X importtime cli.py <argumentos>` varias veces; mínimo de tiempos y módulos cargados
+    orden = [sys.executable, "-X", "importtime", str(CLI), *argumentos]
+    subprocess.run(orden, capture_output=True, cwd=CLI.parent)  # calentamiento (.pyc)
+    imports, totales = [], []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        proceso = subprocess.run(orden, capture_output=True, text=True, cwd=CLI.parent)
+        totales.append((time.perf_counter() - inicio) * 1000)
+        if proceso.returncode != 0:
+            raise RuntimeError(f"cli.py {' '.join(argumentos)} terminó con código {proceso.returncode}")
+        total_ms, acumulados = leer_importtime(proceso.stderr)
+        imports.append(total_ms)
+    pesados = sorted({m.split(".")[0] for m in acumulados if m.split(".")[0] in PESADOS})
+    return {"imports_ms": min(imports), "total_ms": min(totales), "modulos": acumulados, "pesados": pesados}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de cli.py y lo compara con un presupuesto")
+    parser.add_argument("--presupuesto-ms", type=float, default=PRESUPUESTO_MS, help="Tiempo de imports máximo por caso")
+    parser.add_argument("--repeticiones", "-n", type=int, default=REPETICIONES)
+    parser.add_argument("--detalle", type=int, default=0, metavar="N", help="Muestra los N imports más costosos por caso")
+    args = parser.parse_args()
+
+    print(f"{'caso':<20} {'imports (ms)':>12} {'proceso (ms)':>12} {'módulos':>8}  estado")
+    fallos = []
+    for nombre, argumentos in CASOS.items():
+        r = medir_caso(argumentos, args.repeticiones)
+        problemas = []
+        if r["imports_ms"] > args.presupuesto_ms:
+            problemas.append(f"supera {args.presupuesto_ms:.0f} ms")
+        if r["pesados"]:
+            problemas.append(f"carga {', '.join(r['pesados'])}")
+        estado = "; ".join(problemas) if problemas else "ok"
+        print(f"{nombre:<20} {r['imports_ms']:>12.1f} {r['total_ms']:>12.1f} {len(r['modulos']):>8}  {estado}")
+        if args.detalle:
+            costosos = sorted(r["modulos"].items(), key=lambda kv: kv[1], reverse=True)[:args.detalle]
+            for modulo, ms in costosos:
+                print(f"    {ms:8.1f} ms  {modulo}")
+        if problemas:
+            fallos.append(f"{nombre}: {estado}")
+
+    if fallos:
+        print("\nARRANQUE FUERA DE PRESUPUESTO:")
+        for fallo in fallos:
+            print(f"  - {fallo}")
+        sys.exit(1)
+    print(f"\nTodos los casos dentro del presupuesto ({args.presupuesto_ms:.0f} ms de imports, sin dependencias pesadas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Barrido de parámetros de la segmentación con reutilización de etapas intermedias.
+
+Flujo:
+1) Rejilla de valores por parámetro (`--param MIN_DISTANCE=3,5,7 ...`); los no indicados usan el valor global.
+2) Por imagen (en paralelo con --workers) se recorre la rejilla como un árbol de dependencias (DAG):
+     histograma -> umbral (SIGMA_HIST, PROMINENCIA_MODAS, DISTANCIA_MODAS)
+       -> máscara limpia + mapa de distancia (AREA_MIN_NUCLEO)
+         -> distancia suavizada (DIST_SMOOTH_SIGMA)
+           -> marcadores + watershed (MIN_DISTANCE)
+             -> fusión + relleno + métricas de evaluar (THRESHOLD_CONTACTO)
+   Cada nodo se calcula una sola vez y lo comparten todas las combinaciones que cuelgan de él; si dos ajustes
+   del histograma dan el mismo umbral, se reutiliza todo el subárbol.
+   Cada etapa usa las funciones de `segmentar.pipeline_watershed` (detector de semillas y BAJA_MEMORIA
+   configurados), a resolución completa: con los valores globales se obtienen los mismos labels que segmentar.py
+   sin --piramide.
+3) Promedia las métricas por combinación y escribe la clasificación en `barrido.csv`.
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from scipy import ndimage
+
+import evaluar
+import segmentar
+
+# Orden = orden de las etapas del pipeline (de la más cara/compartida a la más barata)
+PARAMETROS_BARRIDO = [
+    "SIGMA_HIST",
+    "PROMINENCIA_MODAS",
+    "DISTANCIA_MODAS",
+    "AREA_MIN_NUCLEO",
+    "DIST_SMOOTH_SIGMA",
+    "MIN_DISTANCE",
+    "THRESHOLD_CONTACTO",
+]
+METRICAS_TABLA = ["f1", "iou", "aji", "pq", "det_f1_50", "precision_conteo", "num_nucleos_pred"]
+SALIDA_CSV = "barrido.csv"
+
+
+def rejilla_desde_argumentos(params: list[str]) -> dict:
+    #Convierte ["MIN_DISTANCE=3,5", ...] en {nombre: [valores]}; el resto de parámetros toma el valor global
+    # Lanza ValueError con un mensaje para el usuario si algún parámetro está mal escrito
+    rejilla = {nombre: [getattr(segmentar, nombre)] for nombre in PARAMETROS_BARRIDO}
+    for param in params:
+        nombre, separador, valores = param.partition("=")
+        nombre = nombre.strip().upper()
+        if not separador:
+            raise ValueError(f"Formato esperado NOMBRE=v1,v2,...: {param!r}")
+        if nombre not in rejilla:
+            raise ValueError(f"Parámetro no barrible: {nombre} (opciones: {', '.join(PARAMETROS_BARRIDO)})")
+        tipo = type(getattr(segmentar, nombre))
+        try:
+            rejilla[nombre] = [tipo(v) for v in valores.split(",") if v.strip()]
+        except ValueError:
+            raise ValueError(f"Valores no válidos para {nombre} (se esperan {tipo.__name__}): {valores!r}") from None
+        if not rejilla[nombre]:
+            raise ValueError(f"Sin valores para {nombre}: {param!r}")
+    return rejilla
+
+
+def barrer_imagen(ruta: Path, rejilla: dict):
+    #Evalúa todas las combinaciones de la rejilla sobre una imagen reutilizando etapas; devuelve (filas, contadores)
+    # GT (XML con vértices y/o PNG coloreado) cargado una sola vez para todas las combinaciones
+    ruta_gt = Path(evaluar.GT_COLORS_DIR) / ruta.name
+    ruta_xml = Path(evaluar.XML_DIR) / f"{ruta.stem}.xml"
+    if not ruta_gt.exists() and not ruta_xml.exists():
+        return [], {}
+    _, imagen_gris = segmentar.cargar_imagen(str(ruta))
+    gt_instancias = evaluar.cargar_gt_imagen(ruta.name, imagen_gris.shape)
+    gt_color = cv2.imread(str(ruta_gt)) if ruta_gt.exists() else None
+    if gt_instancias[0] is None and gt_color is None:
+        return [], {}  # XML sin vértices y sin PNG: no hay máscara de GT
+    gt = (gt_color, gt_instancias)
+    conteos = np.bincount(imagen_gris.ravel(), minlength=256)
+
+    contadores = dict.fromkeys(["umbral", "mascara", "suavizado", "watershed", "fusion"], 0)
+    subarboles = {}  # umbral -> filas del subárbol (sin los parámetros del histograma)
+    filas = []
+
+    for sigma_hist, prominencia, distancia_modas in itertools.product(
+        rejilla["SIGMA_HIST"], rejilla["PROMINENCIA_MODAS"], rejilla["DISTANCIA_MODAS"]
+    ):
+        _, umbral, _ = segmentar.detectar_modas_conteos(conteos, sigma_hist, prominencia, distancia_modas)
+        contadores["umbral"] += 1
+        if umbral not in subarboles:
+            subarboles[umbral] = _barrer_desde_umbral(ruta.name, imagen_gris, umbral, gt, rejilla, contadores)
+        for config, metricas in subarboles[umbral]:
+            filas.append(({"SIGMA_HIST": sigma_hist, "PROMINENCIA_MODAS": prominencia,
+                           "DISTANCIA_MODAS": distancia_modas, **config}, metricas))
+    return filas, contadores
+
+
+def _barrer_desde_umbral(nombre_imagen, imagen_gris, umbral, gt, rejilla, contadores):
+    #Subárbol del DAG a partir de un umbral: máscara -> distancia -> suavizado -> watershed -> fusión
+    # gt: (gt_color o None, cargar_gt_imagen) de la imagen, compartido por todas las combinaciones
+    gt_color, gt_instancias = gt
+    filas = []
+    for area_min in rejilla["AREA_MIN_NUCLEO"]:
+        mask = segmentar.mascara_limpia(imagen_gris, umbral, area_min)
+        distance = segmentar.mapa_distancia(mask)
+        contadores["mascara"] += 1
+
+        for sigma in rejilla["DIST_SMOOTH_SIGMA"]:
+            distance_smooth = ndimage.gaussian_filter(distance, sigma=sigma)  # mismo dtype que distance
+            contadores["suavizado"] += 1
+
+            for min_distance in rejilla["MIN_DISTANCE"]:
+                # Mismas funciones que segmentar.pipeline_watershed: detector, BAJA_MEMORIA y dtype configurados
+                markers = segmentar.marcadores_por_picos(distance_smooth, mask, min_distance)
+                res_wtrshd = segmentar.watershed_distancia(distance, markers, mask)
+                contadores["watershed"] += 1
+
+                for umbral_contacto in rejilla["THRESHOLD_CONTACTO"]:
+                    # unir_fragmentos devuelve un mapa nuevo: res_wtrshd sigue intacto para el siguiente umbral
+                    etiquetas = segmentar.rellenar_por_contorno(
+                        segmentar.unir_fragmentos(res_wtrshd, umbral_contacto), en_sitio=segmentar.BAJA_MEMORIA
+                    )
+                    contadores["fusion"] += 1
+                    pred_binaria = np.where(etiquetas > 0, 255, 0).astype(np.uint8)
+                    metricas = evaluar.evaluar_prediccion(nombre_imagen, pred_binaria, etiquetas, gt_color, gt_instancias)
+                    config = {
+                        "AREA_MIN_NUCLEO": area_min,
+                        "DIST_SMOOTH_SIGMA": sigma,
+                        "MIN_DISTANCE": min_distance,
+                        "THRESHOLD_CONTACTO": umbral_contacto,
+                    }
+                    filas.append((config, {m: metricas[m] for m in METRICAS_TABLA}))
+    return filas
+
+
+def ejecutar_barrido(rejilla: dict, workers: int = 1, max_imagenes: int | None = None, metrica: str = "f1"):
+    #Barre la rejilla sobre el lote, agrega por combinación y escribe la clasificación
+    imagenes = segmentar.listar_entradas()[:max_imagenes]
+    if not imagenes:
+        print(f"ERROR: No se encontraron imágenes en {segmentar.INPUT_DIR}")
+        return
+
+    num_configs = int(np.prod([len(v) for v in rejilla.values()]))
+    print(f"Barrido: {num_configs} combinaciones x {len(imagenes)} imágenes (workers={workers})...")
+    inicio = time.perf_counter()
+
+    acumulado = {}  # config (tupla) -> lista de métricas por imagen
+    contadores_totales = {}
+    pool = segmentar.crear_pool(workers) if workers > 1 else None
+    try:
+        if pool is not None:
+            futuros = [pool.submit(barrer_imagen, ruta, rejilla) for ruta in imagenes]
+        for i, ruta in enumerate(imagenes, 1):
+            print(f"[{i}/{len(imagenes)}] {ruta.name}...", end=" ", flush=True)
+            try:
+                filas, contadores = futuros[i - 1].result() if pool is not None else barrer_imagen(ruta, rejilla)
+            except Exception as e:
+                print(f"ERROR: {e}")
+                continue
+            if not filas:
+                print("sin GT: no evaluado")
+                continue
+            for config, metricas in filas:
+                acumulado.setdefault(tuple(config[p] for p in PARAMETROS_BARRIDO), []).append(metricas)
+            for etapa, n in contadores.items():
+                contadores_totales[etapa] = contadores_totales.get(etapa, 0) + n
+            print("OK")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if not acumulado:
+        print("No se evaluó ninguna imagen correctamente.")
+        return
+
+    # Clasificación: media por combinación, ordenada por la métrica elegida
+    tabla = []
+    for config, lista in acumulado.items():
+        fila = dict(zip(PARAMETROS_BARRIDO, config))
+        fila.update({m: float(np.mean([r[m] for r in lista])) for m in METRICAS_TABLA})
+        fila["imagenes"] = len(lista)
+        tabla.append(fila)
+    tabla.sort(key=lambda f: f[metrica], reverse=True)
+
+    with open(SALIDA_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["posicion", *PARAMETROS_BARRIDO, *METRICAS_TABLA, "imagenes"])
+        writer.writeheader()
+        for posicion, fila in enumerate(tabla, 1):
+            writer.writerow({"posicion": posicion, **fila})
+
+    duracion = time.perf_counter() - inicio
+    evaluadas = len(next(iter(acumulado.values())))
+    print(f"\n{num_configs} combinaciones en {duracion:.1f}s")
+    print("Etapas calculadas (sin reutilizar serían "
+          f"{num_configs * evaluadas} de cada): "
+          + ", ".join(f"{etapa}={n}" for etapa, n in contadores_totales.items()))
+    print(f"\nMejores combinaciones por {metrica}:")
+    for posicion, fila in enumerate(tabla[:10], 1):
+        ajustes = " ".join(f"{p}={fila[p]}" for p in PARAMETROS_BARRIDO if len(rejilla[p]) > 1)
+        print(f"  {posicion:2d}. {ajustes or '(valores globales)'} -> {metrica} {fila[metrica]:.4f}")
+    print(f"Clasificación guardada en: {SALIDA_CSV}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de segmentación con etapas compartidas")
+    parser.add_argument(
+        "--param", "-p", action="append", default=[],
+        help="NOMBRE=v1,v2,... (repetible). Opciones: " + ", ".join(PARAMETROS_BARRIDO),
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1,
+        help="Procesos en paralelo (1 = secuencial, 0 = todos los núcleos de CPU)",
+    )
+    parser.add_argument("--imagenes", type=int, default=None, help="Usar solo las N primeras imágenes del lote")
+    parser.add_argument("--metrica", default="f1", choices=METRICAS_TABLA, help="Métrica para ordenar la clasificación")
+    args = parser.parse_args()
+
+    try:
+        rejilla = rejilla_desde_argumentos(args.param)
+    except ValueError as e:
+        parser.error(str(e))
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    ejecutar_barrido(rejilla, workers, args.imagenes, args.metrica)
+
+
+if __name__ == "__main__":
+    main()
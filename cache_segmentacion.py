@@ -0,0 +1,136 @@
+"""
+Caché en disco de resultados de segmentación.
+
+Cada entrada (`<clave>.npz`) guarda el mapa de labels, la máscara binaria, las áreas y la info del filtro de una
+imagen. La clave es el hash de: bytes de la imagen + parámetros efectivos + versión del pipeline, de modo que
+cambiar cualquier global (MIN_DISTANCE, THRESHOLD_CONTACTO, ...) o el algoritmo invalida la entrada.
+
+`indice.json` guarda el tamaño y el último uso de cada entrada (expulsión LRU al superar el límite) y el hash de
+cada imagen por (tamaño, mtime), para no releer los bytes de las imágenes que no han cambiado.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import diferido
+
+np = diferido.modulo("numpy")
+
+CACHE_DIR = ".cache_segmentar"
+CACHE_MAX_MB = 2048         # Límite de tamaño de la caché (expulsión LRU)
+INDICE = "indice.json"
+
+
+def cargar_indice(carpeta: Path) -> dict:
+    #Lee indice.json (o uno vacío si no existe o está corrupto)
+    ruta = Path(carpeta) / INDICE
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            indice = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        indice = {}
+    indice.setdefault("entradas", {})
+    indice.setdefault("archivos", {})
+    return indice
+
+
+def guardar_indice(carpeta: Path, indice: dict):
+    #Escribe indice.json de forma atómica
+    carpeta = Path(carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    temporal = carpeta / f"{INDICE}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(indice, f)
+    os.replace(temporal, carpeta / INDICE)
+
+
+def hash_archivo(ruta: Path, indice: dict) -> str:
+    #sha256 de los bytes de la imagen; reutiliza el del índice si tamaño y mtime no han cambiado
+    estado = ruta.stat()
+    clave_archivo = str(ruta.resolve())
+    previo = indice["archivos"].get(clave_archivo)
+    if previo and previo["tamano"] == estado.st_size and previo["mtime_ns"] == estado.st_mtime_ns:
+        return previo["sha256"]
+
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    digest = h.hexdigest()
+    indice["archivos"][clave_archivo] = {"tamano": estado.st_size, "mtime_ns": estado.st_mtime_ns, "sha256": digest}
+    return digest
+
+
+def clave_entrada(hash_imagen: str, parametros: dict, version) -> str:
+    #Clave de la entrada: hash(bytes imagen + parámetros efectivos + versión del pipeline)
+    h = hashlib.sha256()
+    h.update(hash_imagen.encode())
+    h.update(json.dumps(parametros, sort_keys=True).encode())
+    h.update(str(version).encode())
+    return h.hexdigest()
+
+
+def leer_entrada(carpeta: Path, clave: str):
+    #Devuelve (areas, info) de la entrada o None si no existe o no se puede leer (sin descomprimir los mapas)
+    ruta = Path(carpeta) / f"{clave}.npz"
+    try:
+        with np.load(ruta) as datos:
+            return datos["areas"].tolist(), json.loads(str(datos["info"]))
+    except (FileNotFoundError, OSError, ValueError, KeyError):
+        return None
+
+
+def existe_entrada(carpeta: Path, clave: str) -> bool:
+    #True si hay una entrada para la clave (sin leerla)
+    return (Path(carpeta) / f"{clave}.npz").exists()
+
+
+def leer_mapas(carpeta: Path, clave: str):
+    #Devuelve (etiquetas, mask) de la entrada
+    with np.load(Path(carpeta) / f"{clave}.npz") as datos:
+        return datos["etiquetas"], datos["mask"]
+
+
+def escribir_entrada(carpeta: Path, clave: str, etiquetas: np.ndarray, mask: np.ndarray, areas, info: dict) -> int:
+    #Guarda la entrada (escritura atómica) y devuelve su tamaño en bytes
+    carpeta = Path(carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    dtype = np.uint16 if etiquetas.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    temporal = carpeta / f"{clave}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(
+        temporal,
+        etiquetas=etiquetas.astype(dtype, copy=False),
+        mask=mask,
+        areas=np.asarray(areas, dtype=np.float64),
+        info=np.array(json.dumps(info)),
+    )
+    destino = carpeta / f"{clave}.npz"
+    os.replace(temporal, destino)
+    return destino.stat().st_size
+
+
+def registrar_uso(indice: dict, clave: str, tamano: int | None = None):
+    #Marca la entrada como usada ahora (y actualiza su tamaño si se acaba de escribir)
+    entrada = indice["entradas"].setdefault(clave, {"tamano": 0})
+    if tamano is not None:
+        entrada["tamano"] = tamano
+    entrada["ultimo_uso"] = time.time()
+
+
+def podar(carpeta: Path, indice: dict, max_bytes: int) -> int:
+    #Expulsa las entradas menos usadas recientemente hasta quedar bajo max_bytes; devuelve cuántas borra
+    entradas = indice["entradas"]
+    total = sum(e["tamano"] for e in entradas.values())
+    expulsadas = 0
+    for clave in sorted(entradas, key=lambda c: entradas[c].get("ultimo_uso", 0)):
+        if total <= max_bytes:
+            break
+        total -= entradas.pop(clave)["tamano"]
+        (Path(carpeta) / f"{clave}.npz").unlink(missing_ok=True)
+        expulsadas += 1
+    return expulsadas
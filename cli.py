@@ -0,0 +1,57 @@
+"""
+Punto de entrada único del pipeline: `python cli.py <subcomando> [opciones]`.
+
+Subcomandos:
+  segmentar   -> segmentar.py   (python cli.py segmentar -w 4 --profile)
+  evaluar     -> evaluar.py
+  visualizar  -> visualizar.py
+  lotes       -> lotes.py       (python cli.py lotes trabajar -w 4: cola en disco para varias máquinas)
+  empaquetar  -> paquete.py     (pack: canal H, GT y XML en fragmentos memmap; luego --paquete en cada script)
+  listar      -> imágenes con resultados en visualizaciones/ (visualizar.py --listar)
+El resto de argumentos se pasa tal cual al script, así que cada subcomando acepta las mismas opciones que el script
+correspondiente (`python cli.py evaluar --help`).
+
+Arranque rápido: este módulo solo importa la biblioteca estándar y el script del subcomando elegido, y los scripts
+difieren numpy/OpenCV/scipy/scikit-image/pandas hasta el primer uso (diferido.py). `--help` y `listar` no cargan
+ninguna de ellas; arranque.py mide el tiempo de arranque y falla si supera el presupuesto.
+"""
+
+import argparse
+import importlib
+import sys
+
+SUBCOMANDOS = {
+    # subcomando: (módulo, argumentos fijos, descripción)
+    "segmentar": ("segmentar", [], "Segmenta las imágenes del canal H (segmentar.py)"),
+    "evaluar": ("evaluar", [], "Evalúa las segmentaciones frente al ground truth (evaluar.py)"),
+    "visualizar": ("visualizar", [], "Genera las visualizaciones de análisis (visualizar.py)"),
+    "lotes": ("lotes", [], "Reparte el lote entre varias máquinas con una cola en disco (lotes.py)"),
+    "empaquetar": ("paquete", [], "Empaqueta el lote en fragmentos que se leen como memmap (paquete.py)"),
+    "listar": ("visualizar", ["--listar"], "Lista las imágenes con resultados en visualizaciones/"),
+}
+
+
+def ejecutar_subcomando(subcomando: str, argumentos: list[str]):
+    #Importa el script del subcomando y ejecuta su main() con `argumentos` como línea de comandos
+    nombre_modulo, fijos, _ = SUBCOMANDOS[subcomando]
+    modulo = importlib.import_module(nombre_modulo)
+    sys.argv = [f"cli.py {subcomando}", *fijos, *argumentos]
+    modulo.main()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Segmentación de núcleos: punto de entrada único",
+        epilog="Las opciones de cada subcomando: python cli.py <subcomando> --help",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="subcomando", required=True, metavar="subcomando")
+    for subcomando, (_, _, descripcion) in SUBCOMANDOS.items():
+        # add_help=False: --help lo atiende el script del subcomando con todas sus opciones
+        subparsers.add_parser(subcomando, help=descripcion, add_help=False)
+    args, resto = parser.parse_known_args()
+    ejecutar_subcomando(args.subcomando, resto)
+
+
+if __name__ == "__main__":
+    main()
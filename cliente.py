@@ -0,0 +1,163 @@
+"""
+Cliente ligero del servicio de segmentación (servidor.py). Solo usa la biblioteca estándar: arranca en milisegundos.
+
+Flujo:
+1) Envía cada imagen (bytes, o solo la ruta con --por-ruta si el servidor ve el mismo disco) en una petición;
+   con varias imágenes las peticiones van en paralelo (--concurrencia) para que el servidor las agrupe en lotes.
+2) Imprime el nº de núcleos y, con --salida, guarda cada mapa de labels como `<salida>/<img>_etiquetas.npy`.
+3) --benchmark IMAGEN: compara la latencia de N llamadas al servicio (secuenciales y concurrentes) con N
+   ejecuciones en frío de `servidor.py --una IMAGEN` (intérprete + imports + segmentación).
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DIRECCION = "http://127.0.0.1:8765"
+CONCURRENCIA = 4
+
+
+class _ConexionUnix(http.client.HTTPConnection):
+    #HTTPConnection sobre un socket Unix
+    def __init__(self, ruta_socket: str):
+        super().__init__("localhost")
+        self.ruta_socket = ruta_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.ruta_socket)
+
+
+def _conexion(direccion: str) -> http.client.HTTPConnection:
+    #"unix:/ruta/socket" o "http://host:puerto"
+    if direccion.startswith("unix:"):
+        return _ConexionUnix(direccion[len("unix:"):])
+    host = direccion.removeprefix("http://").rstrip("/")
+    return http.client.HTTPConnection(host)
+
+
+def segmentar(imagen: Path, direccion: str = DIRECCION, por_ruta: bool = False):
+    #Segmenta una imagen en el servicio; devuelve (num_nucleos, info, bytes .npy del mapa de labels)
+    if por_ruta:
+        cuerpo = json.dumps({"ruta": str(Path(imagen).resolve())}).encode()
+        tipo = "application/json"
+    else:
+        cuerpo = Path(imagen).read_bytes()
+        tipo = "application/octet-stream"
+    conexion = _conexion(direccion)
+    try:
+        conexion.request("POST", "/segmentar", body=cuerpo, headers={"Content-Type": tipo})
+        respuesta = conexion.getresponse()
+        datos = respuesta.read()
+        if respuesta.status != 200:
+            raise RuntimeError(f"{respuesta.status}: {json.loads(datos).get('error', datos[:200])}")
+        return int(respuesta.getheader("X-Num-Nucleos")), json.loads(respuesta.getheader("X-Info")), datos
+    finally:
+        conexion.close()
+
+
+def estado(direccion: str = DIRECCION) -> dict:
+    #Estado del servicio (GET /estado)
+    conexion = _conexion(direccion)
+    try:
+        conexion.request("GET", "/estado")
+        return json.loads(conexion.getresponse().read())
+    finally:
+        conexion.close()
+
+
+def _percentiles(tiempos: list[float]) -> str:
+    ordenados = sorted(tiempos)
+    p95 = ordenados[min(len(ordenados) - 1, round(0.95 * (len(ordenados) - 1)))]
+    return f"p50 {statistics.median(ordenados) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms"
+
+
+def benchmark(imagen: Path, direccion: str, repeticiones: int, concurrencia: int, por_ruta: bool):
+    #Latencia servicio (secuencial y concurrente) frente a ejecuciones en frío de la CLI
+    servidor_py = Path(__file__).with_name("servidor.py")
+    print(f"Benchmark con {imagen.name}, {repeticiones} repeticiones\n")
+
+    frio = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, str(servidor_py), "--una", str(imagen)], check=True, capture_output=True)
+        frio.append(time.perf_counter() - inicio)
+    print(f"CLI en frío (servidor.py --una): {_percentiles(frio)}")
+
+    segmentar(imagen, direccion, por_ruta)  # conexión/caché del SO ya calientes
+    servicio = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        segmentar(imagen, direccion, por_ruta)
+        servicio.append(time.perf_counter() - inicio)
+    print(f"Servicio, secuencial:           {_percentiles(servicio)}")
+
+    def llamada(_):
+        inicio = time.perf_counter()
+        segmentar(imagen, direccion, por_ruta)
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        concurrentes = list(pool.map(llamada, range(repeticiones)))
+    total = time.perf_counter() - inicio
+    print(f"Servicio, {concurrencia} concurrentes:      {_percentiles(concurrentes)}   ({repeticiones / total:.1f} img/s)")
+    print(f"\nAceleración p50 servicio vs frío: x{statistics.median(frio) / statistics.median(servicio):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cliente del servicio de segmentación (servidor.py)")
+    parser.add_argument("imagenes", nargs="*", help="Imágenes a segmentar")
+    parser.add_argument("--direccion", default=DIRECCION, help="http://host:puerto o unix:/ruta/al/socket")
+    parser.add_argument("--por-ruta", action="store_true", help="Envía la ruta en vez de los bytes (mismo disco)")
+    parser.add_argument("--salida", help="Carpeta donde guardar los mapas de labels (.npy)")
+    parser.add_argument("--concurrencia", type=int, default=CONCURRENCIA, help="Peticiones en paralelo")
+    parser.add_argument("--estado", action="store_true", help="Muestra el estado del servicio")
+    parser.add_argument("--benchmark", metavar="IMAGEN", help="Compara latencia del servicio con la CLI en frío")
+    parser.add_argument("--repeticiones", "-n", type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        if args.estado:
+            print(json.dumps(estado(args.direccion), indent=2))
+            return
+        if args.benchmark:
+            benchmark(Path(args.benchmark), args.direccion, args.repeticiones, args.concurrencia, args.por_ruta)
+            return
+    except (ConnectionError, FileNotFoundError) as e:
+        print(f"ERROR: no se pudo conectar con el servicio en {args.direccion} ({e}). ¿Está arrancado servidor.py?")
+        sys.exit(1)
+
+    if not args.imagenes:
+        parser.error("indica al menos una imagen (o --estado / --benchmark)")
+    carpeta = Path(args.salida) if args.salida else None
+    if carpeta is not None:
+        carpeta.mkdir(parents=True, exist_ok=True)
+
+    rutas = [Path(r) for r in args.imagenes]
+    errores = 0
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        futuros = [pool.submit(segmentar, ruta, args.direccion, args.por_ruta) for ruta in rutas]
+        for ruta, futuro in zip(rutas, futuros):
+            try:
+                num_nucleos, info, datos = futuro.result()
+            except Exception as e:
+                print(f"{ruta.name}: ERROR {e}")
+                errores += 1
+                continue
+            print(f"{ruta.name}: {num_nucleos} núcleos (filtro={info['metodo']} thr={info['filtro']:.1f})")
+            if carpeta is not None:
+                (carpeta / f"{ruta.stem}_etiquetas.npy").write_bytes(datos)
+    if errores:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
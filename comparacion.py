@@ -0,0 +1,105 @@
+"""
+Comparación píxel a píxel predicción / GT compartida por evaluar.py y visualizar.py.
+
+Una sola pasada por imagen: mapa de códigos uint8 `pred*2 + gt`
+  0 = TN (fondo en ambos)   1 = FN (solo GT)   2 = FP (solo predicción)   3 = TP (ambos)
+- Conteos TP/FP/FN/TN (evaluar.py): un único bincount del mapa.
+- Imagen de diferencias (visualizar.py): tabla de 4 colores indexada con el mapa (COLORES_DIFERENCIAS).
+- Contornos GT / predicción: las dos binarias son bits del mapa.
+
+Caché por imagen en `visualizaciones/<img>/comparacion.npz`: el mapa de códigos y las huellas (tamaño, mtime) de la
+predicción y del GT de los que sale. evaluar.py la escribe al evaluar cada imagen y visualizar.py la reutiliza
+mientras ninguno de los dos archivos cambie, así que evaluar y visualizar el mismo lote decodifica y compara cada par
+una sola vez (visualizar solo vuelve a leer los PNG que dibuja). Con la caché, las diferencias y los contornos usan el
+mismo GT que las métricas (el rasterizado del XML, si evaluar.py lo usó). En memoria (ejecutar.py) el mapa pasa
+directamente de evaluar.evaluar_prediccion a visualizar.generar_visualizaciones.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import diferido
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+
+OUTPUT_DIR = "visualizaciones"
+CACHE = "comparacion.npz"           # en visualizaciones/<img>/
+TN, FN, FP, TP = 0, 1, 2, 3
+# Colores (BGR) por código: TN negro, FN rojo, FP azul, TP verde
+COLORES_DIFERENCIAS = ((0, 0, 0), (0, 0, 255), (255, 0, 0), (0, 255, 0))
+
+
+def binarizar_imagen(imagen: np.ndarray) -> np.ndarray:
+    #Convierte imagen coloreada a binaria (255 núcleos / 0 fondo)
+    # Convertir a escala de grises si es necesario
+    gray = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY) if imagen.ndim == 3 else imagen
+    # Umbral: cualquier píxel >1 se considera núcleo (255), resto fondo (0)
+    _, binaria = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+    return binaria
+
+
+def codificar(pred_binaria: np.ndarray, gt_binaria: np.ndarray) -> np.ndarray:
+    #Mapa de códigos pred*2 + gt (uint8); las binarias deben tener la misma forma
+    codigo = np.greater(pred_binaria, 0).view(np.uint8)
+    codigo <<= 1
+    codigo |= gt_binaria > 0
+    return codigo
+
+
+def conteos(codigo: np.ndarray):
+    #(tp, fp, fn, tn) del mapa de códigos con un único bincount
+    cuenta = np.bincount(codigo.ravel(), minlength=4)
+    return cuenta[TP], cuenta[FP], cuenta[FN], cuenta[TN]
+
+
+def imagen_diferencias(codigo: np.ndarray) -> np.ndarray:
+    #Mapa BGR de diferencias: un color por código (COLORES_DIFERENCIAS)
+    # np.take con axis=0 es ~2.5 veces más rápido que el indexado avanzado (tabla[codigo]) para el mismo resultado
+    return np.take(np.asarray(COLORES_DIFERENCIAS, dtype=np.uint8), codigo, axis=0)
+
+
+def binarias(codigo: np.ndarray):
+    #(pred_binaria, gt_binaria) 0/255 a partir del mapa de códigos
+    return np.multiply(codigo >> 1, 255, dtype=np.uint8), np.multiply(codigo & 1, 255, dtype=np.uint8)
+
+
+def huella_archivo(ruta: Path):
+    #[tamaño, mtime_ns] del archivo o None si no existe
+    try:
+        estado = Path(ruta).stat()
+    except FileNotFoundError:
+        return None
+    return [estado.st_size, estado.st_mtime_ns]
+
+
+def ruta_cache(nombre_imagen: str) -> Path:
+    return Path(OUTPUT_DIR) / Path(nombre_imagen).stem / CACHE
+
+
+def guardar(nombre_imagen: str, codigo: np.ndarray, ruta_pred: Path, ruta_gt: Path):
+    #Guarda el mapa de códigos de la imagen con las huellas de la predicción y el GT de los que sale (atómico)
+    destino = ruta_cache(nombre_imagen)
+    if not destino.parent.is_dir():
+        return
+    entradas = {str(ruta): huella_archivo(ruta) for ruta in (ruta_pred, ruta_gt)}
+    temporal = destino.with_name(f"{CACHE}.{os.getpid()}.tmp")
+    with open(temporal, "wb") as f:
+        np.savez_compressed(f, codigo=codigo, entradas=json.dumps(entradas))
+    os.replace(temporal, destino)
+
+
+def cargar(nombre_imagen: str) -> np.ndarray | None:
+    #Mapa de códigos en caché de la imagen, o None si no existe o su predicción / GT han cambiado
+    try:
+        with np.load(ruta_cache(nombre_imagen)) as datos:
+            entradas = json.loads(str(datos["entradas"]))
+            codigo = datos["codigo"]
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+    if any(huella_archivo(ruta) != huella for ruta, huella in entradas.items()):
+        return None
+    return codigo
@@ -0,0 +1,108 @@
+"""
+Entrada H&E en RGB: canal de hematoxilina (H) por deconvolución de color, sin pasada de preprocesado aparte.
+
+Flujo (segmentar.cargar_imagen con ENTRADA = "he", `segmentar.py --entrada he`):
+1) Lee el escaneo RGB (cv2, BGR).
+2) Densidad óptica por canal OD = -ln((I + 1) / 256) y concentración de H = OD · columna H de la inversa de la matriz
+   de tinciones (VECTORES_TINCION, Ruifrok y Johnston; filas normalizadas). Como la concentración es lineal en las
+   tres OD, se precalcula una tabla de 256 valores por canal (OD × peso) y cada píxel cuesta tres np.take y dos sumas.
+3) Vuelve a intensidad como si el portaobjetos solo tuviera hematoxilina, I_H = 256·exp(-OD_H) - 1 (recortada a
+   0..255, uint8): núcleos oscuros sobre fondo claro, igual que las imágenes H ya extraídas, así que el resultado
+   entra tal cual en detectar_modas_hist / pipeline_watershed.
+Todo va por bloques de filas (ELEMENTOS_BLOQUE píxeles), así que los temporales float32 no dependen del tamaño
+de la imagen; la salida se puede escribir directamente en un memmap.
+
+Caché opcional (`--cache-h`): el canal H de cada imagen en `<carpeta>/<clave>.npy`, abierto como memmap en las
+siguientes ejecuciones. La clave es el hash de la ruta, tamaño y mtime de la imagen, los vectores de tinción y
+VERSION_DECONVOLUCION; el .npy se escribe bloque a bloque en un temporal y se renombra al terminar.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import diferido
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+
+# Vectores de tinción (RGB) de Ruifrok y Johnston, los mismos que skimage.color.rgb2hed
+VECTORES_TINCION = (
+    (0.65, 0.70, 0.29),     # Hematoxilina
+    (0.07, 0.99, 0.11),     # Eosina
+    (0.27, 0.57, 0.78),     # DAB (tercer vector para completar la base)
+)
+ELEMENTOS_BLOQUE = 1 << 20  # Píxeles por bloque de filas
+CACHE_DIR = ".cache_canal_h"
+VERSION_DECONVOLUCION = 1   # Subirla al cambiar la conversión invalida la caché del canal H
+
+
+@functools.lru_cache(maxsize=None)
+def _tablas_bgr():
+    #Tablas (B, G, R) de 256 valores float32: contribución de cada nivel de intensidad a la concentración de H
+    tinciones = np.asarray(VECTORES_TINCION, dtype=np.float64)
+    tinciones /= np.linalg.norm(tinciones, axis=1, keepdims=True)
+    pesos_h = np.linalg.inv(tinciones)[:, 0]            # OD (R, G, B) -> concentración de H
+    densidad = -np.log((np.arange(256) + 1.0) / 256.0)
+    return tuple((densidad * peso).astype(np.float32) for peso in pesos_h[::-1])
+
+
+def canal_h(imagen_bgr: np.ndarray, salida: np.ndarray | None = None, elementos_bloque: int = ELEMENTOS_BLOQUE) -> np.ndarray:
+    #Canal H (uint8, núcleos oscuros) de una imagen H&E BGR uint8; `salida` puede ser un memmap (H×W uint8)
+    alto, ancho = imagen_bgr.shape[:2]
+    if salida is None:
+        salida = np.empty((alto, ancho), dtype=np.uint8)
+    tabla_b, tabla_g, tabla_r = _tablas_bgr()
+    filas = max(1, elementos_bloque // max(ancho, 1))
+    for f0 in range(0, alto, filas):
+        bloque = imagen_bgr[f0:f0 + filas]
+        concentracion = np.take(tabla_b, bloque[..., 0])
+        concentracion += np.take(tabla_g, bloque[..., 1])
+        concentracion += np.take(tabla_r, bloque[..., 2])
+        # Concentraciones negativas (ruido, píxeles sin H) = fondo
+        np.maximum(concentracion, 0, out=concentracion)
+        np.negative(concentracion, out=concentracion)
+        np.exp(concentracion, out=concentracion)
+        concentracion *= 256
+        concentracion -= 0.5                            # -1 y +0.5 para redondear al truncar
+        np.clip(concentracion, 0, 255, out=concentracion)
+        salida[f0:f0 + filas] = concentracion
+    return salida
+
+
+def clave_cache(ruta: Path) -> str:
+    #Hash de ruta, tamaño y mtime de la imagen + vectores de tinción y versión de la conversión
+    estado = ruta.stat()
+    datos = [str(ruta.resolve()), estado.st_size, estado.st_mtime_ns, VECTORES_TINCION, VERSION_DECONVOLUCION]
+    return hashlib.sha256(json.dumps(datos).encode()).hexdigest()
+
+
+def canal_h_en_cache(ruta: Path, imagen_bgr: np.ndarray, carpeta: Path) -> np.ndarray:
+    #Canal H desde la caché (memmap de solo lectura); si no está, lo calcula escribiendo directamente en el memmap
+    destino = Path(carpeta) / f"{clave_cache(ruta)}.npy"
+    try:
+        return np.load(destino, mmap_mode="r")
+    except (FileNotFoundError, ValueError, OSError):
+        pass
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_name(f"{destino.stem}.{os.getpid()}.tmp.npy")
+    salida = np.lib.format.open_memmap(temporal, mode="w+", dtype=np.uint8, shape=imagen_bgr.shape[:2])
+    canal_h(imagen_bgr, salida)
+    salida.flush()
+    del salida
+    os.replace(temporal, destino)
+    return np.load(destino, mmap_mode="r")
+
+
+def cargar_he(ruta_imagen: str, carpeta_cache: Path | None = None):
+    #Lee un escaneo H&E; devuelve (color BGR, canal H en gris) como segmentar.cargar_imagen
+    imagen_color = cv2.imread(ruta_imagen)
+    if imagen_color is None:
+        raise FileNotFoundError(f"No se pudo leer la imagen: {ruta_imagen}")
+    if carpeta_cache is None:
+        return imagen_color, canal_h(imagen_color)
+    return imagen_color, canal_h_en_cache(Path(ruta_imagen), imagen_color, carpeta_cache)
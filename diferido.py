@@ -0,0 +1,50 @@
+"""
+Imports diferidos de las dependencias pesadas (numpy, OpenCV, scipy, scikit-image, pandas).
+
+Uso en los módulos del pipeline, en lugar de `import numpy as np`:
+    np = diferido.modulo("numpy")
+    signal = diferido.modulo("scipy.signal")
+El módulo real se importa la primera vez que se accede a uno de sus atributos (`np.zeros`), no al importar el
+script: `python cli.py listar` o `segmentar.py --help` arrancan sin cargar ninguna de ellas, y `segmentar.py` con
+todas las imágenes en caché no llega a importar scikit-image ni scipy.signal.
+Las anotaciones de tipo (`np.ndarray`) no fuerzan la carga porque esos módulos usan
+`from __future__ import annotations`.
+Solo para bibliotecas de terceros: los atributos se guardan en el proxy tras el primer acceso, así que no se ven
+cambios posteriores en los globales del módulo real.
+"""
+
+import importlib
+import importlib.util
+
+
+class ModuloDiferido:
+    #Proxy de un módulo que se importa en el primer acceso a un atributo
+
+    def __init__(self, nombre: str):
+        self.__dict__["_nombre"] = nombre
+        self.__dict__["_modulo"] = None
+
+    def __getattr__(self, atributo: str):
+        # Solo se llama para atributos que aún no están en el proxy
+        if self._modulo is None:
+            self.__dict__["_modulo"] = importlib.import_module(self._nombre)
+        valor = getattr(self._modulo, atributo)
+        self.__dict__[atributo] = valor
+        return valor
+
+    def __repr__(self):
+        estado = "cargado" if self._modulo is not None else "sin cargar"
+        return f"<módulo diferido {self._nombre!r} ({estado})>"
+
+
+def modulo(nombre: str) -> ModuloDiferido:
+    #Proxy del módulo `nombre`; no lo importa hasta que se use
+    return ModuloDiferido(nombre)
+
+
+def disponible(nombre: str) -> bool:
+    #True si el módulo (opcional) está instalado, sin importarlo
+    try:
+        return importlib.util.find_spec(nombre) is not None
+    except ModuleNotFoundError:
+        return False
@@ -0,0 +1,192 @@
+"""
+Pipeline completo en memoria: segmentación -> evaluación -> visualización.
+
+Flujo por imagen:
+1) Segmenta la imagen H (`segmentar.segmentar_en_memoria`) sin escribir PNG intermedios.
+2) Evalúa directamente con el mapa de labels en memoria (`evaluar.evaluar_prediccion`).
+3) Genera las visualizaciones con la máscara, el mapa de distancia y la coloreada en memoria (si hay GT coloreado).
+4) Al final escribe `resultados.csv`, `evaluacion.csv` y el resumen global.
+
+Los PNG intermedios (`1_original_gris.png` ... `4_coloreada.png` + `4_etiquetas.npz`) solo se escriben con
+--guardar-intermedios (necesarios si luego se quiere ejecutar `evaluar.py`/`visualizar.py` por separado).
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import entrada_salida
+import evaluar
+import perfil
+import segmentar
+import semillas
+import visualizar
+
+
+def procesar_en_memoria(ruta: Path, guardar_intermedios: bool = False, generar_visualizacion: bool = True):
+    #Segmenta, evalúa y visualiza una imagen; devuelve (fila resultados.csv, métricas o None)
+    # Con --profile la fila lleva además los registros de las etapas de esta imagen ("perfil")
+    perfil.imagen(ruta.name)
+    with perfil.etapa("total"):
+        fila, metricas = _procesar_en_memoria(ruta, guardar_intermedios, generar_visualizacion)
+    if perfil.ACTIVO:
+        fila["perfil"] = perfil.recoger()
+    return fila, metricas
+
+
+def _procesar_en_memoria(ruta: Path, guardar_intermedios: bool, generar_visualizacion: bool):
+    seg = segmentar.segmentar_en_memoria(ruta)
+    if guardar_intermedios:
+        with perfil.etapa("escritura"):
+            segmentar.guardar_resultados(
+                ruta.name, seg["imagen_original"], seg["imagen_gris"], seg["mask"], seg["distance"],
+                seg["imagen_coloreada"], seg["etiquetas"], seg["fila"]["num_nucleos"],
+            )
+
+    # GT: XML (vértices) y/o PNG coloreado; el PNG se decodifica una sola vez para evaluación y visualización
+    ruta_gt = Path(evaluar.GT_COLORS_DIR) / ruta.name
+    ruta_xml = Path(evaluar.XML_DIR) / f"{ruta.stem}.xml"
+    if not ruta_gt.exists() and not ruta_xml.exists():
+        return seg["fila"], None
+    gt_color = None
+    if ruta_gt.exists():
+        with perfil.etapa("lectura_gt"):
+            gt_color = cv2.imread(str(ruta_gt))
+
+    pred_binaria = np.where(seg["etiquetas"] > 0, 255, 0).astype(np.uint8)
+    metricas = evaluar.evaluar_prediccion(ruta.name, pred_binaria, seg["etiquetas"], gt_color, devolver_codigo=True)
+    # Mapa de códigos pred*2+gt: se compara una sola vez para las métricas y las diferencias/contornos
+    codigo = metricas.pop("comparacion")[0] if metricas else None
+
+    # Las visualizaciones muestran el GT coloreado: sin el PNG solo se evalúa
+    if generar_visualizacion and gt_color is not None:
+        mask_vis, dist_vis_color = segmentar.preparar_intermedios(seg["mask"], seg["distance"])
+        visualizar.generar_visualizaciones(
+            ruta.name, seg["imagen_gris"], mask_vis, dist_vis_color, seg["imagen_coloreada"], pred_binaria, gt_color,
+            codigo,
+        )
+    return seg["fila"], metricas
+
+
+def ejecutar_lote(workers: int = 1, guardar_intermedios: bool = False, generar_visualizacion: bool = True, traza: Path | None = None):
+    #Procesa todo INPUT_DIR en memoria y escribe los CSV finales
+    # Con la instrumentación activa escribe la traza por etapa en `traza` y muestra el resumen
+    imagenes = segmentar.listar_entradas()
+    if not imagenes:
+        print(f"ERROR: No se encontraron imágenes en {segmentar.INPUT_DIR}")
+        return
+
+    print(f"Procesando {len(imagenes)} imágenes (segmentación + evaluación en memoria)...")
+    filas, metricas, registros = [], [], []
+    fallos = 0
+    inicio = time.perf_counter()
+
+    # En paralelo, un worker que muere solo hace fallar su imagen (ver segmentar.mapear_en_pool)
+    salidas = (
+        segmentar.mapear_en_pool(
+            workers, procesar_en_memoria, [(ruta, guardar_intermedios, generar_visualizacion) for ruta in imagenes]
+        )
+        if workers > 1 else None
+    )
+    try:
+        for i, ruta in enumerate(imagenes, 1):
+            print(f"[{i}/{len(imagenes)}] {ruta.name}...", end=" ", flush=True)
+            try:
+                if salidas is not None:
+                    salida, error = next(salidas)
+                    if error is not None:
+                        raise error
+                    fila, resultado = salida
+                else:
+                    fila, resultado = procesar_en_memoria(ruta, guardar_intermedios, generar_visualizacion)
+                fila.pop("info")
+                registros.extend(fila.pop("perfil", []))
+                filas.append(fila)
+                if resultado:
+                    metricas.append(resultado)
+                    print(f"OK ({fila['num_nucleos']} núcleos, F1: {resultado['f1']:.3f})")
+                else:
+                    print(f"OK ({fila['num_nucleos']} núcleos, sin GT: no evaluado)")
+
+            except Exception as e:
+                fallos += 1
+                print(f"ERROR: {e}")
+    finally:
+        if salidas is not None:
+            salidas.close()
+
+    perfil.imagen("")
+    if filas:
+        with perfil.etapa("escritura_csv"):
+            segmentar.guardar_csv(filas)
+            if metricas:
+                evaluar.guardar_evaluacion(metricas)
+    else:
+        print(f"Ninguna imagen se procesó: no se reescriben {segmentar.RESULTADOS_CSV} ni {evaluar.OUTPUT_CSV}")
+    duracion = time.perf_counter() - inicio
+    print(f"{len(filas)} imágenes en {duracion:.1f}s ({len(filas) / duracion:.2f} img/s, workers={workers}), {fallos} fallidas")
+
+    if not metricas:
+        print("No se evaluó ninguna imagen correctamente.")
+    else:
+        evaluar.mostrar_resumen(evaluar.acumular(metricas))
+
+    if perfil.ACTIVO:
+        registros.extend(perfil.recoger())
+        perfil.escribir_traza(registros, traza or perfil.TRAZA_POR_DEFECTO)
+        perfil.mostrar_resumen(registros)
+        print(f"Traza por etapa guardada en: {traza or perfil.TRAZA_POR_DEFECTO}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segmenta, evalúa y visualiza todo el lote sin PNG intermedios")
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1,
+        help="Procesos en paralelo (1 = secuencial, 0 = todos los núcleos de CPU)",
+    )
+    parser.add_argument(
+        "--guardar-intermedios", action="store_true",
+        help="Escribe también 1_original_gris.png ... 4_coloreada.png y 4_etiquetas.npz",
+    )
+    parser.add_argument("--sin-visualizar", action="store_true", help="No genera las visualizaciones")
+    parser.add_argument(
+        "--png-compresion", type=int, choices=range(10), default=entrada_salida.COMPRESION_PNG, metavar="0-9",
+        help="Nivel de compresión de los PNG (0 = rápido y grande, 9 = lento y pequeño; por defecto el de OpenCV)",
+    )
+    parser.add_argument(
+        "--profile", nargs="?", const=perfil.TRAZA_POR_DEFECTO, metavar="TRAZA",
+        help=f"Mide tiempo/CPU/memoria por etapa e imagen y los escribe en TRAZA (.jsonl o .csv; por defecto {perfil.TRAZA_POR_DEFECTO})",
+    )
+    parser.add_argument(
+        "--piramide", type=int, default=segmentar.FACTOR_PIRAMIDE, metavar="FACTOR",
+        help="Segmentación grueso a fino con la imagen reducida FACTOR veces (1 = desactivado)",
+    )
+    parser.add_argument(
+        "--semillas", choices=list(semillas.DETECTORES), default=segmentar.DETECTOR_SEMILLAS,
+        help="Detector de semillas del watershed (semillas.py)",
+    )
+    parser.add_argument(
+        "--baja-memoria", action="store_true",
+        help="Distancias float32, labels con el dtype entero mínimo y sin copias intermedias (menos RAM por worker)",
+    )
+    args = parser.parse_args()
+    if args.piramide < 1:
+        parser.error("--piramide debe ser >= 1")
+
+    segmentar.FACTOR_PIRAMIDE = args.piramide
+    segmentar.DETECTOR_SEMILLAS = args.semillas
+    segmentar.BAJA_MEMORIA = args.baja_memoria
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    if args.profile:
+        perfil.activar()
+    entrada_salida.COMPRESION_PNG = args.png_compresion
+    Path(segmentar.OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    ejecutar_lote(workers, args.guardar_intermedios, not args.sin_visualizar, args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+E/S solapada con el cálculo para los bucles del lote.
+
+Flujo:
+1) `leer_por_adelantado`: un pool de hilos decodifica las PREFETCH imágenes siguientes mientras se procesa la actual
+   (cv2.imread/imwrite y zlib liberan el GIL, así que los hilos solapan de verdad con numpy/scikit-image).
+2) El bucle principal calcula sobre la imagen ya cargada.
+3) `EscritorFondo`: otro pool de hilos codifica y escribe los PNG. Como mucho MAX_PENDIENTES tareas en cola: si el
+   disco va más lento que el cálculo, `enviar()` se bloquea (contrapresión) y la memoria queda acotada.
+
+COMPRESION_PNG (0-9, None = valor por defecto de OpenCV) permite cambiar tamaño en disco por velocidad de escritura.
+"""
+
+import contextlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import diferido
+
+cv2 = diferido.modulo("cv2")
+
+PREFETCH = 2                # Imágenes leídas por adelantado
+HILOS_ESCRITURA = 2         # Hilos que codifican/escriben PNG
+MAX_PENDIENTES = 4          # Tareas de escritura en cola como máximo (contrapresión)
+COMPRESION_PNG = None       # 0 (rápido, grande) .. 9 (lento, pequeño); None = por defecto de OpenCV
+
+
+def parametros_png() -> list:
+    #Parámetros de cv2.imwrite para el nivel de compresión configurado
+    return [] if COMPRESION_PNG is None else [cv2.IMWRITE_PNG_COMPRESSION, int(COMPRESION_PNG)]
+
+
+def escribir_png(ruta, imagen):
+    #cv2.imwrite con la compresión configurada; lanza excepción si no se pudo escribir
+    if not cv2.imwrite(str(ruta), imagen, parametros_png()):
+        raise OSError(f"No se pudo escribir: {ruta}")
+
+
+def leer_por_adelantado(elementos, funcion_lectura, prefetch: int = PREFETCH, pool=None):
+    #Genera (elemento, resultado, error) en orden; mantiene `prefetch` lecturas en curso por delante del consumidor
+    # error es la excepción de funcion_lectura (resultado None) para que el bucle decida qué hacer con ella
+    # pool: ejecutor ya creado (p. ej. un ProcessPoolExecutor) en vez del pool de hilos propio; la ventana de
+    # `prefetch` tareas acota igualmente cuántos resultados hay en memoria
+    elementos = list(elementos)
+    if prefetch <= 0:
+        for elemento in elementos:
+            try:
+                yield elemento, funcion_lectura(elemento), None
+            except Exception as e:
+                yield elemento, None, e
+        return
+
+    with contextlib.nullcontext(pool) if pool is not None else ThreadPoolExecutor(max_workers=prefetch) as pool:
+        en_curso = deque()
+        siguiente = 0
+        while siguiente < len(elementos) or en_curso:
+            while siguiente < len(elementos) and len(en_curso) < prefetch:
+                en_curso.append((elementos[siguiente], pool.submit(funcion_lectura, elementos[siguiente])))
+                siguiente += 1
+            elemento, futuro = en_curso.popleft()
+            try:
+                yield elemento, futuro.result(), None
+            except Exception as e:
+                yield elemento, None, e
+
+
+class EscritorFondo:
+    #Pool de escritura en segundo plano con cola acotada; usar como contexto (`with EscritorFondo() as escritor:`)
+
+    def __init__(self, hilos: int = HILOS_ESCRITURA, max_pendientes: int = MAX_PENDIENTES):
+        self._pool = ThreadPoolExecutor(max_workers=hilos)
+        self._huecos = threading.BoundedSemaphore(max_pendientes)
+        self._errores = []
+        self._cerrojo = threading.Lock()
+
+    def enviar(self, etiqueta: str, funcion, *args):
+        #Encola funcion(*args); bloquea si ya hay max_pendientes tareas sin terminar
+        self._huecos.acquire()
+        futuro = self._pool.submit(funcion, *args)
+        futuro.add_done_callback(lambda f: self._terminada(etiqueta, f))
+
+    def _terminada(self, etiqueta: str, futuro):
+        self._huecos.release()
+        if futuro.exception() is not None:
+            with self._cerrojo:
+                self._errores.append((etiqueta, futuro.exception()))
+
+    def cerrar(self) -> list:
+        #Espera a que terminen todas las escrituras; devuelve [(etiqueta, excepción)] de las que fallaron
+        self._pool.shutdown(wait=True)
+        return self._errores
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        for etiqueta, error in self._errores:
+            print(f"ERROR escribiendo {etiqueta}: {error}")
+        return False
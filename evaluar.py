@@ -2,25 +2,71 @@
 Evaluación cuantitativa de segmentaciones (V3.3 final).
 
 Flujo por imagen:
-1) Carga predicción coloreada (`visualizaciones/<img>/4_coloreada.png`) y GT coloreado.
+1) Carga predicción (mapa de labels `visualizaciones/<img>/4_etiquetas.npz`, o `4_coloreada.png` si no existe) y GT:
+   labels rasterizados desde los vértices de las regiones del XML (gt_xml.py, con caché en `.cache_gt/`) o, si el XML
+   no tiene vértices (o con --gt-png), el GT coloreado. Con --paquete, ambos (y las regiones del XML) son vistas del
+   paquete del lote (paquete.py) para las imágenes que estén en él.
 2) Binariza ambos y ajusta tamaño si difiere.
-3) Calcula métricas píxel a píxel (F1, IoU, precisión, recall, accuracy).
-4) Obtiene conteo/áreas GT desde XML y conteo pred por CC.
-5) Agrega métricas por imagen y genera `evaluacion.csv` con resumen global.
+3) Calcula métricas píxel a píxel (F1, IoU, precisión, recall, accuracy) desde el mapa de códigos pred*2+gt de
+   comparacion.py, que se guarda en `visualizaciones/<img>/comparacion.npz` para visualizar.py.
+4) Obtiene conteo/áreas GT desde XML y conteo pred por labels (o por CC sobre la coloreada).
+5) Métricas por instancia (AJI, PQ y F1 de detección por umbral de IoU) desde una tabla de contingencia
+   dispersa entre labels pred y labels GT (instancias GT = regiones del XML, o regiones conectadas de un mismo
+   color en el GT coloreado).
+6) Escribe `evaluacion.csv` y el resumen global, acumulado en streaming (AcumuladorMetricas): medias por imagen
+   (macro), TP/FP/FN/TN sumados (micro) e intervalos de confianza bootstrap sobre los valores por imagen.
+
+Incremental: solo se reevalúan las imágenes cuya predicción o GT ha cambiado (tamaño/mtime, guardados en
+HUELLAS_JSON) desde el último `evaluacion.csv`; el resto conserva su fila. --todas las reevalúa todas y
+--workers N reparte las imágenes entre N procesos.
+
+Con --piramide 1,2,4 compara en su lugar los factores del modo pirámide de segmentar.py: segmenta cada imagen de
+entrada con cada factor (en memoria, sin caché), la evalúa y muestra tiempo por imagen, aceleración y métricas por
+factor (detalle por imagen en `piramide.csv`), para elegir el factor de cada escáner.
 """
 
+from __future__ import annotations
+
+import argparse
 import csv
-import xml.etree.ElementTree as ET
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import cv2
-import numpy as np
+import comparacion
+import diferido
+import gt_xml
+import paquete
+import perfil
+import segmentar
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+measure = diferido.modulo("skimage.measure")
 
 XML_DIR = "Material Celulas/xml"
 GT_COLORS_DIR = "Material Celulas/gt_colors"
 OUTPUT_DIR = "visualizaciones"
 RESULTADOS_CSV = "resultados.csv"  # entrada: lista de imágenes procesadas
 OUTPUT_CSV = "evaluacion.csv"      # salida: métricas por imagen
+UMBRALES_IOU = (0.5, 0.75)         # umbrales de IoU para el F1 de detección por instancia
+GT_DESDE_XML = True                # GT por instancia rasterizado desde los vértices del XML (si los tiene)
+PAQUETE = None                     # Carpeta del paquete del lote (paquete.py) con GT y XML; None = archivos sueltos
+PIRAMIDE_CSV = "piramide.csv"      # salida de --piramide: tiempo y métricas por imagen y factor
+REPETICIONES_PIRAMIDE = 3          # segmentaciones por imagen y factor (se toma el tiempo mínimo)
+HUELLAS_JSON = ".huellas_evaluacion.json"  # tamaño/mtime de las entradas de cada fila de evaluacion.csv
+VERSION_EVALUACION = 1             # subirla al cambiar las métricas invalida las filas de evaluaciones anteriores
+
+# Resumen global: intervalos de confianza bootstrap (percentil) sobre los valores por imagen
+METRICAS_IC = ("f1", "iou", "aji", "pq", "precision_conteo")
+CONFUSION = ("tp", "fp", "fn", "tn")
+REMUESTREOS_BOOTSTRAP = 1000
+NIVEL_CONFIANZA = 0.95
+SEMILLA_BOOTSTRAP = 0
+ELEMENTOS_BLOQUE = 4_000_000       # pesos (remuestreos x imágenes) generados de una vez en el bootstrap
 
 
 def cargar_ground_truth_xml(ruta_xml: Path):
@@ -28,41 +74,30 @@ def cargar_ground_truth_xml(ruta_xml: Path):
     if not ruta_xml.exists():
         return 0, []
     try:
-        tree = ET.parse(ruta_xml)
-        # Buscar todas las regiones (núcleos) en el XML
-        regiones = tree.getroot().findall(".//Region")
-        areas_gt = []
-        for region in regiones:
-            area_str = region.get("Area")
-            if area_str:
-                areas_gt.append(float(area_str))
+        # Regiones (núcleos) leídas en streaming; área del atributo Area (o del polígono si no lo tiene)
+        areas_gt = [area for area, _ in gt_xml.leer_regiones(ruta_xml) if area is not None]
         return len(areas_gt), areas_gt
     except Exception as e:
         print(f"Error al leer XML {ruta_xml}: {e}")
         return 0, []
 
 
-def binarizar_imagen(imagen: np.ndarray) -> np.ndarray:
-    #Convierte imagen coloreada a binaria (255 núcleos / 0 fondo)
-    # Convertir a escala de grises si es necesario
-    gray = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY) if imagen.ndim == 3 else imagen
-    # Umbral: cualquier píxel >1 se considera núcleo (255), resto fondo (0)
-    _, binaria = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-    return binaria
+def paquete_de(nombre_imagen: str):
+    #Paquete activo si contiene la imagen; None = leer los PNG / XML
+    if PAQUETE is None:
+        return None
+    datos = paquete.abrir(PAQUETE)
+    return datos if nombre_imagen in datos else None
 
 
-def calcular_metricas_pixel(pred_binaria: np.ndarray, gt_binaria: np.ndarray) -> dict:
-    #Calcula F1(Dice), IoU, precision, recall, accuracy a nivel píxel
-    # Normalizar a 0 y 1
-    pred = (pred_binaria > 0).astype(np.uint8)
-    gt = (gt_binaria > 0).astype(np.uint8)
+def calcular_metricas_pixel(codigo: np.ndarray) -> dict:
+    #Calcula F1(Dice), IoU, precision, recall, accuracy a nivel píxel desde el mapa de códigos pred*2+gt
+    # (comparacion.py): la matriz de confusión sale de un único bincount
+    return metricas_confusion(*comparacion.conteos(codigo))
 
-    # Calcular matriz de confusión píxel a píxel
-    tp = np.sum((pred == 1) & (gt == 1))  # True Positives: detectado y es núcleo
-    fp = np.sum((pred == 1) & (gt == 0))  # False Positives: detectado pero es fondo
-    fn = np.sum((pred == 0) & (gt == 1))  # False Negatives: no detectado pero es núcleo
-    tn = np.sum((pred == 0) & (gt == 0))  # True Negatives: no detectado y es fondo
 
+def metricas_confusion(tp, fp, fn, tn) -> dict:
+    #F1(Dice), IoU, precision, recall y accuracy a partir de los conteos de la matriz de confusión
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
     recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
     f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0.0
@@ -82,40 +117,199 @@ def calcular_metricas_pixel(pred_binaria: np.ndarray, gt_binaria: np.ndarray) ->
     }
 
 
-def evaluar_imagen(nombre_imagen: str) -> dict | None:
+def etiquetas_desde_color(imagen_color: np.ndarray) -> np.ndarray:
+    #Instancias de una imagen coloreada: cada región conectada de un mismo color (fondo negro = 0)
+    if imagen_color.ndim == 2:
+        return measure.label(imagen_color > 1)
+    color = imagen_color.astype(np.int32)
+    codigo = (color[..., 0] << 16) | (color[..., 1] << 8) | color[..., 2]
+    codigo[cv2.cvtColor(imagen_color, cv2.COLOR_BGR2GRAY) <= 1] = 0  # mismo criterio que comparacion.binarizar_imagen
+    return measure.label(codigo, background=0, connectivity=1)
+
+
+def redimensionar_etiquetas(etiquetas: np.ndarray, forma) -> np.ndarray:
+    #Reescala un mapa de labels por vecino más próximo (sin mezclar IDs)
+    filas = (np.arange(forma[0]) * etiquetas.shape[0] // forma[0])
+    cols = (np.arange(forma[1]) * etiquetas.shape[1] // forma[1])
+    return etiquetas[filas[:, None], cols]
+
+
+def _labels_consecutivos(etiquetas: np.ndarray):
+    #Renumera un mapa de labels a 0..N (0 = fondo) con una tabla de búsqueda; devuelve (array plano, N)
+    planos = etiquetas.ravel()
+    presentes = np.bincount(planos) > 0
+    presentes[0] = False
+    tabla = np.cumsum(presentes)
+    return tabla[planos], int(tabla[-1])
+
+
+def _emparejar(orden, iou, par_pred, par_gt, umbral):
+    #Emparejamiento 1 a 1 voraz por IoU descendente con IoU > umbral (con umbral >= 0.5 es único)
+    usados_pred, usados_gt, emparejados = set(), set(), []
+    for k in orden:
+        if iou[k] <= umbral:
+            break
+        p, g = par_pred[k], par_gt[k]
+        if p in usados_pred or g in usados_gt:
+            continue
+        usados_pred.add(p)
+        usados_gt.add(g)
+        emparejados.append(k)
+    return emparejados
+
+
+def calcular_metricas_instancia(etiquetas_pred: np.ndarray, etiquetas_gt: np.ndarray, umbrales_iou=UMBRALES_IOU) -> dict:
+    #AJI, PQ (SQ·DQ con IoU > 0.5) y precision/recall/F1 de detección para cada umbral de IoU
+    pred, num_pred = _labels_consecutivos(etiquetas_pred)
+    gt, num_gt = _labels_consecutivos(etiquetas_gt)
+
+    # Áreas por instancia (bincount) y tabla de contingencia dispersa: solo pares que se solapan
+    area_pred = np.bincount(pred, minlength=num_pred + 1).astype(np.int64)
+    area_gt = np.bincount(gt, minlength=num_gt + 1).astype(np.int64)
+    solape = (pred > 0) & (gt > 0)
+    pares, interseccion = np.unique(pred[solape].astype(np.int64) * (num_gt + 1) + gt[solape], return_counts=True)
+    par_pred, par_gt = np.divmod(pares, num_gt + 1)
+    union = area_pred[par_pred] + area_gt[par_gt] - interseccion
+    iou = interseccion / union
+
+    metricas = {}
+    orden = np.argsort(-iou, kind="stable")
+    for umbral in sorted(set(umbrales_iou) | {0.5}):
+        emparejados = _emparejar(orden, iou, par_pred, par_gt, umbral)
+        tp = len(emparejados)
+        f1 = 2 * tp / (num_pred + num_gt) if (num_pred + num_gt) > 0 else 0.0
+        if umbral in umbrales_iou:
+            sufijo = f"{round(umbral * 100):02d}"
+            metricas[f"det_precision_{sufijo}"] = tp / num_pred if num_pred > 0 else 0.0
+            metricas[f"det_recall_{sufijo}"] = tp / num_gt if num_gt > 0 else 0.0
+            metricas[f"det_f1_{sufijo}"] = f1
+        if umbral == 0.5:
+            # Panoptic quality: DQ = F1 de detección, SQ = IoU medio de los emparejados
+            sq = float(np.mean(iou[emparejados])) if emparejados else 0.0
+            metricas["sq"] = sq
+            metricas["dq"] = f1
+            metricas["pq"] = sq * f1
+
+    # AJI: cada GT con su pred de mayor IoU; GT sin pred y pred no usadas suman su área a la unión
+    interseccion_aji = union_aji = 0
+    pred_usada = np.zeros(num_pred + 1, dtype=bool)
+    gt_cubierto = np.zeros(num_gt + 1, dtype=bool)
+    if pares.size:
+        orden_gt = np.lexsort((-iou, par_gt))
+        primero = np.ones(orden_gt.size, dtype=bool)
+        primero[1:] = par_gt[orden_gt][1:] != par_gt[orden_gt][:-1]
+        mejores = orden_gt[primero]
+        interseccion_aji = int(interseccion[mejores].sum())
+        union_aji = int(union[mejores].sum())
+        pred_usada[par_pred[mejores]] = True
+        gt_cubierto[par_gt[mejores]] = True
+    union_aji += int(area_gt[1:][~gt_cubierto[1:]].sum()) + int(area_pred[1:][~pred_usada[1:]].sum())
+    aji = interseccion_aji / union_aji if union_aji > 0 else 0.0
+    return {"aji": aji, "pq": metricas.pop("pq"), "sq": metricas.pop("sq"), "dq": metricas.pop("dq"), **metricas}
+
+
+def evaluar_imagen(nombre_imagen: str, umbrales_iou=UMBRALES_IOU) -> dict | None:
     #Evalúa una imagen; retorna dict de métricas o None si falta algún archivo
     nombre_base = Path(nombre_imagen).stem
 
-    # 1) Cargar predicción (4_coloreada.png)
+    # 1) Cargar predicción: labels exactos (4_etiquetas.npz) o, si no existen, 4_coloreada.png
+    ruta_etiquetas = Path(OUTPUT_DIR) / nombre_base / "4_etiquetas.npz"
     ruta_pred = Path(OUTPUT_DIR) / nombre_base / "4_coloreada.png"
-    if not ruta_pred.exists():
+    etiquetas_pred = None
+    perfil.imagen(nombre_imagen)
+    if ruta_etiquetas.exists():
+        with perfil.etapa("lectura"):
+            etiquetas_pred = segmentar.cargar_etiquetas(ruta_etiquetas)
+            pred_binaria = np.where(etiquetas_pred > 0, 255, 0).astype(np.uint8)
+        ruta_pred = ruta_etiquetas
+    elif ruta_pred.exists():
+        with perfil.etapa("lectura"):
+            pred_color = cv2.imread(str(ruta_pred))
+            pred_binaria = comparacion.binarizar_imagen(pred_color)
+    else:
         print(f"No existe predicción para {nombre_imagen}")
         return None
-    pred_color = cv2.imread(str(ruta_pred))
-    pred_binaria = binarizar_imagen(pred_color)
 
-    # 2) Cargar ground truth coloreado
-    ruta_gt = Path(GT_COLORS_DIR) / nombre_imagen
-    if not ruta_gt.exists():
-        print(f"No existe GT para {nombre_imagen}")
+    resultado = evaluar_prediccion(nombre_imagen, pred_binaria, etiquetas_pred, umbrales_iou=umbrales_iou, devolver_codigo=True)
+    if resultado is None:
         return None
-    gt_color = cv2.imread(str(ruta_gt))
-    gt_binaria = binarizar_imagen(gt_color)
+    # El mapa de códigos queda en la caché de la imagen para visualizar.py
+    codigo, ruta_gt = resultado.pop("comparacion")
+    with perfil.etapa("cache_comparacion"):
+        comparacion.guardar(nombre_imagen, codigo, ruta_pred, ruta_gt)
+    return resultado
+
+
+def cargar_gt_imagen(nombre_imagen: str, forma):
+    #Ground truth del XML de una imagen: (etiquetas_gt o None, areas_gt)
+    # etiquetas_gt: labels rasterizados desde los vértices (con caché en disco, o del paquete) a `forma`; None si el
+    # XML no tiene vértices, no existe o se evalúa con --gt-png. areas_gt: áreas de sus regiones ([] sin XML)
+    # Se carga una vez por imagen y se pasa a evaluar_prediccion (barrido.py / ejecutar.py lo reutilizan)
+    ruta_xml = Path(XML_DIR) / f"{Path(nombre_imagen).stem}.xml"
+    datos = paquete_de(nombre_imagen)
+    if GT_DESDE_XML:
+        with perfil.etapa("lectura_gt"):
+            gt = datos.gt_xml(nombre_imagen, forma) if datos else gt_xml.cargar_gt(ruta_xml, forma)
+        if gt is not None:
+            return gt
+
+    # Sin vértices: solo el conteo y las áreas del XML
+    with perfil.etapa("lectura_xml"):
+        regiones = datos.regiones(nombre_imagen) if datos else None
+        if regiones is not None:
+            return None, [area for area, _ in regiones if area is not None]
+        return None, cargar_ground_truth_xml(ruta_xml)[1]
+
+
+def evaluar_prediccion(nombre_imagen: str, pred_binaria: np.ndarray, etiquetas_pred=None, gt_color=None, gt_instancias=None, umbrales_iou=UMBRALES_IOU, devolver_codigo: bool = False) -> dict | None:
+    #Evalúa una predicción ya en memoria (binaria y, si hay, mapa de labels); gt_color se lee de disco si es None
+    # gt_instancias: resultado de cargar_gt_imagen ya cargado (None = cargarlo aquí)
+    # devolver_codigo: el resultado lleva además "comparacion" = (mapa de códigos pred*2+gt, archivo del GT usado)
+    nombre_base = Path(nombre_imagen).stem
+    ruta_xml = Path(XML_DIR) / f"{nombre_base}.xml"
+    ruta_gt = Path(GT_COLORS_DIR) / nombre_imagen
+    datos = paquete_de(nombre_imagen)
+
+    # 2) Ground truth: labels rasterizados desde los vértices del XML (con caché en disco) o, si el XML no tiene
+    #    vértices, GT coloreado binarizado (instancias = regiones conectadas de un mismo color)
+    #    Con paquete, ambos salen de él y el archivo del que depende la comparación es su índice
+    if gt_instancias is None:
+        gt_instancias = cargar_gt_imagen(nombre_imagen, pred_binaria.shape)
+    etiquetas_gt, areas_gt = gt_instancias
+    if etiquetas_gt is not None:
+        gt_binaria = np.where(etiquetas_gt > 0, 255, 0).astype(np.uint8)
+        ruta_gt = datos.ruta_indice if datos else ruta_xml
+    else:
+        if gt_color is None and datos is not None:
+            gt_color = datos.leer(nombre_imagen, "gt")
+            ruta_gt = datos.ruta_indice
+        if gt_color is None:
+            if not ruta_gt.exists():
+                print(f"No existe GT para {nombre_imagen}")
+                return None
+            with perfil.etapa("lectura_gt"):
+                gt_color = cv2.imread(str(ruta_gt))
+        with perfil.etapa("binarizar_gt"):
+            gt_binaria = comparacion.binarizar_imagen(gt_color)
 
     # 3) Ajustar tamaño si difiere
     if pred_binaria.shape != gt_binaria.shape:
         pred_binaria = cv2.resize(pred_binaria, (gt_binaria.shape[1], gt_binaria.shape[0]))
 
-    # 4) Calcular métricas píxel a píxel
-    metricas = calcular_metricas_pixel(pred_binaria, gt_binaria)
+    # 4) Calcular métricas píxel a píxel (mapa de códigos pred*2+gt, compartido con visualizar.py)
+    with perfil.etapa("metricas_pixel"):
+        codigo = comparacion.codificar(pred_binaria, gt_binaria)
+        metricas = calcular_metricas_pixel(codigo)
 
-    # 5) Obtener conteo GT desde XML
-    ruta_xml = Path(XML_DIR) / f"{nombre_base}.xml"
-    num_nucleos_gt, areas_gt = cargar_ground_truth_xml(ruta_xml)
+    # 5) Conteo GT desde XML (ya leído con el GT)
+    num_nucleos_gt = len(areas_gt)
 
-    # 6) Contar núcleos predichos (componentes conectadas)
-    num_labels, _ = cv2.connectedComponents(pred_binaria)
-    num_nucleos_pred = max(num_labels - 1, 0)  # -1 porque label 0 es fondo
+    # 6) Contar núcleos predichos (labels distintos; sin mapa de labels, componentes conectadas)
+    if etiquetas_pred is not None:
+        num_nucleos_pred = int(np.count_nonzero(np.bincount(etiquetas_pred.ravel())[1:]))
+    else:
+        num_labels, _ = cv2.connectedComponents(pred_binaria)
+        num_nucleos_pred = max(num_labels - 1, 0)  # -1 porque label 0 es fondo
 
     # 7) Calcular áreas medias
     area_total_gt = areas_gt if areas_gt else [np.sum(gt_binaria > 0)]
@@ -126,7 +320,17 @@ def evaluar_imagen(nombre_imagen: str) -> dict | None:
     error_conteo_abs = abs(num_nucleos_pred - num_nucleos_gt)
     precision_conteo = 100 - (error_conteo_abs / num_nucleos_gt * 100) if num_nucleos_gt > 0 else 0.0
 
-    return {
+    # 9) Métricas por instancia (labels pred exactos si existen; si no, CC de la binaria)
+    with perfil.etapa("metricas_instancia"):
+        if etiquetas_pred is None:
+            etiquetas_pred = measure.label(pred_binaria > 0)
+        if etiquetas_pred.shape != gt_binaria.shape:
+            etiquetas_pred = redimensionar_etiquetas(etiquetas_pred, gt_binaria.shape)
+        if etiquetas_gt is None:
+            etiquetas_gt = etiquetas_desde_color(gt_color)
+        metricas_instancia = calcular_metricas_instancia(etiquetas_pred, etiquetas_gt, umbrales_iou)
+
+    resultado = {
         "nombre": nombre_imagen,
         **metricas,
         "num_nucleos_gt": num_nucleos_gt,
@@ -134,89 +338,363 @@ def evaluar_imagen(nombre_imagen: str) -> dict | None:
         "precision_conteo": precision_conteo,
         "area_media_gt": area_media_gt,
         "area_media_pred": area_media_pred,
+        **metricas_instancia,
     }
+    if devolver_codigo:
+        resultado["comparacion"] = (codigo, ruta_gt)
+    return resultado
 
 
-def evaluar_todas_imagenes():
+def evaluar_todas_imagenes(umbrales_iou=UMBRALES_IOU, traza: Path | None = None, workers: int = 1, incremental: bool = True):
     #Evalua todas las imágenes listadas en resultados.csv y guarda evaluacion.csv
+    # Incremental: las imágenes sin cambios en predicción ni GT desde el último evaluacion.csv conservan su fila
+    # Con workers > 1 las imágenes a evaluar van a un pool; las filas se escriben en el orden de resultados.csv
+    # Cada fila se escribe y se acumula en el resumen (AcumuladorMetricas) según llega, sin guardarlas en memoria
+    # Con la instrumentación activa escribe la traza por etapa en `traza` y muestra el resumen
     # 1) Verificar que existe resultados.csv (generado por segmentar.py)
     if not Path(RESULTADOS_CSV).exists():
         print(f"No existe {RESULTADOS_CSV}. Ejecuta primero la segmentación.")
         return
 
-    # 2) Leer lista de imágenes procesadas
+    # 2) Leer lista de imágenes procesadas y quedarse con las que han cambiado desde la última evaluación
     with open(RESULTADOS_CSV, "r") as f:
         imagenes = [row["Imagen"] for row in csv.DictReader(f)]
+    configuracion = configuracion_evaluacion(umbrales_iou)
+    previas, huellas_previas = cargar_evaluacion_previa(configuracion) if incremental else ({}, {})
+    huellas = {nombre: huella_entradas(nombre) for nombre in imagenes}
+    pendientes = [n for n in imagenes if n not in previas or huellas_previas.get(n) != huellas[n]]
+    print(f"Evaluando {len(pendientes)} de {len(imagenes)} imágenes ({len(imagenes) - len(pendientes)} sin cambios)...")
+
+    # 3) Evaluar las pendientes; escribir y acumular cada fila (nueva o conservada) en orden
+    pool = (
+        ProcessPoolExecutor(
+            max_workers=workers, initializer=inicializar_worker, initargs=(perfil.ACTIVO, GT_DESDE_XML, PAQUETE),
+        )
+        if workers > 1 and len(pendientes) > 1 else None
+    )
+    acumulado = AcumuladorMetricas()
+    huellas_escritas, registros = {}, []
+    temporal = Path(f"{OUTPUT_CSV}.{os.getpid()}.tmp")
+    try:
+        futuros = {n: pool.submit(_evaluar_imagen_perfil, n, umbrales_iou) for n in pendientes} if pool else {}
+        with open(temporal, "w", newline="") as f:
+            writer = None
+            i = 0
+            for nombre_imagen in imagenes:
+                if nombre_imagen in previas and huellas_previas.get(nombre_imagen) == huellas[nombre_imagen]:
+                    resultado = previas.pop(nombre_imagen)
+                else:
+                    i += 1
+                    print(f"[{i}/{len(pendientes)}] {nombre_imagen}...", end=" ", flush=True)
+                    try:
+                        if pool is not None:
+                            resultado, regs = futuros.pop(nombre_imagen).result()
+                        else:
+                            resultado, regs = _evaluar_imagen_perfil(nombre_imagen, umbrales_iou)
+                    except Exception as e:
+                        print(f"ERROR: {e}")
+                        continue
+                    registros.extend(regs)
+                    if not resultado:
+                        print("No evaluado.")
+                        continue
+                    print(f"F1: {resultado['f1']:.3f} AJI: {resultado['aji']:.3f} PQ: {resultado['pq']:.3f}")
+
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=campos_evaluacion(resultado))
+                    writer.writeheader()
+                writer.writerow(resultado)
+                acumulado.agregar(resultado)
+                huellas_escritas[nombre_imagen] = huellas[nombre_imagen]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if acumulado.n == 0:
+        temporal.unlink()
+        print("No se evaluó ninguna imagen correctamente.")
+        return
+
+    # 4) Publicar el CSV (reemplazo atómico) y las huellas de sus filas
+    os.replace(temporal, OUTPUT_CSV)
+    guardar_huellas(configuracion, huellas_escritas)
+
+    # 5) Mostrar resumen en consola
+    mostrar_resumen(acumulado)
+    if perfil.ACTIVO:
+        registros.extend(perfil.recoger())
+        perfil.escribir_traza(registros, traza or perfil.TRAZA_POR_DEFECTO)
+        perfil.mostrar_resumen(registros)
+        print(f"Traza por etapa guardada en: {traza or perfil.TRAZA_POR_DEFECTO}")
+
+
+def _evaluar_imagen_perfil(nombre_imagen: str, umbrales_iou):
+    #evaluar_imagen + los registros de sus etapas (también desde los procesos del pool)
+    resultado = evaluar_imagen(nombre_imagen, umbrales_iou)
+    return resultado, perfil.recoger() if perfil.ACTIVO else []
+
+
+def inicializar_worker(perfil_activo: bool, gt_desde_xml: bool, paquete_lote=None):
+    #Traslada a cada proceso del pool la configuración fijada desde la línea de comandos
+    global GT_DESDE_XML, PAQUETE
+    GT_DESDE_XML = gt_desde_xml
+    PAQUETE = paquete_lote
+    if perfil_activo:
+        perfil.activar()
 
-    # 3) Evaluar cada imagen y acumular resultados
-    print(f"Evaluando {len(imagenes)} imágenes...")
-    resultados = []
-    for i, nombre_imagen in enumerate(imagenes, 1):
-        print(f"[{i}/{len(imagenes)}] {nombre_imagen}...", end=" ")
-        resultado = evaluar_imagen(nombre_imagen)
-        if resultado:
-            resultados.append(resultado)
-            print(f"F1: {resultado['f1']:.3f}")
-        else:
+
+def configuracion_evaluacion(umbrales_iou) -> dict:
+    #Lo que, además de los archivos de entrada, determina las filas de evaluacion.csv
+    return {"umbrales_iou": list(umbrales_iou), "gt_desde_xml": GT_DESDE_XML, "version": VERSION_EVALUACION}
+
+
+def huella_entradas(nombre_imagen: str) -> list:
+    #Huellas de los archivos de los que depende la evaluación de una imagen (predicción y GT)
+    # Con paquete, el GT depende solo de su índice (cambia al volver a empaquetar)
+    nombre_base = Path(nombre_imagen).stem
+    datos = paquete_de(nombre_imagen)
+    rutas = [
+        Path(OUTPUT_DIR) / nombre_base / "4_etiquetas.npz",
+        Path(OUTPUT_DIR) / nombre_base / "4_coloreada.png",
+        *([datos.ruta_indice] if datos else [Path(XML_DIR) / f"{nombre_base}.xml", Path(GT_COLORS_DIR) / nombre_imagen]),
+    ]
+    return [comparacion.huella_archivo(ruta) for ruta in rutas]
+
+
+def _numero(texto: str):
+    # Valor de una celda de evaluacion.csv: entero o float (str(float) se relee sin pérdida)
+    try:
+        return int(texto)
+    except ValueError:
+        return float(texto)
+
+
+def cargar_evaluacion_previa(configuracion: dict):
+    #Filas de evaluacion.csv ({nombre: fila}) y huellas de sus entradas, o ({}, {}) si no se pueden reutilizar:
+    # sin huellas, otra configuración o un evaluacion.csv escrito por otro script (ejecutar.py, lotes.py)
+    try:
+        with open(HUELLAS_JSON, "r", encoding="utf-8") as f:
+            previo = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}, {}
+    if previo.get("configuracion") != configuracion or previo.get("csv") != comparacion.huella_archivo(Path(OUTPUT_CSV)):
+        return {}, {}
+    with open(OUTPUT_CSV, "r", newline="") as f:
+        filas = {
+            fila["nombre"]: {k: (v if k == "nombre" else _numero(v)) for k, v in fila.items()}
+            for fila in csv.DictReader(f)
+        }
+    return filas, previo["imagenes"]
+
+
+def guardar_huellas(configuracion: dict, huellas: dict):
+    #Escribe HUELLAS_JSON de forma atómica, con la huella del evaluacion.csv al que corresponde
+    datos = {"configuracion": configuracion, "csv": comparacion.huella_archivo(Path(OUTPUT_CSV)), "imagenes": huellas}
+    temporal = Path(f"{HUELLAS_JSON}.{os.getpid()}.tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f)
+    os.replace(temporal, HUELLAS_JSON)
+
+
+def comparar_piramide(factores, umbrales_iou=UMBRALES_IOU, repeticiones: int = REPETICIONES_PIRAMIDE):
+    #Compromiso velocidad/precisión del modo pirámide: segmenta cada imagen de segmentar.INPUT_DIR con cada factor,
+    # la evalúa frente al GT y escribe piramide.csv; devuelve las filas (una por imagen y factor)
+    rutas = sorted(Path(segmentar.INPUT_DIR).glob("*.png"))
+    if not rutas:
+        print(f"No se encontraron imágenes en {segmentar.INPUT_DIR}")
+        return []
+
+    filas = []
+    for i, ruta in enumerate(rutas, 1):
+        print(f"[{i}/{len(rutas)}] {ruta.name}...", end=" ", flush=True)
+        _, imagen_gris = segmentar.cargar_imagen(str(ruta))
+        if i == 1:
+            _segmentar_con_factor(imagen_gris, factores[0])  # calentamiento: imports diferidos y cachés
+        filas_imagen = []
+        for factor in factores:
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                etiquetas = _segmentar_con_factor(imagen_gris, factor)
+                tiempos.append(time.perf_counter() - inicio)
+            pred_binaria = np.where(etiquetas > 0, 255, 0).astype(np.uint8)
+            resultado = evaluar_prediccion(ruta.name, pred_binaria, etiquetas, umbrales_iou=umbrales_iou)
+            if resultado is None:  # sin GT: no se evalúa ningún factor de esta imagen
+                filas_imagen = []
+                break
+            filas_imagen.append({
+                "nombre": ruta.name,
+                "factor": factor,
+                "tiempo_s": min(tiempos),
+                "f1": resultado["f1"],
+                "aji": resultado["aji"],
+                "pq": resultado["pq"],
+                "num_nucleos_gt": resultado["num_nucleos_gt"],
+                "num_nucleos_pred": resultado["num_nucleos_pred"],
+                "precision_conteo": resultado["precision_conteo"],
+            })
+        if not filas_imagen:
             print("No evaluado.")
+            continue
+        filas.extend(filas_imagen)
+        print("  ".join(f"x{f['factor']}: {f['tiempo_s']*1000:.0f} ms AJI {f['aji']:.3f}" for f in filas_imagen))
 
-    if not resultados:
+    if not filas:
         print("No se evaluó ninguna imagen correctamente.")
-        return
-
-    # 4) Guardar CSV con métricas por imagen
+        return []
+    with open(PIRAMIDE_CSV, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(filas[0]))
+        writer.writeheader()
+        writer.writerows(filas)
+    mostrar_resumen_piramide(filas, factores)
+    print(f"Detalle por imagen guardado en: {PIRAMIDE_CSV}")
+    return filas
+
+
+def _segmentar_con_factor(imagen_gris: np.ndarray, factor: int) -> np.ndarray:
+    #Segmentación completa (watershed + fusión + relleno) con el factor de pirámide indicado
+    res_wtrshd, _, _, _ = segmentar.pipeline_watershed(imagen_gris, factor=factor)
+    return segmentar.rellenar_por_contorno(segmentar.unir_fragmentos(res_wtrshd))
+
+
+def mostrar_resumen_piramide(filas: list[dict], factores):
+    #Tabla por factor: tiempo medio por imagen, aceleración y métricas frente al primer factor (referencia)
+    por_factor = {f: [r for r in filas if r["factor"] == f] for f in factores}
+    referencia = por_factor[factores[0]]
+    tiempo_ref = np.mean([r["tiempo_s"] for r in referencia])
+    aji_ref = np.mean([r["aji"] for r in referencia])
+
+    print("\n" + "=" * 78)
+    print(f"  MODO PIRÁMIDE: VELOCIDAD / PRECISIÓN (referencia: factor {factores[0]})")
+    print("=" * 78)
+    print(f"{'factor':>6} {'ms/img':>8} {'aceler.':>8} {'F1':>7} {'AJI':>7} {'ΔAJI':>7} {'PQ':>7} {'conteo':>8}")
+    for factor, lista in por_factor.items():
+        tiempo = np.mean([r["tiempo_s"] for r in lista])
+        aji = np.mean([r["aji"] for r in lista])
+        print(
+            f"{factor:>6} {tiempo*1000:>8.1f} {tiempo_ref/tiempo:>7.2f}x "
+            f"{np.mean([r['f1'] for r in lista])*100:>6.2f}% {aji*100:>6.2f}% {(aji - aji_ref)*100:>+6.2f} "
+            f"{np.mean([r['pq'] for r in lista])*100:>6.2f}% {np.mean([r['precision_conteo'] for r in lista]):>7.2f}%"
+        )
+    print("=" * 78)
+
+
+def campos_evaluacion(fila: dict) -> list:
+    #Columnas de evaluacion.csv: las fijas y después las métricas por instancia de `fila`
+    campos = [
+        "nombre",
+        "f1",
+        "iou",
+        "precision",
+        "recall",
+        "accuracy",
+        "tp",
+        "fp",
+        "fn",
+        "tn",
+        "num_nucleos_gt",
+        "num_nucleos_pred",
+        "precision_conteo",
+        "area_media_gt",
+        "area_media_pred",
+    ]
+    # Métricas por instancia (AJI, PQ, det_*_<umbral>): dependen de los umbrales usados
+    return campos + [k for k in fila if k not in campos]
+
+
+def guardar_evaluacion(resultados: list[dict]):
+    #Escribe evaluacion.csv con las métricas por imagen
     with open(OUTPUT_CSV, "w", newline="") as f:
-        campos = [
-            "nombre",
-            "f1",
-            "iou",
-            "precision",
-            "recall",
-            "accuracy",
-            "tp",
-            "fp",
-            "fn",
-            "tn",
-            "num_nucleos_gt",
-            "num_nucleos_pred",
-            "precision_conteo",
-            "area_media_gt",
-            "area_media_pred",
-        ]
-        writer = csv.DictWriter(f, fieldnames=campos)
+        writer = csv.DictWriter(f, fieldnames=campos_evaluacion(resultados[0]))
         writer.writeheader()
         writer.writerows(resultados)
 
-    # 5) Mostrar resumen en consola
-    mostrar_resumen(resultados)
 
-
-def mostrar_resumen(resultados: list[dict]):
+class AcumuladorMetricas:
+    #Resumen global en streaming, fila a fila: sumas por métrica (medias por imagen, macro), TP/FP/FN/TN sumados
+    # (micro) y mejor/peor F1. Para el bootstrap solo guarda los valores por imagen de METRICAS_IC y CONFUSION, en
+    # arrays compactos (8 bytes por valor), no las filas
+
+    def __init__(self):
+        self.n = 0
+        self.sumas = {}
+        self.valores = {clave: array("d") for clave in (*METRICAS_IC, *CONFUSION)}
+        self.mejor = self.peor = None
+
+    def agregar(self, fila: dict):
+        for clave, valor in fila.items():
+            if clave != "nombre":
+                self.sumas[clave] = self.sumas.get(clave, 0) + valor
+        for clave, valores in self.valores.items():
+            valores.append(fila[clave])
+        caso = {k: fila[k] for k in ("nombre", "f1", "num_nucleos_gt", "num_nucleos_pred")}
+        if self.mejor is None or caso["f1"] > self.mejor["f1"]:
+            self.mejor = caso
+        if self.peor is None or caso["f1"] < self.peor["f1"]:
+            self.peor = caso
+        self.n += 1
+
+    def media(self, clave: str) -> float:
+        #Media por imagen (macro)
+        return self.sumas[clave] / self.n
+
+    def micro(self) -> dict:
+        #Métricas píxel a píxel de la matriz de confusión sumada sobre todas las imágenes
+        return metricas_confusion(*(self.sumas[k] for k in CONFUSION))
+
+    def intervalos(self, remuestreos: int = REMUESTREOS_BOOTSTRAP, nivel: float = NIVEL_CONFIANZA, semilla=SEMILLA_BOOTSTRAP) -> dict:
+        #IC bootstrap (percentil) de las medias de METRICAS_IC y de F1/IoU micro: {métrica: (inferior, superior)}
+        # Cada remuestreo con reemplazo es una fila de pesos (veces que entra cada imagen, un único bincount para
+        # todo el bloque): las sumas de todas las métricas de un bloque de remuestreos salen de un producto de matrices
+        rng = np.random.default_rng(semilla)
+        columnas = (*METRICAS_IC, *CONFUSION)
+        valores = np.column_stack([np.frombuffer(self.valores[k]) for k in columnas])
+        bloque = max(1, ELEMENTOS_BLOQUE // self.n)
+        partes = []
+        for inicio in range(0, remuestreos, bloque):
+            filas = min(bloque, remuestreos - inicio)
+            indices = rng.integers(0, self.n, (filas, self.n)) + np.arange(filas)[:, None] * self.n
+            pesos = np.bincount(indices.ravel(), minlength=filas * self.n).reshape(filas, self.n)
+            partes.append(pesos @ valores)
+        sumas = np.concatenate(partes)
+        estadisticos = {k: sumas[:, j] / self.n for j, k in enumerate(METRICAS_IC)}
+        tp, fp, fn = (sumas[:, columnas.index(k)] for k in ("tp", "fp", "fn"))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            estadisticos["f1_micro"] = np.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+            estadisticos["iou_micro"] = np.where(tp + fp + fn > 0, tp / (tp + fp + fn), 0.0)
+        cola = (1 - nivel) / 2 * 100
+        return {k: tuple(np.percentile(v, [cola, 100 - cola])) for k, v in estadisticos.items()}
+
+
+def acumular(filas) -> AcumuladorMetricas:
+    #Acumula un iterable de filas de métricas (las de ejecutar.py, lotes.py...)
+    acumulado = AcumuladorMetricas()
+    for fila in filas:
+        acumulado.agregar(fila)
+    return acumulado
+
+
+def mostrar_resumen(acumulado: AcumuladorMetricas):
     #Imprime resumen global de las métricas
-    # Calcular promedios de todas las métricas
-    f1_medio = np.mean([r["f1"] for r in resultados])
-    iou_medio = np.mean([r["iou"] for r in resultados])
-    precision_medio = np.mean([r["precision"] for r in resultados])
-    recall_medio = np.mean([r["recall"] for r in resultados])
-    accuracy_medio = np.mean([r["accuracy"] for r in resultados])
-    precision_conteo_medio = np.mean([r["precision_conteo"] for r in resultados])
-    area_media_gt = np.mean([r["area_media_gt"] for r in resultados])
-    area_media_pred = np.mean([r["area_media_pred"] for r in resultados])
+    # Promedios por imagen (macro) desde las sumas acumuladas
+    media = acumulado.media
+    area_media_gt = media("area_media_gt")
+    area_media_pred = media("area_media_pred")
 
     print("\n" + "=" * 60)
     print("  EVALUACIÓN CUANTITATIVA - RESULTADOS GLOBALES")
     print("=" * 60)
     print(f"\n1. MÉTRICAS DE SEGMENTACIÓN (píxel a píxel):")
-    print(f"   F1-Score:    {f1_medio*100:.2f}%  (balance precision-recall)")
-    print(f"   IoU:         {iou_medio*100:.2f}%")
-    print(f"   Precision:   {precision_medio*100:.2f}%")
-    print(f"   Recall:      {recall_medio*100:.2f}%")
-    print(f"   Accuracy:    {accuracy_medio*100:.2f}%")
+    print(f"   F1-Score:    {media('f1')*100:.2f}%  (balance precision-recall)")
+    print(f"   IoU:         {media('iou')*100:.2f}%")
+    print(f"   Precision:   {media('precision')*100:.2f}%")
+    print(f"   Recall:      {media('recall')*100:.2f}%")
+    print(f"   Accuracy:    {media('accuracy')*100:.2f}%")
 
     print(f"\n2. MÉTRICAS DE CONTEO (número de núcleos):")
-    print(f"   Núcleos GT (media):   {np.mean([r['num_nucleos_gt'] for r in resultados]):.1f}")
-    print(f"   Núcleos Pred (media): {np.mean([r['num_nucleos_pred'] for r in resultados]):.1f}")
-    print(f"   Precisión conteo:     {precision_conteo_medio:.2f}%")
+    print(f"   Núcleos GT (media):   {media('num_nucleos_gt'):.1f}")
+    print(f"   Núcleos Pred (media): {media('num_nucleos_pred'):.1f}")
+    print(f"   Precisión conteo:     {media('precision_conteo'):.2f}%")
 
     print(f"\n3. MÉTRICAS DE ÁREA (px²):")
     print(f"   Área Media GT:   {area_media_gt:.2f} px²")
@@ -224,9 +702,37 @@ def mostrar_resumen(resultados: list[dict]):
     if area_media_gt > 0:
         print(f"   Diferencia rel.: {abs(1 - area_media_pred/area_media_gt)*100:.1f}%")
 
-    # Identificar mejor y peor caso
-    mejor = max(resultados, key=lambda x: x["f1"])
-    peor = min(resultados, key=lambda x: x["f1"])
+    print(f"\n4. MÉTRICAS POR INSTANCIA (núcleo a núcleo):")
+    print(f"   AJI:         {media('aji')*100:.2f}%")
+    print(f"   PQ:          {media('pq')*100:.2f}%  (SQ {media('sq')*100:.2f}% · DQ {media('dq')*100:.2f}%)")
+    for clave in [k for k in acumulado.sumas if k.startswith("det_f1_")]:
+        sufijo = clave[len("det_f1_"):]
+        print(f"   Detección IoU>0.{sufijo}: "
+              f"P {media(f'det_precision_{sufijo}')*100:.2f}%  "
+              f"R {media(f'det_recall_{sufijo}')*100:.2f}%  "
+              f"F1 {media(clave)*100:.2f}%")
+
+    micro = acumulado.micro()
+    print(f"\n5. AGREGADO MICRO (TP/FP/FN/TN sumados sobre las {acumulado.n} imágenes):")
+    print(f"   F1-Score:    {micro['f1']*100:.2f}%")
+    print(f"   IoU:         {micro['iou']*100:.2f}%")
+    print(f"   Precision:   {micro['precision']*100:.2f}%")
+    print(f"   Recall:      {micro['recall']*100:.2f}%")
+    print(f"   Accuracy:    {micro['accuracy']*100:.2f}%")
+
+    ic = acumulado.intervalos()
+    print(f"\n6. INTERVALOS DE CONFIANZA {NIVEL_CONFIANZA*100:.0f}% (bootstrap por imagen, {REMUESTREOS_BOOTSTRAP} remuestreos):")
+    for clave, titulo in [
+        ("f1", "F1 (macro)"), ("f1_micro", "F1 (micro)"), ("iou", "IoU (macro)"), ("iou_micro", "IoU (micro)"),
+        ("aji", "AJI"), ("pq", "PQ"),
+    ]:
+        inferior, superior = ic[clave]
+        print(f"   {titulo + ':':<13}[{inferior*100:.2f}%, {superior*100:.2f}%]")
+    inferior, superior = ic["precision_conteo"]
+    print(f"   {'Prec. conteo:':<13}[{inferior:.2f}%, {superior:.2f}%]")
+
+    # Mejor y peor caso
+    mejor, peor = acumulado.mejor, acumulado.peor
     print("\n" + "=" * 60)
     print("Mejor resultado (F1):")
     print(f"  {mejor['nombre']} -> F1 {mejor['f1']*100:.1f}% (GT:{mejor['num_nucleos_gt']} Pred:{mejor['num_nucleos_pred']})")
@@ -236,5 +742,55 @@ def mostrar_resumen(resultados: list[dict]):
     print(f"Evaluacion guardada en: {OUTPUT_CSV}")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Evalúa las segmentaciones de resultados.csv frente al ground truth")
+    parser.add_argument(
+        "--umbrales-iou", type=float, nargs="+", default=list(UMBRALES_IOU),
+        help="Umbrales de IoU para el F1 de detección por instancia (PQ usa siempre 0.5)",
+    )
+    parser.add_argument(
+        "--gt-png", action="store_true",
+        help="Usa siempre el GT coloreado (PNG) aunque el XML tenga los vértices de las regiones",
+    )
+    parser.add_argument(
+        "--profile", nargs="?", const=perfil.TRAZA_POR_DEFECTO, metavar="TRAZA",
+        help=f"Mide tiempo/CPU/memoria por etapa e imagen y los escribe en TRAZA (.jsonl o .csv; por defecto {perfil.TRAZA_POR_DEFECTO})",
+    )
+    parser.add_argument(
+        "--piramide", metavar="FACTORES",
+        help="Compara factores del modo pirámide de segmentar.py (p. ej. 1,2,4): tiempo y métricas por factor; "
+             f"el primero es la referencia. Escribe {PIRAMIDE_CSV}",
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1,
+        help="Procesos en paralelo (1 = secuencial, 0 = todos los núcleos de CPU)",
+    )
+    parser.add_argument(
+        "--todas", action="store_true",
+        help=f"Reevalúa todas las imágenes aunque no hayan cambiado desde el último {OUTPUT_CSV}",
+    )
+    parser.add_argument(
+        "--paquete", nargs="?", const=paquete.PAQUETE_DIR, metavar="CARPETA",
+        help=f"Lee GT y XML del paquete del lote (`python paquete.py`; por defecto {paquete.PAQUETE_DIR}) en lugar de los archivos",
+    )
+    args = parser.parse_args()
+    if args.profile:
+        perfil.activar()
+    global GT_DESDE_XML, PAQUETE
+    GT_DESDE_XML = not args.gt_png
+    PAQUETE = args.paquete
+    if args.piramide:
+        try:
+            factores = [int(f) for f in args.piramide.split(",")]
+        except ValueError:
+            parser.error("--piramide espera factores enteros separados por comas (p. ej. 1,2,4)")
+        if min(factores) < 1:
+            parser.error("--piramide: los factores deben ser >= 1")
+        comparar_piramide(factores, tuple(args.umbrales_iou))
+        return
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    evaluar_todas_imagenes(tuple(args.umbrales_iou), args.profile, workers, not args.todas)
+
+
 if __name__ == "__main__":
-    evaluar_todas_imagenes()
+    main()
@@ -0,0 +1,136 @@
+"""
+Ground truth por instancia desde los vértices de las regiones del XML, con caché en disco.
+
+Flujo:
+1) Lee el XML en streaming (iterparse): por cada `Region`, su atributo `Area` y el polígono de sus `Vertex` (X, Y);
+   cada elemento se libera al terminarlo, así que la memoria no depende del tamaño del XML.
+2) Rasteriza los polígonos en un mapa de labels (núcleo i -> label i, en orden del XML; en solapes gana el último).
+3) Guarda labels (uint16/uint32) + áreas en `.cache_gt/<xml>_<alto>x<ancho>.npz`. La entrada es válida mientras el
+   XML no cambie: mismo (tamaño, mtime) o, si el mtime cambió, mismo sha256 del contenido.
+Las evaluaciones siguientes no vuelven a parsear el XML ni a decodificar el PNG de GT coloreado.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import diferido
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+
+CACHE_DIR = ".cache_gt"
+
+
+def leer_regiones(ruta_xml: Path):
+    #Devuelve [(area, vertices Nx2 float (x, y) o None)] de cada Region del XML, leyendo en streaming
+    regiones = []
+    vertices = []
+    for _, elem in ET.iterparse(ruta_xml, events=("end",)):
+        if elem.tag == "Vertex":
+            vertices.append((float(elem.get("X")), float(elem.get("Y"))))
+        elif elem.tag == "Region":
+            poligono = np.array(vertices, dtype=np.float64) if len(vertices) >= 3 else None
+            area = elem.get("Area")
+            if area:
+                area = float(area)
+            elif poligono is not None:
+                area = _area_poligono(poligono)
+            else:
+                area = None
+            regiones.append((area, poligono))
+            vertices = []
+            elem.clear()
+    return regiones
+
+
+def _area_poligono(poligono: np.ndarray) -> float:
+    #Área de un polígono simple (fórmula del área de Gauss)
+    x, y = poligono[:, 0], poligono[:, 1]
+    return float(abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))) / 2)
+
+
+def rasterizar(poligonos, forma) -> np.ndarray:
+    #Mapa de labels (int32) con el polígono i relleno con el label i + 1
+    etiquetas = np.zeros(forma, dtype=np.int32)
+    for i, poligono in enumerate(poligonos, 1):
+        puntos = np.round(poligono).astype(np.int32).reshape(-1, 1, 2)
+        cv2.fillPoly(etiquetas, [puntos], i)
+    return etiquetas
+
+
+def _estado_xml(ruta_xml: Path) -> dict:
+    #(tamaño, mtime) del XML: comprobación rápida de que no ha cambiado
+    estado = ruta_xml.stat()
+    return {"tamano": estado.st_size, "mtime_ns": estado.st_mtime_ns}
+
+
+def _sha256(ruta: Path) -> str:
+    #sha256 del contenido (solo si el mtime cambió)
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def cargar_gt(ruta_xml: Path, forma, carpeta_cache: Path | None = Path(CACHE_DIR)):
+    #Devuelve (etiquetas_gt, areas_gt) rasterizando el XML a `forma` (alto, ancho), o None si el XML no existe
+    # o sus regiones no tienen vértices. carpeta_cache=None desactiva la caché
+    ruta_xml = Path(ruta_xml)
+    if not ruta_xml.exists():
+        return None
+    forma = tuple(int(v) for v in forma[:2])
+    estado = _estado_xml(ruta_xml)
+
+    ruta_cache = None
+    if carpeta_cache is not None:
+        ruta_cache = Path(carpeta_cache) / f"{ruta_xml.stem}_{forma[0]}x{forma[1]}.npz"
+        entrada = _leer_cache(ruta_cache, ruta_xml, estado)
+        if entrada is not None:
+            return entrada
+
+    regiones = leer_regiones(ruta_xml)
+    poligonos = [p for _, p in regiones if p is not None]
+    if not poligonos:
+        return None
+    etiquetas = rasterizar(poligonos, forma)
+    areas = [a for a, _ in regiones if a is not None]
+
+    if ruta_cache is not None:
+        _escribir_cache(ruta_cache, etiquetas, areas, {**estado, "sha256": _sha256(ruta_xml)})
+    return etiquetas, areas
+
+
+def _leer_cache(ruta_cache: Path, ruta_xml: Path, estado: dict):
+    #(etiquetas, areas) si la entrada corresponde al XML actual; None si no existe o está desfasada
+    try:
+        with np.load(ruta_cache) as datos:
+            meta = json.loads(str(datos["meta"]))
+            etiquetas, areas = datos["etiquetas"], datos["areas"].tolist()
+    except (FileNotFoundError, OSError, ValueError, KeyError):
+        return None
+    if (meta["tamano"], meta["mtime_ns"]) != (estado["tamano"], estado["mtime_ns"]):
+        # mtime distinto (copia, checkout...): vale si el contenido es el mismo; se actualiza el estado guardado
+        if meta["sha256"] != _sha256(ruta_xml):
+            return None
+        _escribir_cache(ruta_cache, etiquetas, areas, {**estado, "sha256": meta["sha256"]})
+    return etiquetas, areas
+
+
+def _escribir_cache(ruta_cache: Path, etiquetas: np.ndarray, areas, meta: dict):
+    #Guarda la entrada de forma atómica con el dtype entero mínimo
+    ruta_cache.parent.mkdir(parents=True, exist_ok=True)
+    dtype = np.uint16 if etiquetas.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    temporal = ruta_cache.with_name(f"{ruta_cache.stem}.{os.getpid()}.tmp.npz")
+    np.savez_compressed(
+        temporal,
+        etiquetas=etiquetas.astype(dtype, copy=False),
+        areas=np.asarray(areas, dtype=np.float64),
+        meta=np.array(json.dumps(meta)),
+    )
+    os.replace(temporal, ruta_cache)
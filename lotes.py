@@ -0,0 +1,414 @@
+"""
+Reparto del lote entre varias máquinas (o procesos) que comparten un sistema de archivos.
+
+Cola en disco (--cola, por defecto COLA_DIR):
+  cola.json     manifiesto: imágenes, lotes y ajustes del pipeline con los que se preparó la cola
+  pendientes/   un archivo por lote sin reclamar (lote_0000.json: lista de imágenes)
+  en_curso/     lotes reclamados, `<lote>@<host>-<pid>`; el mtime del archivo es el latido de su worker
+  hechos/       lotes terminados
+  parciales/    resultados de cada lote (filas de resultados.csv y evaluacion.csv)
+
+Flujo:
+1) `preparar`: reparte las imágenes de INPUT_DIR en lotes de --por-lote imágenes y los deja en pendientes/.
+   Si la cola ya existe no la toca (así se reanuda); --rehacer la borra y empieza de cero.
+2) `trabajar` (en cada máquina, tantas veces como se quiera; -w N lanza N workers): reclama un lote renombrando
+   su archivo de pendientes/ a en_curso/ (os.rename es atómico: si dos workers compiten solo uno lo consigue),
+   segmenta y evalúa sus imágenes (salidas en visualizaciones/, como segmentar.py), escribe el parcial del lote
+   (temporal + os.replace: nunca hay parciales a medias) y mueve el lote a hechos/. Termina cuando no queda
+   ningún lote pendiente ni en curso.
+3) Tras una caída: un lote en curso vuelve a pendientes/ si su worker ya no existe (mismo host y pid muerto) o si
+   su latido tiene más de --plazo segundos (worker de otra máquina). Repetir un lote es inocuo: su parcial se
+   reescribe entero. Con --cache-dir las imágenes ya segmentadas antes de la caída no se vuelven a segmentar.
+4) `fusionar`: junta los parciales en resultados.csv y evaluacion.csv (mismo formato y orden que
+   segmentar.py + evaluar.py) y muestra el resumen. `estado` muestra el avance de la cola.
+
+Prueba local con varios procesos sobre una carpeta temporal:
+    python lotes.py preparar --cola /tmp/cola --por-lote 2
+    for i in 1 2 3; do python lotes.py trabajar --cola /tmp/cola & done; wait
+    python lotes.py fusionar --cola /tmp/cola
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cache_segmentacion
+import entrada_salida
+import evaluar
+import segmentar
+import semillas
+
+COLA_DIR = ".cola_lotes"
+MANIFIESTO = "cola.json"
+CARPETAS = ("pendientes", "en_curso", "hechos", "parciales")
+IMAGENES_POR_LOTE = 4
+PLAZO_S = 600               # Latido más antiguo: el worker se da por caído (holgado: relojes de máquinas distintas)
+ESPERA_S = 2.0              # Pausa entre sondeos mientras otros workers terminan sus lotes
+SEPARADOR = "@"             # en_curso/<lote>@<nodo>
+
+
+def nodo_actual() -> str:
+    #Identificador del worker: <host>-<pid>
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _a_json(valor):
+    # Escalares de numpy (conteos y métricas) -> tipos de Python
+    return valor.item()
+
+
+def escribir_atomico(ruta: Path, datos):
+    #Escribe `datos` como JSON en un temporal de la misma carpeta y lo renombra: nadie lee un archivo a medias
+    temporal = ruta.with_name(f".{ruta.name}.{nodo_actual()}.tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, default=_a_json)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def leer_json(ruta: Path):
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def leer_manifiesto(cola: Path) -> dict:
+    #Manifiesto de la cola; termina con error si la cola no está preparada
+    try:
+        return leer_json(cola / MANIFIESTO)
+    except FileNotFoundError:
+        sys.exit(f"ERROR: {cola} no es una cola preparada (python lotes.py preparar --cola {cola})")
+
+
+def preparar_cola(cola: Path, por_lote: int = IMAGENES_POR_LOTE, rehacer: bool = False) -> dict | None:
+    #Crea la cola con las imágenes de INPUT_DIR y los ajustes actuales de segmentar; si ya existe la deja como está
+    if (cola / MANIFIESTO).exists() and not rehacer:
+        print(f"La cola {cola} ya existe: se reanuda donde se quedó (--rehacer para empezar de cero)")
+        return leer_manifiesto(cola)
+    if rehacer and cola.exists():
+        shutil.rmtree(cola)
+
+    imagenes = segmentar.listar_entradas()
+    if not imagenes:
+        print(f"ERROR: No se encontraron imágenes en {segmentar.INPUT_DIR}")
+        return None
+    for carpeta in CARPETAS:
+        (cola / carpeta).mkdir(parents=True, exist_ok=True)
+
+    lotes = {
+        f"lote_{i // por_lote:04d}.json": [ruta.name for ruta in imagenes[i:i + por_lote]]
+        for i in range(0, len(imagenes), por_lote)
+    }
+    for lote, nombres in lotes.items():
+        escribir_atomico(cola / "pendientes" / lote, nombres)
+    manifiesto = {
+        "entrada": str(segmentar.INPUT_DIR),
+        "imagenes": [ruta.name for ruta in imagenes],
+        "lotes": lotes,
+        "ajustes": segmentar.ajustes_worker(),
+        "parametros": segmentar.parametros_efectivos(),
+        "version": segmentar.VERSION_PIPELINE,
+    }
+    # El manifiesto va el último: una cola sin él no está lista
+    escribir_atomico(cola / MANIFIESTO, manifiesto)
+    print(f"Cola {cola}: {len(imagenes)} imágenes en {len(lotes)} lotes de hasta {por_lote}")
+    return manifiesto
+
+
+def configurar_nodo(manifiesto: dict):
+    #Aplica a este proceso los ajustes con los que se preparó la cola y comprueba que el pipeline del nodo coincide
+    segmentar.INPUT_DIR = manifiesto["entrada"]
+    segmentar.inicializar_worker(False, entrada_salida.COMPRESION_PNG, manifiesto["ajustes"])
+    parametros = json.loads(json.dumps(segmentar.parametros_efectivos()))
+    if parametros != manifiesto["parametros"] or segmentar.VERSION_PIPELINE != manifiesto["version"]:
+        raise RuntimeError(
+            "Los parámetros o la versión del pipeline de este nodo no coinciden con los de la cola "
+            f"(versión {segmentar.VERSION_PIPELINE} frente a {manifiesto['version']})"
+        )
+    Path(segmentar.OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+
+
+def reclamar_lote(cola: Path, nodo: str) -> Path | None:
+    #Reclama el primer lote pendiente que se deje (rename atómico); None si no queda ninguno
+    for pendiente in sorted((cola / "pendientes").glob("lote_*.json")):
+        reclamado = cola / "en_curso" / f"{pendiente.name}{SEPARADOR}{nodo}"
+        try:
+            # Primer latido antes del rename (que conserva el mtime): nunca se ve en en_curso/ con un latido viejo
+            os.utime(pendiente)
+            os.rename(pendiente, reclamado)
+        except FileNotFoundError:
+            continue  # otro worker se lo llevó antes
+        return reclamado
+    return None
+
+
+def _worker_caido(nodo: str) -> bool:
+    #True si el worker es de esta máquina y su proceso ya no existe; de otras máquinas solo se sabe por el latido
+    host, _, pid = nodo.rpartition("-")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def recuperar_caidos(cola: Path, plazo: float = PLAZO_S) -> int:
+    #Devuelve a pendientes/ los lotes en curso de workers caídos; devuelve cuántos
+    recuperados = 0
+    for reclamado in sorted((cola / "en_curso").glob(f"lote_*{SEPARADOR}*")):
+        lote, _, nodo = reclamado.name.partition(SEPARADOR)
+        try:
+            latido = time.time() - reclamado.stat().st_mtime
+            if _worker_caido(nodo):
+                motivo = "su proceso ya no existe"
+            elif latido > plazo:
+                motivo = f"sin latido desde hace {latido:.0f}s"
+            else:
+                continue
+            os.rename(reclamado, cola / "pendientes" / lote)
+        except FileNotFoundError:
+            continue  # terminado o recuperado por otro worker mientras tanto
+        print(f"{lote} de {nodo} vuelve a la cola ({motivo})")
+        recuperados += 1
+    return recuperados
+
+
+def procesar_lote(reclamado: Path, carpeta_cache: Path | None, indice: dict | None) -> list[dict]:
+    #Segmenta y evalúa las imágenes del lote; renueva el latido tras cada imagen
+    filas = []
+    for nombre in leer_json(reclamado):
+        ruta = Path(segmentar.INPUT_DIR) / nombre
+        try:
+            clave = None
+            if indice is not None:
+                clave = cache_segmentacion.clave_entrada(
+                    cache_segmentacion.hash_archivo(ruta, indice), segmentar.parametros_efectivos(),
+                    segmentar.VERSION_PIPELINE,
+                )
+            resultado = segmentar.segmentar_imagen(ruta, carpeta_cache, clave)
+            info_filtro = resultado.pop("info")
+            origen = " [caché]" if resultado.pop("cache_acierto", False) else ""
+            if indice is not None:
+                tamano = resultado.pop("cache_tamano", None)
+                if tamano is None and clave not in indice["entradas"]:
+                    # Acierto de una entrada que escribió un worker caído antes de guardar el índice
+                    tamano = (carpeta_cache / f"{clave}.npz").stat().st_size
+                cache_segmentacion.registrar_uso(indice, clave, tamano)
+            metricas = evaluar.evaluar_imagen(nombre)
+            filas.append({"nombre": nombre, "resultado": resultado, "evaluacion": metricas})
+            evaluacion = f"F1: {metricas['f1']:.3f}" if metricas else "no evaluado"
+            print(f"  {nombre}: OK (filtro={info_filtro['metodo']}, {resultado['num_nucleos']} núcleos, {evaluacion}){origen}")
+        except Exception as e:
+            filas.append({"nombre": nombre, "error": str(e)})
+            print(f"  {nombre}: ERROR: {e}")
+        try:
+            os.utime(reclamado)
+        except FileNotFoundError:
+            pass  # el lote se dio por caído y volvió a la cola: se termina igualmente (el parcial es idempotente)
+    return filas
+
+
+def guardar_cache(carpeta_cache: Path, indice: dict, cache_max_mb: int) -> int:
+    #Funde el índice de caché de este worker con el del disco (lo comparten todos los workers), poda (LRU) y lo
+    # guarda, como procesar_todas_imagenes al terminar; `indice` queda con el resultado. Devuelve las expulsadas
+    comun = cache_segmentacion.cargar_indice(carpeta_cache)
+    comun["archivos"].update(indice["archivos"])
+    for clave, entrada in indice["entradas"].items():
+        previa = comun["entradas"].get(clave)
+        if previa is None or entrada.get("ultimo_uso", 0) >= previa.get("ultimo_uso", 0):
+            comun["entradas"][clave] = entrada
+    expulsadas = cache_segmentacion.podar(carpeta_cache, comun, cache_max_mb * 1024 * 1024)
+    cache_segmentacion.guardar_indice(carpeta_cache, comun)
+    indice.clear()
+    indice.update(comun)
+    return expulsadas
+
+
+def trabajar(cola: Path, plazo: float = PLAZO_S, carpeta_cache: Path | None = None, cache_max_mb: int = cache_segmentacion.CACHE_MAX_MB) -> int:
+    #Bucle de un worker: reclama y procesa lotes hasta que no quede ninguno pendiente ni en curso; devuelve cuántos
+    # Con carpeta_cache el índice de la caché se guarda (y se poda) tras cada lote
+    configurar_nodo(leer_manifiesto(cola))
+    nodo = nodo_actual()
+    indice = cache_segmentacion.cargar_indice(carpeta_cache) if carpeta_cache is not None else None
+    hechos = 0
+    recuperar_caidos(cola, plazo)  # reanudar: los lotes que dejó a medias un worker caído de esta máquina
+    while True:
+        reclamado = reclamar_lote(cola, nodo)
+        if reclamado is None and recuperar_caidos(cola, plazo):
+            reclamado = reclamar_lote(cola, nodo)
+        if reclamado is None:
+            if not any((cola / "en_curso").glob(f"lote_*{SEPARADOR}*")):
+                return hechos
+            # Otros workers terminan sus lotes; si caen, sus lotes se recuperan en una vuelta posterior
+            time.sleep(ESPERA_S)
+            continue
+
+        lote = reclamado.name.partition(SEPARADOR)[0]
+        print(f"[{nodo}] {lote}")
+        filas = procesar_lote(reclamado, carpeta_cache, indice)
+        if indice is not None:
+            expulsadas = guardar_cache(carpeta_cache, indice, cache_max_mb)
+            if expulsadas:
+                print(f"[{nodo}] caché: {expulsadas} entradas expulsadas ({carpeta_cache})")
+        escribir_atomico(cola / "parciales" / lote, {"lote": lote, "nodo": nodo, "filas": filas})
+        try:
+            os.replace(reclamado, cola / "hechos" / lote)
+        except FileNotFoundError:
+            print(f"[{nodo}] {lote} se reasignó mientras se procesaba; su parcial ya está escrito")
+        hechos += 1
+
+
+def trabajar_en_paralelo(cola: Path, workers: int, plazo: float = PLAZO_S, carpeta_cache: Path | None = None, cache_max_mb: int = cache_segmentacion.CACHE_MAX_MB) -> int:
+    #Lanza `workers` workers de la cola en esta máquina (cada uno es un nodo más); devuelve los lotes hechos
+    if workers == 1:
+        return trabajar(cola, plazo, carpeta_cache, cache_max_mb)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = [pool.submit(trabajar, cola, plazo, carpeta_cache, cache_max_mb) for _ in range(workers)]
+        return sum(futuro.result() for futuro in futuros)
+
+
+def mostrar_estado(cola: Path):
+    #Lotes pendientes / en curso (con la edad de su latido) / hechos
+    manifiesto = leer_manifiesto(cola)
+    pendientes = list((cola / "pendientes").glob("lote_*.json"))
+    en_curso = sorted((cola / "en_curso").glob(f"lote_*{SEPARADOR}*"))
+    hechos = list((cola / "hechos").glob("lote_*.json"))
+    print(
+        f"Cola {cola}: {len(manifiesto['imagenes'])} imágenes, {len(manifiesto['lotes'])} lotes | "
+        f"pendientes {len(pendientes)} | en curso {len(en_curso)} | hechos {len(hechos)}"
+    )
+    for reclamado in en_curso:
+        lote, _, nodo = reclamado.name.partition(SEPARADOR)
+        try:
+            latido = time.time() - reclamado.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        caido = " (caído)" if _worker_caido(nodo) else ""
+        print(f"  {lote}  {nodo}  último latido hace {latido:.0f}s{caido}")
+
+
+def fusionar(cola: Path, incompleto: bool = False) -> bool:
+    #Junta los parciales en resultados.csv y evaluacion.csv, en el orden de las imágenes del manifiesto
+    # Sin `incompleto` no escribe nada si falta alguna imagen (lotes sin terminar)
+    manifiesto = leer_manifiesto(cola)
+    por_imagen = {}
+    for parcial in sorted((cola / "parciales").glob("lote_*.json")):
+        for fila in leer_json(parcial)["filas"]:
+            por_imagen[fila["nombre"]] = fila
+
+    faltan = [nombre for nombre in manifiesto["imagenes"] if nombre not in por_imagen]
+    if faltan:
+        print(f"Faltan {len(faltan)} de {len(manifiesto['imagenes'])} imágenes (lotes sin terminar): {', '.join(faltan[:5])}")
+        if not incompleto:
+            print("No se escribe nada (--incompleto para fusionar lo que haya)")
+            return False
+
+    filas = []
+    for nombre in manifiesto["imagenes"]:
+        fila = por_imagen.get(nombre)
+        if fila is not None and "error" in fila:
+            print(f"ERROR en {nombre}: {fila['error']}")
+        elif fila is not None:
+            filas.append(fila)
+
+    segmentar.guardar_csv([fila["resultado"] for fila in filas])
+    metricas = [fila["evaluacion"] for fila in filas if fila["evaluacion"]]
+    if metricas:
+        evaluar.guardar_evaluacion(metricas)
+    print(f"{len(filas)} imágenes en {segmentar.RESULTADOS_CSV}, {len(metricas)} evaluadas en {evaluar.OUTPUT_CSV}")
+    if metricas:
+        evaluar.mostrar_resumen(evaluar.acumular(metricas))
+    else:
+        print("No se evaluó ninguna imagen correctamente.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reparte el lote entre varias máquinas mediante una cola en disco")
+    parser.add_argument("--cola", default=COLA_DIR, help="Carpeta de la cola (compartida por todos los nodos)")
+    subparsers = parser.add_subparsers(dest="orden", required=True, metavar="orden")
+
+    preparar = subparsers.add_parser("preparar", help="Crea la cola con las imágenes de entrada")
+    preparar.add_argument("--por-lote", type=int, default=IMAGENES_POR_LOTE, help="Imágenes por lote")
+    preparar.add_argument("--rehacer", action="store_true", help="Borra la cola existente y empieza de cero")
+    preparar.add_argument(
+        "--piramide", type=int, default=segmentar.FACTOR_PIRAMIDE, metavar="FACTOR",
+        help="Segmentación grueso a fino con la imagen reducida FACTOR veces (1 = desactivado)",
+    )
+    preparar.add_argument(
+        "--semillas", choices=list(semillas.DETECTORES), default=segmentar.DETECTOR_SEMILLAS,
+        help="Detector de semillas del watershed (semillas.py)",
+    )
+    preparar.add_argument(
+        "--baja-memoria", action="store_true",
+        help="Distancias float32, labels con el dtype entero mínimo y sin copias intermedias (menos RAM por worker)",
+    )
+    preparar.add_argument(
+        "--entrada", choices=segmentar.ENTRADAS, default=segmentar.ENTRADA,
+        help="h: imágenes del canal H ya extraído; he: escaneos H&E en RGB (deconvolución de color)",
+    )
+    preparar.add_argument("--carpeta-entrada", default=segmentar.INPUT_DIR, help="Carpeta con las imágenes de entrada")
+
+    trabajo = subparsers.add_parser("trabajar", help="Procesa lotes de la cola hasta vaciarla")
+    trabajo.add_argument(
+        "--workers", "-w", type=int, default=1,
+        help="Workers en esta máquina (1 = uno, 0 = uno por núcleo de CPU)",
+    )
+    trabajo.add_argument(
+        "--plazo", type=float, default=PLAZO_S,
+        help="Segundos sin latido tras los que un lote en curso de otra máquina se da por caído",
+    )
+    trabajo.add_argument(
+        "--cache-dir", default=None,
+        help="Caché de resultados (cache_segmentacion) para no repetir imágenes tras una caída; por defecto sin caché",
+    )
+    trabajo.add_argument(
+        "--cache-max-mb", type=int, default=cache_segmentacion.CACHE_MAX_MB,
+        help="Tamaño máximo de la caché (MB); se expulsan las entradas menos usadas",
+    )
+
+    subparsers.add_parser("estado", help="Muestra el avance de la cola")
+
+    fusion = subparsers.add_parser("fusionar", help="Escribe resultados.csv y evaluacion.csv con los parciales")
+    fusion.add_argument("--incompleto", action="store_true", help="Fusiona aunque falten lotes por terminar")
+
+    args = parser.parse_args()
+    cola = Path(args.cola)
+
+    if args.orden == "preparar":
+        if args.piramide < 1:
+            parser.error("--piramide debe ser >= 1")
+        if args.por_lote < 1:
+            parser.error("--por-lote debe ser >= 1")
+        segmentar.FACTOR_PIRAMIDE = args.piramide
+        segmentar.DETECTOR_SEMILLAS = args.semillas
+        segmentar.BAJA_MEMORIA = args.baja_memoria
+        segmentar.ENTRADA = args.entrada
+        segmentar.INPUT_DIR = args.carpeta_entrada
+        if preparar_cola(cola, args.por_lote, args.rehacer) is None:
+            sys.exit(1)
+    elif args.orden == "trabajar":
+        workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+        carpeta_cache = Path(args.cache_dir) if args.cache_dir else None
+        inicio = time.perf_counter()
+        hechos = trabajar_en_paralelo(cola, workers, args.plazo, carpeta_cache, args.cache_max_mb)
+        print(f"{hechos} lotes procesados en {time.perf_counter() - inicio:.1f}s (workers={workers})")
+        mostrar_estado(cola)
+    elif args.orden == "estado":
+        mostrar_estado(cola)
+    elif not fusionar(cola, args.incompleto):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
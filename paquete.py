@@ -0,0 +1,302 @@
+"""
+Paquete del lote: el canal H, el GT y las regiones de los XML en unos pocos fragmentos contiguos leídos como memmap.
+
+Con miles de PNG pequeños (y sus XML) en almacenamiento de red, abrir y descomprimir cada archivo domina las
+ejecuciones cortas. `python paquete.py` (`python cli.py empaquetar`) lo convierte una vez y después `segmentar.py`,
+`evaluar.py` y `visualizar.py` con `--paquete` leen cada imagen por nombre sin copiarla (vistas del memmap).
+
+Flujo de `empaquetar`:
+1) Por imagen de INPUT_DIR (con --workers, decodificadas en un pool y escritas en orden):
+     h             canal H en gris (segmentar.cargar_imagen: respeta --entrada he)
+     gt            GT coloreado (BGR) de gt_colors, si existe
+     gt_etiquetas  labels del GT rasterizados desde los vértices del XML al tamaño de la imagen (gt_xml.py), si los hay
+     areas / vertices_por_region / vertices   regiones del XML (gt_xml.leer_regiones): área (NaN si no tiene),
+                   nº de vértices (0 = sin polígono) y todos los vértices (x, y) seguidos
+2) Los arrays de cada imagen se escriben seguidos (alineados a ALINEACION bytes) en `fragmento_NNN.bin`; se empieza
+   un fragmento nuevo cuando el actual superaría TAMANO_FRAGMENTO (una imagen nunca se parte entre dos).
+3) `indice.json`: por imagen, el sha256 del archivo de origen (clave de la caché de segmentar) y, por campo,
+   [fragmento, offset, dtype, forma]. Todo se escribe en una carpeta temporal que sustituye a la anterior al final.
+Lectura (`abrir(carpeta).leer(nombre, campo)`): un memmap de solo lectura por fragmento y proceso; cada campo es una
+vista de él, sin copia ni decodificación. Las imágenes que no están en el paquete (o sin --paquete) se leen de los
+PNG / XML de siempre.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import diferido
+import entrada_salida
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+
+PAQUETE_DIR = "paquete"
+INDICE = "indice.json"
+VERSION_PAQUETE = 1
+TAMANO_FRAGMENTO = 1 << 30          # Bytes máximos por fragmento (salvo una imagen que por sí sola lo supere)
+ALINEACION = 64                     # Offset de cada array múltiplo de ALINEACION (vistas alineadas para cualquier dtype)
+EN_VUELO_POR_WORKER = 2             # Con --workers: imágenes en curso (o esperando a escribirse) por worker como máximo
+CAMPOS_REGIONES = ("areas", "vertices_por_region", "vertices")
+
+
+class Paquete:
+    #Lector de un paquete: vistas de solo lectura de cada campo de una imagen
+
+    def __init__(self, carpeta: Path):
+        self.carpeta = Path(carpeta)
+        self.ruta_indice = self.carpeta / INDICE
+        with open(self.ruta_indice, "r", encoding="utf-8") as f:
+            indice = json.load(f)
+        if indice.get("version") != VERSION_PAQUETE:
+            raise ValueError(f"{self.ruta_indice}: versión {indice.get('version')} (se esperaba {VERSION_PAQUETE})")
+        self.fragmentos = indice["fragmentos"]
+        self.imagenes = indice["imagenes"]
+        self.origen = indice["origen"]
+        self._memmaps = {}
+
+    def nombres(self) -> list[str]:
+        return list(self.imagenes)
+
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self.imagenes
+
+    def hash(self, nombre: str) -> str | None:
+        #sha256 del archivo de origen de la imagen (el mismo que calcula cache_segmentacion.hash_archivo)
+        return self.imagenes[nombre]["sha256"] if nombre in self.imagenes else None
+
+    def _fragmento(self, indice: int):
+        memmap = self._memmaps.get(indice)
+        if memmap is None:
+            memmap = self._memmaps[indice] = np.memmap(self.carpeta / self.fragmentos[indice], dtype=np.uint8, mode="r")
+        return memmap
+
+    def leer(self, nombre: str, campo: str):
+        #Vista (sin copia, solo lectura) del campo de la imagen, o None si la imagen no lo tiene
+        entrada = self.imagenes.get(nombre, {}).get("campos", {}).get(campo)
+        if entrada is None:
+            return None
+        fragmento, offset, dtype, forma = entrada
+        dtype = np.dtype(dtype)
+        tamano = int(np.prod(forma, dtype=np.int64)) * dtype.itemsize
+        return self._fragmento(fragmento)[offset:offset + tamano].view(dtype).reshape(forma)
+
+    def regiones(self, nombre: str):
+        #[(area o None, vértices Nx2 o None)] de las regiones del XML, como gt_xml.leer_regiones; None si no hay XML
+        areas, conteos, vertices = (self.leer(nombre, campo) for campo in CAMPOS_REGIONES)
+        if areas is None:
+            return None
+        limites = np.concatenate(([0], np.cumsum(conteos)))
+        return [
+            (None if np.isnan(area) else float(area), vertices[inicio:fin] if fin > inicio else None)
+            for area, inicio, fin in zip(areas, limites[:-1], limites[1:])
+        ]
+
+    def gt_xml(self, nombre: str, forma):
+        #(etiquetas_gt, areas_gt) como gt_xml.cargar_gt: el rasterizado empaquetado si coincide la forma; None si
+        # la imagen no tiene regiones con vértices
+        regiones = self.regiones(nombre)
+        if regiones is None:
+            return None
+        etiquetas = self.leer(nombre, "gt_etiquetas")
+        if etiquetas is None:
+            return None
+        forma = tuple(int(v) for v in forma[:2])
+        if etiquetas.shape != forma:
+            import gt_xml
+            etiquetas = gt_xml.rasterizar([p for _, p in regiones if p is not None], forma)
+        return etiquetas, [a for a, _ in regiones if a is not None]
+
+
+_ABIERTOS = {}
+
+
+def abrir(carpeta) -> Paquete:
+    #Paquete de la carpeta, abierto una vez por proceso (se reabre si indice.json ha cambiado)
+    ruta = Path(carpeta).resolve()
+    huella = (ruta / INDICE).stat().st_mtime_ns
+    abierto = _ABIERTOS.get(ruta)
+    if abierto is None or abierto[0] != huella:
+        abierto = _ABIERTOS[ruta] = (huella, Paquete(ruta))
+    return abierto[1]
+
+
+def sha256_archivo(ruta: Path) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def campos_imagen(ruta: Path, gt_dir: Path, xml_dir: Path, ajustes: dict) -> tuple[str, dict]:
+    #(sha256 del origen, {campo: array}) de una imagen; se puede ejecutar en un proceso del pool
+    import gt_xml
+    import segmentar
+
+    segmentar.inicializar_worker(False, None, ajustes)
+    _, gris = segmentar.cargar_imagen(str(ruta))
+    campos = {"h": np.ascontiguousarray(gris)}
+
+    ruta_gt = gt_dir / ruta.name
+    if ruta_gt.exists():
+        campos["gt"] = cv2.imread(str(ruta_gt))
+
+    ruta_xml = xml_dir / f"{ruta.stem}.xml"
+    if ruta_xml.exists():
+        regiones = gt_xml.leer_regiones(ruta_xml)
+        poligonos = [p for _, p in regiones if p is not None]
+        campos["areas"] = np.array([np.nan if a is None else a for a, _ in regiones], dtype=np.float64)
+        campos["vertices_por_region"] = np.array([0 if p is None else len(p) for _, p in regiones], dtype=np.int64)
+        campos["vertices"] = np.concatenate(poligonos) if poligonos else np.zeros((0, 2), dtype=np.float64)
+        if poligonos:
+            etiquetas = gt_xml.rasterizar(poligonos, gris.shape)
+            dtype = np.uint16 if etiquetas.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+            campos["gt_etiquetas"] = etiquetas.astype(dtype)
+    return sha256_archivo(ruta), campos
+
+
+class EscritorFragmentos:
+    #Escribe los arrays de cada imagen seguidos en fragmento_NNN.bin y devuelve sus entradas del índice
+
+    def __init__(self, carpeta: Path, tamano_fragmento: int = TAMANO_FRAGMENTO):
+        self.carpeta = carpeta
+        self.tamano_fragmento = tamano_fragmento
+        self.fragmentos = []
+        self._archivo = None
+        self._offset = 0
+
+    def _nuevo_fragmento(self):
+        self.cerrar()
+        self.fragmentos.append(f"fragmento_{len(self.fragmentos):03d}.bin")
+        self._archivo = open(self.carpeta / self.fragmentos[-1], "wb")
+        self._offset = 0
+
+    @staticmethod
+    def _alineado(n: int) -> int:
+        return -(-n // ALINEACION) * ALINEACION
+
+    def escribir(self, campos: dict) -> dict:
+        #{campo: [fragmento, offset, dtype, forma]}; todos los campos de la imagen en el mismo fragmento
+        total = sum(self._alineado(a.nbytes) for a in campos.values())
+        if self._archivo is None or (self._offset and self._offset + total > self.tamano_fragmento):
+            self._nuevo_fragmento()
+        entradas = {}
+        for campo, array in campos.items():
+            array = np.ascontiguousarray(array)
+            entradas[campo] = [len(self.fragmentos) - 1, self._offset, array.dtype.str, list(array.shape)]
+            self._archivo.write(memoryview(array).cast("B"))
+            relleno = self._alineado(array.nbytes) - array.nbytes
+            self._archivo.write(b"\0" * relleno)
+            self._offset += array.nbytes + relleno
+        return entradas
+
+    def cerrar(self):
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = None
+
+
+def empaquetar(destino: Path, workers: int = 1, tamano_fragmento: int = TAMANO_FRAGMENTO) -> dict | None:
+    #Empaqueta las imágenes de segmentar.INPUT_DIR con su GT y sus XML; devuelve el índice (None si no hay imágenes)
+    import evaluar
+    import segmentar
+
+    # Aquí se leen a propósito los PNG de INPUT_DIR y no segmentar.listar_entradas(): el paquete se crea desde los
+    # archivos de origen, aunque haya otro paquete activo
+    rutas = sorted(Path(segmentar.INPUT_DIR).glob("*.png"))
+    if not rutas:
+        print(f"ERROR: No se encontraron imágenes en {segmentar.INPUT_DIR}")
+        return None
+    gt_dir, xml_dir = Path(evaluar.GT_COLORS_DIR), Path(evaluar.XML_DIR)
+    ajustes = segmentar.ajustes_worker()
+    ajustes["PAQUETE"] = None  # se empaquetan siempre los archivos de origen
+
+    destino = Path(destino)
+    temporal = destino.with_name(f"{destino.name}.{os.getpid()}.tmp")
+    shutil.rmtree(temporal, ignore_errors=True)
+    temporal.mkdir(parents=True)
+    escritor = EscritorFragmentos(temporal, tamano_fragmento)
+    imagenes = {}
+
+    # Con workers > 1 solo EN_VUELO_POR_WORKER imágenes por worker en curso o esperando a escribirse: la memoria no
+    # depende del tamaño del lote aunque la escritura vaya más lenta que la decodificación
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    leer = functools.partial(campos_imagen, gt_dir=gt_dir, xml_dir=xml_dir, ajustes=ajustes)
+    en_vuelo = EN_VUELO_POR_WORKER * workers if pool is not None else 0
+    try:
+        leidas = entrada_salida.leer_por_adelantado(rutas, leer, en_vuelo, pool)
+        for i, (ruta, resultado, error) in enumerate(leidas, 1):
+            print(f"[{i}/{len(rutas)}] {ruta.name}...", end=" ", flush=True)
+            if error is not None:
+                raise error
+            sha256, campos = resultado
+            imagenes[ruta.name] = {"sha256": sha256, "campos": escritor.escribir(campos)}
+            print(", ".join("xml" if c == "areas" else c for c in campos if c not in CAMPOS_REGIONES[1:]))
+    finally:
+        escritor.cerrar()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    indice = {
+        "version": VERSION_PAQUETE,
+        "fragmentos": escritor.fragmentos,
+        "origen": {
+            "entrada": segmentar.ENTRADA, "carpeta_entrada": str(segmentar.INPUT_DIR),
+            "gt_colors": str(gt_dir), "xml": str(xml_dir),
+        },
+        "imagenes": imagenes,
+    }
+    with open(temporal / INDICE, "w", encoding="utf-8") as f:
+        json.dump(indice, f)
+    # Sustituye el paquete anterior (los procesos que lo tengan abierto siguen leyendo sus fragmentos)
+    if destino.exists():
+        antiguo = destino.with_name(f"{destino.name}.{os.getpid()}.old")
+        os.replace(destino, antiguo)
+        os.replace(temporal, destino)
+        shutil.rmtree(antiguo, ignore_errors=True)
+    else:
+        os.replace(temporal, destino)
+    return indice
+
+
+def main():
+    import segmentar
+
+    parser = argparse.ArgumentParser(description="Empaqueta el lote (canal H, GT y XML) en fragmentos para leerlo como memmap")
+    parser.add_argument("--destino", default=PAQUETE_DIR, help="Carpeta del paquete")
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1,
+        help="Procesos que decodifican en paralelo (1 = secuencial, 0 = todos los núcleos de CPU)",
+    )
+    parser.add_argument(
+        "--tamano-fragmento-mb", type=int, default=TAMANO_FRAGMENTO >> 20,
+        help="Tamaño máximo de cada fragmento (MB)",
+    )
+    parser.add_argument(
+        "--entrada", choices=segmentar.ENTRADAS, default=segmentar.ENTRADA,
+        help="h: imágenes del canal H ya extraído; he: escaneos H&E en RGB (se empaqueta su canal H)",
+    )
+    parser.add_argument("--carpeta-entrada", default=segmentar.INPUT_DIR, help="Carpeta con las imágenes de entrada")
+    args = parser.parse_args()
+
+    segmentar.ENTRADA = args.entrada
+    segmentar.INPUT_DIR = args.carpeta_entrada
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    indice = empaquetar(Path(args.destino), workers, args.tamano_fragmento_mb << 20)
+    if indice is None:
+        sys.exit(1)
+    tamano = sum((Path(args.destino) / f).stat().st_size for f in indice["fragmentos"])
+    print(f"\n{len(indice['imagenes'])} imágenes en {len(indice['fragmentos'])} fragmentos ({tamano / 2**20:.1f} MB): {args.destino}/")
+
+
+if __name__ == "__main__":
+    main()
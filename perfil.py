@@ -0,0 +1,136 @@
+"""
+Instrumentación por etapas (--profile): tiempo real, tiempo de CPU y memoria pico por etapa e imagen.
+
+Uso en el código:
+    with perfil.etapa("watershed"):
+        ...
+Desactivada (por defecto) `etapa()` devuelve un contexto vacío compartido: solo cuesta una llamada a función.
+Activada (`activar()`) cada etapa añade un registro con:
+  - imagen, etapa, pid
+  - tiempo_s (perf_counter), cpu_s (process_time)
+  - pico_mem_mb: pico de memoria reservada por Python/numpy durante la etapa (tracemalloc), sobre la del inicio
+  - rss_max_mb: máximo de RSS del proceso hasta el final de la etapa (getrusage; es acumulado, nunca baja)
+Las etapas se pueden anidar: el pico de la etapa exterior incluye el de las interiores.
+Activada, tracemalloc ralentiza las etapas que reservan mucha memoria: los tiempos sirven para comparar etapas
+entre sí, no como tiempo absoluto del lote (para eso, rendimiento.py).
+Los registros se guardan por proceso; los workers los devuelven con `recoger()` junto a su resultado.
+"""
+
+import contextlib
+import csv
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import diferido
+
+np = diferido.modulo("numpy")
+
+ACTIVO = False
+TRAZA_POR_DEFECTO = "perfil.jsonl"
+CAMPOS = ["imagen", "etapa", "pid", "tiempo_s", "cpu_s", "pico_mem_mb", "rss_max_mb"]
+
+_NULO = contextlib.nullcontext()
+_registros = []
+_pila = []          # etapas abiertas: [pico acumulado de las etapas interiores]
+_imagen_actual = ""
+
+
+def activar():
+    #Activa la instrumentación en este proceso (también se usa como initializer de los pools)
+    global ACTIVO
+    ACTIVO = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def imagen(nombre: str):
+    #Imagen a la que se asignan las etapas siguientes
+    global _imagen_actual
+    _imagen_actual = nombre
+
+
+def etapa(nombre: str):
+    #Contexto que mide una etapa con nombre (contexto vacío si la instrumentación está desactivada)
+    if not ACTIVO:
+        return _NULO
+    return _medir(nombre)
+
+
+@contextlib.contextmanager
+def _medir(nombre: str):
+    memoria_inicio, pico_previo = tracemalloc.get_traced_memory()
+    if _pila:
+        # El pico de la etapa exterior hasta ahora se guarda antes de reiniciarlo para esta
+        _pila[-1] = max(_pila[-1], pico_previo)
+    _pila.append(0)
+    tracemalloc.reset_peak()
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        tiempo, cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+        pico = max(_pila.pop(), tracemalloc.get_traced_memory()[1])
+        if _pila:
+            _pila[-1] = max(_pila[-1], pico)
+        _registros.append({
+            "imagen": _imagen_actual,
+            "etapa": nombre,
+            "pid": os.getpid(),
+            "tiempo_s": tiempo,
+            "cpu_s": cpu,
+            "pico_mem_mb": max(pico - memoria_inicio, 0) / 2**20,
+            "rss_max_mb": _rss_max_mb(),
+        })
+
+
+def _rss_max_mb() -> float:
+    #RSS máximo del proceso (ru_maxrss: KiB en Linux, bytes en macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def recoger() -> list[dict]:
+    #Devuelve y vacía los registros de este proceso
+    registros = _registros[:]
+    _registros.clear()
+    return registros
+
+
+def escribir_traza(registros: list[dict], ruta: Path):
+    #Escribe los registros en JSONL (una línea por etapa) o CSV según la extensión
+    ruta = Path(ruta)
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        if ruta.suffix == ".csv":
+            writer = csv.DictWriter(f, fieldnames=CAMPOS)
+            writer.writeheader()
+            writer.writerows(registros)
+        else:
+            for registro in registros:
+                f.write(json.dumps(registro) + "\n")
+
+
+def mostrar_resumen(registros: list[dict]):
+    #Resumen por etapa: nº de medidas, total, p50/p95 de tiempo real y de CPU, y pico de memoria máximo
+    if not registros:
+        return
+    por_etapa = {}
+    for r in registros:
+        por_etapa.setdefault(r["etapa"], []).append(r)
+
+    print("\n" + "=" * 94)
+    print("PERFIL POR ETAPA")
+    print("=" * 94)
+    print(f"{'etapa':<18} {'n':>4} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} {'cpu p50 ms':>11} {'cpu p95 ms':>11} {'pico MB':>9}")
+    for nombre, lista in sorted(por_etapa.items(), key=lambda e: -sum(r["tiempo_s"] for r in e[1])):
+        tiempos = np.array([r["tiempo_s"] for r in lista]) * 1000
+        cpu = np.array([r["cpu_s"] for r in lista]) * 1000
+        p50, p95 = np.percentile(tiempos, [50, 95])
+        cpu50, cpu95 = np.percentile(cpu, [50, 95])
+        pico = max(r["pico_mem_mb"] for r in lista)
+        print(f"{nombre:<18} {len(lista):>4} {tiempos.sum() / 1000:>9.2f} {p50:>9.1f} {p95:>9.1f} {cpu50:>11.1f} {cpu95:>11.1f} {pico:>9.1f}")
+    print(f"RSS máximo: {max(r['rss_max_mb'] for r in registros):.0f} MB (por proceso)")
@@ -0,0 +1,254 @@
+"""
+Benchmark por etapas de la segmentación sobre imágenes sintéticas (sinteticas.py).
+
+Flujo:
+1) Para cada tamaño de imagen y densidad de núcleos genera una imagen H sintética determinista.
+2) Cronometra cada etapa por separado (REPETICIONES veces, mínimo y mediana):
+     modas (detectar_modas_hist) -> watershed (pipeline_watershed) -> fusion (unir_fragmentos)
+     -> relleno (rellenar_por_contorno) -> coloreado (crear_imagen_coloreada)
+3) Escribe los tiempos y el entorno (versiones, CPU) en JSON.
+   Con --memoria, en su lugar: pico de memoria (tracemalloc) de la segmentación completa en modo normal y en
+   modo de baja memoria (segmentar.BAJA_MEMORIA), en MB y MB por megapíxel, y si los labels de ambos coinciden
+   (AJI >= TOLERANCIA_LABELS; si no, código de salida 1).
+4) Con --comparar BASE.json marca como regresión toda etapa cuyo tiempo mínimo supere el de la base en más de
+   TOLERANCIA (y en más de MARGEN_ABSOLUTO_S, para ignorar el ruido de las etapas muy rápidas); sale con código 1.
+   Se compara el mínimo y no la mediana porque es mucho menos sensible a la carga de la máquina.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import scipy
+import skimage
+
+import evaluar
+import segmentar
+from sinteticas import generar_imagen_h, nucleos_para_densidad
+
+TAMANOS = [256, 512, 1024]          # Lado de la imagen (px)
+DENSIDADES = [400, 1600]            # Núcleos por megapíxel
+REPETICIONES = 5
+TOLERANCIA = 0.15                   # Regresión si mínimo > base * (1 + TOLERANCIA)
+MARGEN_ABSOLUTO_S = 0.002           # ... y además la diferencia supera este margen
+SALIDA_JSON = "rendimiento.json"
+ETAPAS = ["modas", "watershed", "fusion", "relleno", "coloreado"]
+TOLERANCIA_LABELS = 0.999           # --memoria: AJI mínimo de los labels de baja memoria frente a los normales
+
+
+def entorno() -> dict:
+    #Versiones y máquina (para saber si dos JSON son comparables)
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "skimage": skimage.__version__,
+        "opencv": cv2.__version__,
+        "plataforma": platform.platform(),
+        "procesador": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "version_pipeline": segmentar.VERSION_PIPELINE,
+    }
+
+
+def medir(funcion, repeticiones: int):
+    #Ejecuta funcion() `repeticiones` veces; devuelve (último resultado, lista de tiempos en s)
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, tiempos
+
+
+def medir_caso(lado: int, densidad: float, repeticiones: int = REPETICIONES, semilla: int = 0) -> dict:
+    #Cronometra cada etapa del pipeline sobre una imagen sintética lado x lado
+    num_nucleos = nucleos_para_densidad(lado, lado, densidad)
+    imagen_gris, _ = generar_imagen_h(lado, lado, num_nucleos, semilla)
+    imagen_color = cv2.cvtColor(imagen_gris, cv2.COLOR_GRAY2BGR)
+
+    tiempos = {}
+    modas, tiempos["modas"] = medir(lambda: segmentar.detectar_modas_hist(imagen_gris), repeticiones)
+    (res_wtrshd, _, _, _), tiempos["watershed"] = medir(
+        lambda: segmentar.pipeline_watershed(imagen_gris, modas), repeticiones
+    )
+    fusionado, tiempos["fusion"] = medir(lambda: segmentar.unir_fragmentos(res_wtrshd), repeticiones)
+    etiquetas, tiempos["relleno"] = medir(lambda: segmentar.rellenar_por_contorno(fusionado), repeticiones)
+    _, tiempos["coloreado"] = medir(lambda: segmentar.crear_imagen_coloreada(etiquetas, imagen_color), repeticiones)
+
+    return {
+        "alto": lado,
+        "ancho": lado,
+        "densidad": densidad,
+        "nucleos_generados": num_nucleos,
+        "nucleos_detectados": int(np.unique(etiquetas).size - 1),
+        "semilla": semilla,
+        "etapas": {
+            etapa: {"min_s": min(t), "mediana_s": statistics.median(t)} for etapa, t in tiempos.items()
+        },
+    }
+
+
+def medir_memoria(lado: int, densidad: float, semilla: int = 0) -> dict:
+    #Pico de memoria de segmentar_en_memoria en modo normal y de baja memoria, y parecido entre sus labels
+    num_nucleos = nucleos_para_densidad(lado, lado, densidad)
+    imagen_gris, _ = generar_imagen_h(lado, lado, num_nucleos, semilla)
+    imagenes = (cv2.cvtColor(imagen_gris, cv2.COLOR_GRAY2BGR), imagen_gris)
+    ruta = Path(f"sintetica_{lado}.png")
+
+    picos_mb, etiquetas = {}, {}
+    for baja_memoria in (False, True):
+        segmentar.BAJA_MEMORIA = baja_memoria
+        segmentar.segmentar_en_memoria(ruta, imagenes)  # calentamiento: imports diferidos y cachés internas
+        tracemalloc.start()
+        inicial = tracemalloc.get_traced_memory()[0]
+        seg = segmentar.segmentar_en_memoria(ruta, imagenes)
+        picos_mb[baja_memoria] = (tracemalloc.get_traced_memory()[1] - inicial) / 2**20
+        tracemalloc.stop()
+        etiquetas[baja_memoria] = seg["etiquetas"]
+        del seg
+    segmentar.BAJA_MEMORIA = False
+
+    normal, baja = etiquetas[False], etiquetas[True]
+    identicos = np.array_equal(normal, baja)
+    megapixeles = lado * lado / 1e6
+    return {
+        "lado": lado,
+        "densidad": densidad,
+        "pico_normal_mb": picos_mb[False],
+        "pico_baja_mb": picos_mb[True],
+        "mb_por_mp_normal": picos_mb[False] / megapixeles,
+        "mb_por_mp_baja": picos_mb[True] / megapixeles,
+        "dtype_normal": str(normal.dtype),
+        "dtype_baja": str(baja.dtype),
+        "identicos": identicos,
+        "aji": 1.0 if identicos else evaluar.calcular_metricas_instancia(baja, normal, (0.5,))["aji"],
+    }
+
+
+def mostrar_memoria(casos: list[dict]):
+    #Tabla de picos de memoria por caso: normal frente a baja memoria
+    print(f"\n{'caso':>20} {'normal MB':>10} {'MB/MP':>7} {'baja MB':>9} {'MB/MP':>7} {'ahorro':>7} {'labels':>16}  iguales")
+    for c in casos:
+        nombre = f"{c['lado']}x{c['lado']} ({c['densidad']:g}/MP)"
+        iguales = "sí" if c["identicos"] else f"AJI {c['aji']:.4f}"
+        print(
+            f"{nombre:>20} {c['pico_normal_mb']:>10.1f} {c['mb_por_mp_normal']:>7.1f} {c['pico_baja_mb']:>9.1f} "
+            f"{c['mb_por_mp_baja']:>7.1f} {1 - c['pico_baja_mb'] / c['pico_normal_mb']:>6.0%} "
+            f"{c['dtype_normal'] + '->' + c['dtype_baja']:>16}  {iguales}"
+        )
+
+
+def clave_caso(caso: dict):
+    #Identifica un caso para emparejarlo entre dos JSON
+    return caso["alto"], caso["ancho"], caso["densidad"]
+
+
+def comparar(actual: dict, base: dict, tolerancia: float = TOLERANCIA) -> list[str]:
+    #Devuelve las regresiones (texto) de `actual` respecto a `base` en los casos comunes
+    casos_base = {clave_caso(c): c for c in base["casos"]}
+    regresiones = []
+    for caso in actual["casos"]:
+        previo = casos_base.get(clave_caso(caso))
+        if previo is None:
+            continue
+        for etapa, t in caso["etapas"].items():
+            if etapa not in previo["etapas"]:
+                continue
+            t_base = previo["etapas"][etapa]["min_s"]
+            t_actual = t["min_s"]
+            if t_actual > t_base * (1 + tolerancia) and t_actual - t_base > MARGEN_ABSOLUTO_S:
+                regresiones.append(
+                    f"{caso['ancho']}x{caso['alto']} densidad={caso['densidad']:g} {etapa}: "
+                    f"{t_base * 1000:.1f} ms -> {t_actual * 1000:.1f} ms (x{t_actual / t_base:.2f})"
+                )
+    return regresiones
+
+
+def mostrar_tabla(resultado: dict, base: dict | None = None):
+    #Tabla de tiempos mínimos por caso y etapa (con la razón frente a la base si se da)
+    casos_base = {clave_caso(c): c for c in base["casos"]} if base else {}
+    print(f"\n{'caso':>22} " + " ".join(f"{etapa:>14}" for etapa in ETAPAS))
+    for caso in resultado["casos"]:
+        previo = casos_base.get(clave_caso(caso))
+        celdas = []
+        for etapa in ETAPAS:
+            t = caso["etapas"][etapa]["min_s"] * 1000
+            if previo and etapa in previo["etapas"]:
+                celdas.append(f"{t:7.1f}ms x{t / (previo['etapas'][etapa]['min_s'] * 1000):.2f}")
+            else:
+                celdas.append(f"{t:12.1f}ms")
+        nombre = f"{caso['ancho']}x{caso['alto']} ({caso['nucleos_generados']} n)"
+        print(f"{nombre:>22} " + " ".join(f"{c:>14}" for c in celdas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapas de la segmentación con imágenes sintéticas")
+    parser.add_argument("--tamanos", default=",".join(map(str, TAMANOS)), help="Lados de imagen separados por comas")
+    parser.add_argument("--densidades", default=",".join(map(str, DENSIDADES)), help="Núcleos por megapíxel")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", default=SALIDA_JSON, help="JSON de resultados")
+    parser.add_argument("--comparar", metavar="BASE.json", help="Marca regresiones frente a un JSON guardado")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA, help="Aumento relativo permitido (0.15 = 15%%)")
+    parser.add_argument(
+        "--memoria", action="store_true",
+        help="Mide el pico de memoria por megapíxel en modo normal y de baja memoria y compara sus labels",
+    )
+    args = parser.parse_args()
+
+    tamanos = [int(t) for t in args.tamanos.split(",")]
+    densidades = [float(d) for d in args.densidades.split(",")]
+    if args.memoria:
+        casos = []
+        for lado in tamanos:
+            for densidad in densidades:
+                print(f"Midiendo memoria {lado}x{lado}, densidad {densidad:g}/MP...", flush=True)
+                casos.append(medir_memoria(lado, densidad, args.semilla))
+        mostrar_memoria(casos)
+        distintos = [c for c in casos if c["aji"] < TOLERANCIA_LABELS]
+        if distintos:
+            print(f"\nLABELS DISTINTOS en baja memoria (AJI < {TOLERANCIA_LABELS}) en {len(distintos)} casos")
+            sys.exit(1)
+        print(f"\nLabels de baja memoria dentro de tolerancia (AJI >= {TOLERANCIA_LABELS}) en todos los casos")
+        return
+    resultado = {"entorno": entorno(), "repeticiones": args.repeticiones, "casos": []}
+
+    for lado in tamanos:
+        for densidad in densidades:
+            print(f"Midiendo {lado}x{lado}, densidad {densidad:g}/MP...", flush=True)
+            resultado["casos"].append(medir_caso(lado, densidad, args.repeticiones, args.semilla))
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2)
+
+    base = None
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        if base["entorno"] != resultado["entorno"]:
+            print("AVISO: la base se midió en otro entorno (versiones/CPU); la comparación es orientativa")
+
+    mostrar_tabla(resultado, base)
+    print(f"\nResultados guardados en: {args.salida}")
+
+    if base is not None:
+        regresiones = comparar(resultado, base, args.tolerancia)
+        if regresiones:
+            print(f"\nREGRESIONES (> {args.tolerancia:.0%} respecto a {args.comparar}):")
+            for r in regresiones:
+                print(f"  {r}")
+            sys.exit(1)
+        print(f"\nSin regresiones respecto a {args.comparar} (tolerancia {args.tolerancia:.0%})")
+
+
+if __name__ == "__main__":
+    main()
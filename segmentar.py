@@ -1,27 +1,56 @@
 """
 Flujo:
-1) Cargar canal H en escala de grises.
+1) Cargar canal H en escala de grises. Con --entrada he la entrada son escaneos H&E en RGB y el canal H sale de una
+   deconvolución de color por bloques (deconvolucion.py), opcionalmente en caché como memmap (--cache-h).
+   Con --paquete las imágenes se leen por nombre del paquete del lote (paquete.py), sin abrir ni decodificar PNG.
 2) filtro por imagen: Otsu si el histograma tiene 2 picos; Multi-Otsu (3 clases) si detecta mas de 3 picos (usa la clase más oscura).
 3) Limpieza previa: elimina ruido (objetos pequeños), rellena huecos y erosiona ligeramente.
-4) picos locales como marcadores -> watershed
+4) picos locales como marcadores (detector intercambiable, semillas.py) -> watershed
+   Con --piramide FACTOR (grueso a fino): umbral, mapa de distancia y semillas sobre la imagen reducida FACTOR
+   veces; las semillas se escalan y el watershed refina a resolución completa dentro de la máscara.
+   Con --baja-memoria: distancias float32, labels con el dtype entero mínimo y sin copias (ver BAJA_MEMORIA).
 5) Postprocesado opcional: fusionar fragmentos que comparten borde y rellenar contorno externo.
-6) Guardar pasos intermedios y CSV con conteos/áreas.
+6) Guardar pasos intermedios, mapa de labels (4_etiquetas.npz) y CSV con conteos/áreas.
+   Con --workers 1 la lectura (por adelantado) y la escritura de PNG van en hilos, solapadas con el cálculo.
 """
 
+from __future__ import annotations
+
+import argparse
 import csv
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
-import cv2
-import numpy as np
-from scipy import ndimage
-from scipy.signal import find_peaks
-from skimage import feature, filters, measure, morphology, segmentation, util
+import cache_segmentacion
+import deconvolucion
+import diferido
+import entrada_salida
+import morfometria
+import paquete
+import perfil
+import semillas
+
+# Dependencias pesadas: se importan en el primer uso (diferido.py)
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+ndimage = diferido.modulo("scipy.ndimage")
+signal = diferido.modulo("scipy.signal")
+filters = diferido.modulo("skimage.filters")
+measure = diferido.modulo("skimage.measure")
+morphology = diferido.modulo("skimage.morphology")
+segmentation = diferido.modulo("skimage.segmentation")
+util = diferido.modulo("skimage.util")
 
 # Parametros globales
 MIN_DISTANCE = 5            # Distancia mínima entre picos
 AREA_MIN_NUCLEO = 50        # Filtro de ruido (px²)
 DIST_SMOOTH_SIGMA = 1.2     # Suavizado del mapa de distancia
+DETECTOR_SEMILLAS = "picos" # Detector de semillas del watershed (semillas.py): picos, maximo o hmaxima
+H_MAXIMA = 0.3              # Prominencia mínima de una semilla con el detector hmaxima (px de distancia)
 
 # filtroización adaptativa por modas (Otsu/Multi-Otsu)
 PROMINENCIA_MODAS = 0.001   # Sensibilidad para hallar picos
@@ -31,14 +60,63 @@ SIGMA_HIST = 1.5            # Suavizado del histograma
 # Post-procesado
 THRESHOLD_CONTACTO = 0.2    # Fusión si contacto > 20% del perímetro
 
+# Modo pirámide (grueso a fino): umbral, mapa de distancia y semillas sobre la imagen reducida FACTOR_PIRAMIDE
+# veces; el watershed refina a resolución completa. 1 = todo a resolución completa
+FACTOR_PIRAMIDE = 1
+
+# Modo de baja memoria: mapas de distancia float32 (EDT de OpenCV), watershed por franjas sobre el mapa negado en
+# el sitio, labels con el dtype entero mínimo y relleno sin copia. Pico de memoria de la segmentación completa
+# (tracemalloc, `rendimiento.py --memoria`, imágenes sintéticas de 0.26 a 4.2 MP): ~42 MB/MP normal frente a
+# ~27 MB/MP en baja memoria (el pico pasa a ser la detección de semillas). Labels idénticos salvo empates aislados
+# (AJI >= 0.9999 frente al modo normal)
+BAJA_MEMORIA = False
+FILAS_FRANJA = 256          # Baja memoria: alto aproximado de las franjas en las que se ejecuta el watershed
+
+# Entrada: "h" = canal H ya extraído (gris directo), "he" = escaneo H&E en RGB (deconvolución de color)
+ENTRADAS = ("h", "he")
+ENTRADA = "h"
+CACHE_CANAL_H = None        # Entrada he: carpeta de la caché del canal H (memmap .npy); None = sin caché
+PAQUETE = None              # Carpeta del paquete del lote (paquete.py) del que leer las imágenes; None = INPUT_DIR
+
+# Versión del algoritmo: subirla al cambiar el pipeline invalida la caché de resultados
+VERSION_PIPELINE = 2
+
 # Directorios
 INPUT_DIR = "Material Celulas/H"
 OUTPUT_DIR = "visualizaciones"
 RESULTADOS_CSV = "resultados.csv"
+SELLO_CACHE = ".clave_cache"  # en visualizaciones/<img>/: clave de caché de las salidas escritas
+
+
+def parametros_efectivos() -> dict:
+    #Globales que determinan el resultado de la segmentación (forman parte de la clave de caché)
+    return {
+        "MIN_DISTANCE": MIN_DISTANCE,
+        "AREA_MIN_NUCLEO": AREA_MIN_NUCLEO,
+        "DIST_SMOOTH_SIGMA": DIST_SMOOTH_SIGMA,
+        "DETECTOR_SEMILLAS": DETECTOR_SEMILLAS,
+        "H_MAXIMA": H_MAXIMA,
+        "PROMINENCIA_MODAS": PROMINENCIA_MODAS,
+        "DISTANCIA_MODAS": DISTANCIA_MODAS,
+        "SIGMA_HIST": SIGMA_HIST,
+        "THRESHOLD_CONTACTO": THRESHOLD_CONTACTO,
+        "FACTOR_PIRAMIDE": FACTOR_PIRAMIDE,
+        "BAJA_MEMORIA": BAJA_MEMORIA,
+        "ENTRADA": ENTRADA,
+    }
 
 
 def cargar_imagen(ruta_imagen: str):
     #Lee la imagen H, devuelve (RGB y gris).
+    # Con ENTRADA "he" la imagen es un escaneo H&E y el gris es su canal H (deconvolucion.py)
+    # Con PAQUETE, el gris es una vista del paquete; el color no se empaqueta y se devuelve el gris en su lugar
+    # (de la imagen original solo se usa el dtype)
+    if PAQUETE is not None:
+        gris = paquete.abrir(PAQUETE).leer(Path(ruta_imagen).name, "h")
+        if gris is not None:
+            return gris, gris
+    if ENTRADA == "he":
+        return deconvolucion.cargar_he(ruta_imagen, CACHE_CANAL_H)
     imagen_color = cv2.imread(ruta_imagen)
     if imagen_color is None:
         raise FileNotFoundError(f"No se pudo leer la imagen: {ruta_imagen}")
@@ -46,153 +124,410 @@ def cargar_imagen(ruta_imagen: str):
     return imagen_color, imagen_gris
 
 
+def listar_entradas() -> list[Path]:
+    #Imágenes del lote: las del paquete (PAQUETE) o los PNG de INPUT_DIR
+    if PAQUETE is not None:
+        return [Path(INPUT_DIR) / nombre for nombre in paquete.abrir(PAQUETE).nombres()]
+    return sorted(Path(INPUT_DIR).glob("*.png"))
+
+
+def hash_entrada(ruta: Path, indice: dict) -> str:
+    #sha256 de la imagen para la clave de caché: el guardado en el paquete o el de los bytes del archivo
+    if PAQUETE is not None:
+        digest = paquete.abrir(PAQUETE).hash(ruta.name)
+        if digest is not None:
+            return digest
+    return cache_segmentacion.hash_archivo(ruta, indice)
+
+
+def usar_paquete(carpeta):
+    #Activa el paquete del lote: las imágenes salen de él y ENTRADA pasa a ser la que se usó al empaquetar
+    global PAQUETE, ENTRADA
+    PAQUETE = str(carpeta)
+    ENTRADA = paquete.abrir(PAQUETE).origen["entrada"]
+
+
 def detectar_modas_hist(imagen_gris: np.ndarray):
     #Detecta nº de modas del histograma y devuelve (num_picos, filtro, metodo)
-    hist, _ = np.histogram(imagen_gris, bins=256, range=(0, 255), density=True)
+    return detectar_modas_conteos(np.bincount(imagen_gris.ravel(), minlength=256))
+
+
+def detectar_modas_conteos(conteos: np.ndarray, sigma_hist=None, prominencia=None, distancia=None):
+    #Igual que detectar_modas_hist pero desde los conteos por nivel de gris (0..255),
+    # que se pueden acumular por partes (p. ej. tesela a tesela)
+    # sigma_hist/prominencia/distancia: None = SIGMA_HIST/PROMINENCIA_MODAS/DISTANCIA_MODAS
+    sigma_hist = SIGMA_HIST if sigma_hist is None else sigma_hist
+    prominencia = PROMINENCIA_MODAS if prominencia is None else prominencia
+    distancia = DISTANCIA_MODAS if distancia is None else distancia
+
+    niveles = np.arange(256)
+    hist, _ = np.histogram(niveles, bins=256, range=(0, 255), weights=conteos, density=True)
     # Suavizado del histograma
-    hist_smooth = ndimage.gaussian_filter1d(hist, sigma=SIGMA_HIST)
-    peaks, _ = find_peaks(hist_smooth, prominence=PROMINENCIA_MODAS, distance=DISTANCIA_MODAS)
+    hist_smooth = ndimage.gaussian_filter1d(hist, sigma=sigma_hist)
+    peaks, _ = signal.find_peaks(hist_smooth, prominence=prominencia, distance=distancia)
     num_picos = len(peaks)
 
     if num_picos >= 3:
         try:
-            thresholds = filters.threshold_multiotsu(imagen_gris, classes=3)
+            thresholds = filters.threshold_multiotsu(hist=(conteos / conteos.sum(), niveles), classes=3)
             umbral = thresholds[0]  # clase más oscura (la que nos interesa)
             metodo = "multiotsu_3clases"
         except Exception:
-            umbral = filters.threshold_otsu(imagen_gris)
+            umbral = _umbral_otsu(conteos)
             metodo = "otsu"
     else:
-        umbral = filters.threshold_otsu(imagen_gris)
+        umbral = _umbral_otsu(conteos)
         metodo = "otsu"
 
     return num_picos, umbral, metodo
 
 
-def pipeline_watershed(imagen_gris: np.ndarray):
+def _umbral_otsu(conteos: np.ndarray):
+    #Otsu sobre el histograma; si solo hay un nivel de gris devuelve ese nivel (como threshold_otsu con imagen)
+    niveles_presentes = np.flatnonzero(conteos)
+    if niveles_presentes.size == 1:
+        return niveles_presentes[0]
+    return filters.threshold_otsu(hist=(conteos, np.arange(256)))
+
+
+def mascara_limpia(imagen_gris: np.ndarray, umbral, area_min: int) -> np.ndarray:
+    # Máscara binaria de la imagen de gris que pasa el umbral + limpieza previa (ruido y huecos)
+    with perfil.etapa("umbral"):
+        mask = imagen_gris < umbral
+    with perfil.etapa("limpieza"):
+        mask = morphology.remove_small_objects(mask, min_size=area_min)
+        mask = morphology.remove_small_holes(mask, area_threshold=50)
+        mask = cv2.erode(mask.astype(np.uint8), np.ones((2, 2), np.uint8), iterations=1) > 0 #necesaria, si no el área se dispara
+    return mask
+
+
+def marcadores_por_picos(distance_smooth: np.ndarray, mask: np.ndarray, min_distance: int, h=None) -> np.ndarray:
+    # Semillas (marcadores para watershed) en el mapa de distancia, limitadas a la máscara
+    # Detector DETECTOR_SEMILLAS (semillas.py); h: prominencia de hmaxima (None = H_MAXIMA)
+    return semillas.marcadores(DETECTOR_SEMILLAS, distance_smooth, mask, min_distance, H_MAXIMA if h is None else h)
+
+
+def pipeline_watershed(imagen_gris: np.ndarray, modas=None, factor=None):
     # Segmenta una imagen gris con watershed
+    # modas: (num_picos, filtro, metodo) ya calculado; si es None se calcula sobre esta imagen
+    # factor: reducción del modo pirámide (None = FACTOR_PIRAMIDE; 1 = todo a resolución completa)
+    factor = FACTOR_PIRAMIDE if factor is None else int(factor)
+    if factor > 1:
+        return pipeline_piramide(imagen_gris, factor, modas)
+
     # 1) Umbral por modas
-    num_picos, umbral, metodo_umbral = detectar_modas_hist(imagen_gris)
-    # Máscara binaria de la imagen de gris que pasa el umbral
-    mask = imagen_gris < umbral
+    with perfil.etapa("modas"):
+        num_picos, umbral, metodo_umbral = modas if modas is not None else detectar_modas_hist(imagen_gris)
 
     # 2) Limpieza previa (ruido y huecos)
-    mask = morphology.remove_small_objects(mask, min_size=AREA_MIN_NUCLEO)
-    mask = morphology.remove_small_holes(mask, area_threshold=50)
-    mask = cv2.erode(mask.astype(np.uint8), np.ones((2, 2), np.uint8), iterations=1) > 0 #necesaria, si no el área se dispara
+    mask = mascara_limpia(imagen_gris, umbral, AREA_MIN_NUCLEO)
 
     # 3) Distancia + picos -> marcadores
-    distance = ndimage.distance_transform_edt(mask)
-    distance_smooth = ndimage.gaussian_filter(distance, sigma=DIST_SMOOTH_SIGMA)
-    # Picos locales en el mapa de distancia (semillas) limitados a la máscara
-    coords = feature.peak_local_max(distance_smooth, min_distance=MIN_DISTANCE, labels=mask)
-
-    # Máscara booleana con 1 píxel True por cada pico detectado (candidatos a semilla)
-    mask_peaks = np.zeros(distance.shape, dtype=bool)
-    if hasattr(coords, "size") and coords.size > 0:
-        for (r, c) in np.atleast_2d(coords):
-            mask_peaks[int(r), int(c)] = True
-    # Etiquetar cada pico con un ID entero distinto (marcadores para watershed)
-    markers, _ = ndimage.label(mask_peaks)
+    with perfil.etapa("edt"):
+        distance = mapa_distancia(mask)
+    with perfil.etapa("picos"):
+        distance_smooth = ndimage.gaussian_filter(distance, sigma=DIST_SMOOTH_SIGMA)  # mismo dtype que distance
+        markers = marcadores_por_picos(distance_smooth, mask, MIN_DISTANCE)
+        del distance_smooth
 
     # 4) Watershed
-    res_wtrshd = segmentation.watershed(-distance, markers, mask=mask)
+    with perfil.etapa("watershed"):
+        res_wtrshd = watershed_distancia(distance, markers, mask)
 
     info = {"metodo": metodo_umbral, "filtro": float(umbral), "modas": num_picos}
     # res_wtrshd: imagen segmentada mask: máscara binaria pre watershed distance: mapa de distancia info: info del filtro
     return res_wtrshd, mask, distance, info
 
 
-def unir_fragmentos(res_wtrshd: np.ndarray):
+def pipeline_piramide(imagen_gris: np.ndarray, factor: int, modas=None):
+    # Watershed de grueso a fino; devuelve lo mismo que pipeline_watershed
+    # Umbral por modas, mapa de distancia y semillas se calculan sobre la imagen reducida `factor` veces; las semillas
+    # se llevan a resolución completa y el watershed refina ahí, dentro de la máscara a resolución completa
+    alto, ancho = imagen_gris.shape
+    tamano_reducido = tamano_piramide(imagen_gris.shape, factor)
+    with perfil.etapa("piramide"):
+        gris_reducida = cv2.resize(imagen_gris, tamano_reducido, interpolation=cv2.INTER_AREA)
+
+    # 1) Umbral por modas sobre el histograma de la imagen reducida
+    with perfil.etapa("modas"):
+        num_picos, umbral, metodo_umbral = modas if modas is not None else detectar_modas_hist(gris_reducida)
+
+    # 2) Máscara a resolución completa: fija el contorno final de los núcleos
+    mask = mascara_limpia(imagen_gris, umbral, AREA_MIN_NUCLEO)
+
+    # 3) Distancia + picos en la reducida (sigma y distancia mínima en píxeles reducidos)
+    with perfil.etapa("edt"):
+        mask_reducida = reducir_mascara(mask, factor)
+        distance_reducida = mapa_distancia(mask_reducida)
+    with perfil.etapa("picos"):
+        distance_smooth = ndimage.gaussian_filter(distance_reducida, sigma=DIST_SMOOTH_SIGMA / factor)
+        markers_reducidos = marcadores_por_picos(
+            distance_smooth, mask_reducida, max(1, round(MIN_DISTANCE / factor)), H_MAXIMA / factor
+        )
+
+    # 4) Semillas y mapa de distancia a resolución completa (centro de cada píxel reducido; distancias en px completos)
+    with perfil.etapa("piramide"):
+        filas, cols = np.nonzero(markers_reducidos)
+        escala_f, escala_c = alto / mask_reducida.shape[0], ancho / mask_reducida.shape[1]
+        filas = np.minimum(((filas + 0.5) * escala_f).astype(np.intp), alto - 1)
+        cols = np.minimum(((cols + 0.5) * escala_c).astype(np.intp), ancho - 1)
+        markers = np.zeros(imagen_gris.shape, dtype=np.int32)
+        markers[filas, cols] = markers_reducidos[np.nonzero(markers_reducidos)]
+        distance = ampliar_distancia(distance_reducida, imagen_gris.shape)
+
+    # 5) Watershed a resolución completa, solo dentro de la máscara
+    with perfil.etapa("watershed"):
+        res_wtrshd = watershed_distancia(distance, markers, mask)
+
+    info = {"metodo": metodo_umbral, "filtro": float(umbral), "modas": num_picos}
+    return res_wtrshd, mask, distance, info
+
+
+def tamano_piramide(forma, factor: int):
+    # (ancho, alto) de la imagen reducida `factor` veces en el modo pirámide (orden de cv2.resize)
+    alto, ancho = forma
+    return max(1, round(ancho / factor)), max(1, round(alto / factor))
+
+
+def reducir_mascara(mask: np.ndarray, factor: int) -> np.ndarray:
+    # Máscara reducida `factor` veces (mayoría de cada bloque) para la distancia y las semillas del modo pirámide
+    reducida = cv2.resize(mask.astype(np.uint8) * 255, tamano_piramide(mask.shape, factor), interpolation=cv2.INTER_AREA)
+    return reducida > 127
+
+
+def ampliar_distancia(distance_reducida: np.ndarray, forma) -> np.ndarray:
+    # Mapa de distancia reducido llevado a resolución completa (float32, distancias en píxeles completos)
+    alto, ancho = forma
+    escala_f = alto / distance_reducida.shape[0]
+    return cv2.resize(
+        distance_reducida.astype(np.float32), (ancho, alto), interpolation=cv2.INTER_LINEAR
+    ) * np.float32(escala_f)
+
+
+def distancia_de_mascara(mask: np.ndarray, factor=None) -> np.ndarray:
+    # Mapa de distancia a resolución completa tal como lo devuelve pipeline_watershed para esta máscara
+    # (FACTOR_PIRAMIDE y BAJA_MEMORIA incluidos); sirve para rehacer 3_mapa_distancia.png sin segmentar
+    factor = FACTOR_PIRAMIDE if factor is None else int(factor)
+    if factor > 1:
+        return ampliar_distancia(mapa_distancia(reducir_mascara(mask, factor)), mask.shape)
+    return mapa_distancia(mask)
+
+
+def mapa_distancia(mask: np.ndarray) -> np.ndarray:
+    # Transformada de distancia euclídea de la máscara: float64 (scipy) o, con BAJA_MEMORIA, float32 con la
+    # transformada exacta de OpenCV (sin los índices int32 intermedios de scipy)
+    if not BAJA_MEMORIA or mask.all():  # sin fondo OpenCV no tiene referencia (devuelve ~1e19)
+        distance = ndimage.distance_transform_edt(mask)
+        return distance.astype(np.float32) if BAJA_MEMORIA else distance
+    distance = cv2.distanceTransform(mask.view(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    # OpenCV se desvía ~1e-6 px: se ajusta a sqrt(entero) en el sitio para que las distancias iguales sigan siendo
+    # iguales (mismos empates, y mismo orden de inundación, que con scipy)
+    np.square(distance, out=distance)
+    np.rint(distance, out=distance)
+    np.sqrt(distance, out=distance)
+    return distance
+
+
+def watershed_distancia(distance: np.ndarray, markers: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # Watershed sobre -distance. Con BAJA_MEMORIA niega el mapa en el sitio (y lo restaura) en lugar de crear la
+    # copia negada, inunda por franjas y devuelve los labels con el dtype entero mínimo
+    if not BAJA_MEMORIA:
+        return segmentation.watershed(-distance, markers, mask=mask)
+    np.negative(distance, out=distance)
+    try:
+        return _watershed_por_franjas(distance, markers, mask, tipo_etiquetas(int(markers.max(initial=0))))
+    finally:
+        np.negative(distance, out=distance)
+
+
+def _watershed_por_franjas(paisaje: np.ndarray, markers: np.ndarray, mask: np.ndarray, dtype) -> np.ndarray:
+    # Una cuenca nunca pasa de una componente conexa de la máscara a otra: las componentes (enteras) se agrupan en
+    # franjas horizontales de ~FILAS_FRANJA filas y cada franja se inunda solo sobre las suyas. Mismo resultado que
+    # sobre la imagen completa, pero las copias internas de skimage (float64, con borde) son del tamaño de la franja
+    componentes, n = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+    cajas = ndimage.find_objects(componentes)
+    franjas = []  # [fila inicial, fila final, labels de componente]
+    for i in sorted(range(n), key=lambda i: cajas[i][0].start):
+        filas = cajas[i][0]
+        if franjas and max(franjas[-1][1], filas.stop) - franjas[-1][0] <= FILAS_FRANJA:
+            franjas[-1][1] = max(franjas[-1][1], filas.stop)
+            franjas[-1][2].append(i + 1)
+        else:
+            franjas.append([filas.start, filas.stop, [i + 1]])
+
+    res_wtrshd = np.zeros(mask.shape, dtype=dtype)
+    seleccion = np.zeros(n + 1, dtype=bool)
+    for f0, f1, labels in franjas:
+        seleccion[labels] = True
+        mask_franja = seleccion[componentes[f0:f1]]
+        seleccion[labels] = False
+        parcial = segmentation.watershed(paisaje[f0:f1], markers[f0:f1], mask=mask_franja)
+        res_wtrshd[f0:f1][mask_franja] = parcial[mask_franja]
+    return res_wtrshd
+
+
+def tipo_etiquetas(max_label: int):
+    # dtype entero sin signo más pequeño que admite labels 0..max_label
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_label <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _contactos_por_par(res_wtrshd: np.ndarray) -> dict:
+    #Un único recorrido vectorizado (8 desplazamientos): para cada par (a, b) de labels vecinos,
+    # índices planos de los píxeles de a que tienen algún vecino (8-conexo) con label b
+    h, w = res_wtrshd.shape
+    padded = np.pad(res_wtrshd, 1)
+    centro = res_wtrshd.ravel()
+    lista_a, lista_b, lista_p = [], [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy == 0 and dx == 0:
+                continue
+            vecino = padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w].ravel()
+            pixeles = np.flatnonzero((centro != 0) & (vecino != 0) & (centro != vecino))
+            lista_a.append(centro[pixeles])
+            lista_b.append(vecino[pixeles])
+            lista_p.append(pixeles)
+
+    a = np.concatenate(lista_a).astype(np.int64)
+    b = np.concatenate(lista_b).astype(np.int64)
+    p = np.concatenate(lista_p)
+    if a.size == 0:
+        return {}
+
+    # Ordenar por (a, b, p) y quitar repetidos: un píxel cuenta una vez aunque toque b por varios lados
+    orden = np.lexsort((p, b, a))
+    a, b, p = a[orden], b[orden], p[orden]
+    distinto = np.ones(a.size, dtype=bool)
+    distinto[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1]) | (p[1:] != p[:-1])
+    a, b, p = a[distinto], b[distinto], p[distinto]
+
+    # Agrupar por par (a, b)
+    cortes = np.flatnonzero((a[1:] != a[:-1]) | (b[1:] != b[:-1])) + 1
+    inicios = np.concatenate(([0], cortes))
+    return {
+        (int(a[k]), int(b[k])): grupo
+        for k, grupo in zip(inicios, np.split(p, cortes))
+    }
+
+
+def unir_fragmentos(res_wtrshd: np.ndarray, umbral_contacto=None, orden_ascendente: bool = False):
     #Fusiona núcleos que comparten borde significativo (contacto relativo > THRESHOLD_CONTACTO)
-    res_wtrshd_copia = res_wtrshd.copy()
-    kernel = np.ones((3, 3), np.uint8)
-    unique_res_wtrshd = np.unique(res_wtrshd_copia)
-    unique_res_wtrshd = unique_res_wtrshd[unique_res_wtrshd != 0]
+    # umbral_contacto: None = THRESHOLD_CONTACTO
+    # orden_ascendente: evalúa los vecinos de cada núcleo en orden ascendente de label en vez del orden del set
+    # (el del recorrido original). Así el resultado depende solo del orden relativo de los labels y no de su valor
+    # absoluto, y una ventana renumerada (teselas.py) fusiona igual que la imagen entera con la misma opción
+    # Grafo de adyacencia en una pasada + union-find; mismo orden de evaluación que el recorrido original
+    unique_res_wtrshd = np.unique(res_wtrshd)
+    unique_res_wtrshd = unique_res_wtrshd[unique_res_wtrshd != 0].tolist()
+    if not unique_res_wtrshd:
+        return res_wtrshd.copy()
+
+    umbral_contacto = THRESHOLD_CONTACTO if umbral_contacto is None else umbral_contacto
 
     # Encontrar vecinos de cada núcleo (solo los que se tocan)
+    contactos = _contactos_por_par(res_wtrshd)
     vecinos = {label: set() for label in unique_res_wtrshd}
-    for label in unique_res_wtrshd:
-        mask = (res_wtrshd_copia == label).astype(np.uint8)
-        mask_dil = cv2.dilate(mask, kernel, iterations=1)  # Expandir 1 píxel
-        mask_borde = mask_dil - mask  # Solo el borde expandido
-        res_wtrshd_vecinos = res_wtrshd_copia[mask_borde > 0]  # Qué res_wtrshd toca
-        for vecino in np.unique(res_wtrshd_vecinos):
-            if vecino != 0 and vecino != label:
-                vecinos[label].add(vecino)
-
-    # Calcular propiedades (área, perímetro) de cada núcleo
-    props_dict = {prop.label: prop for prop in measure.regionprops(res_wtrshd_copia)}
+    for a, b in contactos:  # claves ordenadas por (a, b): inserción ascendente
+        vecinos[a].add(b)
+    if orden_ascendente:
+        vecinos = {label: sorted(vecinos_label) for label, vecinos_label in vecinos.items()}
+
+    # Perímetro y bounding box por label (se actualizan solo para los núcleos fusionados)
+    max_label = int(max(unique_res_wtrshd))
+    perimetros = np.zeros(max_label + 1)
+    bboxes = np.zeros((max_label + 1, 4), dtype=np.int64)
+    for prop in measure.regionprops(res_wtrshd):
+        perimetros[prop.label] = prop.perimeter
+        bboxes[prop.label] = prop.bbox
+
+    # Union-find: padre[label] es siempre la raíz (label que sobrevive) de su grupo
+    padre = np.arange(max_label + 1)
+    miembros = {label: [label] for label in unique_res_wtrshd}
+
+    def contacto(label_i, label_j):
+        # Píxeles de j (todos sus miembros) que tocan i, contando cada píxel una vez
+        trozos = [
+            contactos[(a, b)]
+            for a in miembros[label_j]
+            for b in vecinos[a]
+            if padre[b] == label_i
+        ]
+        if not trozos:
+            return 0
+        if len(trozos) == 1:
+            return trozos[0].size
+        return np.unique(np.concatenate(trozos)).size
+
     pares_procesados = set()
     fusiones_realizadas = True
 
     # Repetir mientras se sigan fusionando núcleos
     while fusiones_realizadas:
         fusiones_realizadas = False
-        for label_i in list(unique_res_wtrshd):
-            current_label_i = res_wtrshd_copia[res_wtrshd_copia == label_i]
-            if current_label_i.size == 0:  # Ya fusionado
+        for label_i in unique_res_wtrshd:
+            if padre[label_i] != label_i:  # Ya fusionado
                 continue
-            current_label_i = current_label_i[0]
 
             for label_j in vecinos[label_i]:
-                current_label_j = res_wtrshd_copia[res_wtrshd_copia == label_j]
-                if current_label_j.size == 0:  # Ya fusionado
-                    continue
-                current_label_j = current_label_j[0]
-                if current_label_i == current_label_j:  # Ya son el mismo
+                if padre[label_j] != label_j:  # Ya fusionado
                     continue
 
-                par = tuple(sorted([current_label_i, current_label_j]))
+                par = (min(label_i, label_j), max(label_i, label_j))
                 if par in pares_procesados:  # Ya evaluado en esta ronda
                     continue
                 pares_procesados.add(par)
 
-                if current_label_i not in props_dict or current_label_j not in props_dict:
-                    continue
-
-                prop_i = props_dict[current_label_i]
-                prop_j = props_dict[current_label_j]
-                mask_i = res_wtrshd_copia == current_label_i
-                mask_j = res_wtrshd_copia == current_label_j
-                # Dilatar i y contar cuántos píxeles de j toca
-                mask_i_dil = cv2.dilate(mask_i.astype(np.uint8), kernel, iterations=1)
-                pixeles_contacto = np.sum(mask_i_dil & mask_j)
+                pixeles_contacto = contacto(label_i, label_j)
                 if pixeles_contacto == 0:
                     continue
 
                 # Contacto relativo al perímetro del más pequeño
-                perimetro_min = min(prop_i.perimeter, prop_j.perimeter)
+                perimetro_min = min(perimetros[label_i], perimetros[label_j])
                 if perimetro_min == 0:
                     continue
                 ratio_contacto = pixeles_contacto / perimetro_min
 
-                # Si el contacto es > 20% del perímetro menor -> fusionar
-                if ratio_contacto > THRESHOLD_CONTACTO:
-                    res_wtrshd_copia[mask_j] = current_label_i  # j pasa a ser i
+                # Si el contacto es > 20% del perímetro menor -> fusionar (j pasa a ser i)
+                if ratio_contacto > umbral_contacto:
+                    miembros_j = miembros.pop(label_j)
+                    padre[miembros_j] = label_i
+                    miembros[label_i].extend(miembros_j)
                     fusiones_realizadas = True
-                    # Recalcular propiedades del núcleo fusionado
-                    props_fusionado = measure.regionprops((res_wtrshd_copia == current_label_i).astype(int))
-                    if props_fusionado:
-                        props_dict[current_label_i] = props_fusionado[0]
-                    if current_label_j in props_dict:
-                        del props_dict[current_label_j]
+
+                    # Recalcular perímetro del núcleo fusionado dentro de su bounding box
+                    r0, c0 = np.minimum(bboxes[label_i, :2], bboxes[label_j, :2])
+                    r1, c1 = np.maximum(bboxes[label_i, 2:], bboxes[label_j, 2:])
+                    bboxes[label_i] = (r0, c0, r1, c1)
+                    recorte = np.isin(res_wtrshd[r0:r1, c0:c1], miembros[label_i])
+                    perimetros[label_i] = measure.perimeter(recorte)
 
         if fusiones_realizadas:
             pares_procesados.clear()  # Reiniciar para la siguiente ronda
 
-    return res_wtrshd_copia
+    # Mapa final: cada píxel toma la raíz de su label
+    return padre.astype(res_wtrshd.dtype)[res_wtrshd]
 
 
-def rellenar_por_contorno(res_wtrshd: np.ndarray):
+def rellenar_por_contorno(res_wtrshd: np.ndarray, en_sitio: bool = False):
     #Rellena huecos internos usando el contorno externo de cada label
-    res_wtrshd_rellenado = res_wtrshd.copy()
-    unique_res_wtrshd = np.unique(res_wtrshd_rellenado)
-    unique_res_wtrshd = unique_res_wtrshd[unique_res_wtrshd != 0]
+    # Trabaja solo dentro del bounding box de cada label (una pasada de find_objects)
+    # en_sitio: modifica res_wtrshd en lugar de una copia (modo de baja memoria)
+    res_wtrshd_rellenado = res_wtrshd if en_sitio else res_wtrshd.copy()
+    h, w = res_wtrshd_rellenado.shape
+
+    for label, bbox in enumerate(ndimage.find_objects(res_wtrshd_rellenado), 1):
+        if bbox is None:
+            continue
+        # Bounding box + 1 px de margen para que el contorno no toque el borde del recorte
+        r0, r1 = max(bbox[0].start - 1, 0), min(bbox[0].stop + 1, h)
+        c0, c1 = max(bbox[1].start - 1, 0), min(bbox[1].stop + 1, w)
+        recorte = res_wtrshd_rellenado[r0:r1, c0:c1]  # vista: se escribe en el resultado
 
-    for label in unique_res_wtrshd:
         # Máscara del núcleo actual
-        mask_nucleo = (res_wtrshd_rellenado == label).astype(np.uint8)
+        mask_nucleo = (recorte == label).astype(np.uint8)
         # Encontrar solo el contorno externo
         contours, _ = cv2.findContours(mask_nucleo, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         if not contours:
@@ -200,38 +535,55 @@ def rellenar_por_contorno(res_wtrshd: np.ndarray):
         # Rellenar todo el interior del contorno (elimina huecos)
         mask_rellenado = np.zeros_like(mask_nucleo)
         cv2.drawContours(mask_rellenado, contours, -1, 1, cv2.FILLED)
-        res_wtrshd_rellenado[mask_rellenado > 0] = label
+        recorte[mask_rellenado > 0] = label
 
     return res_wtrshd_rellenado
 
 
 def crear_imagen_coloreada(res_wtrshd: np.ndarray, imagen_original: np.ndarray) -> np.ndarray:
     #Devuelve imagen coloreada por label (fondo negro)
-    imagen_coloreada = np.zeros_like(imagen_original)
+    # Tabla de colores por label (semilla fija, mismos colores que el bucle label a label) + un único indexado
     unique_res_wtrshd = np.unique(res_wtrshd)
     unique_res_wtrshd = unique_res_wtrshd[unique_res_wtrshd != 0]
 
-    np.random.seed(42)
-    for label_id in unique_res_wtrshd:
-        color = np.random.randint(50, 255, 3).tolist()
-        imagen_coloreada[res_wtrshd == label_id] = color
-    return imagen_coloreada
+    tabla_colores = np.zeros((int(res_wtrshd.max(initial=0)) + 1, 3), dtype=imagen_original.dtype)
+    tabla_colores[unique_res_wtrshd] = np.random.RandomState(42).randint(50, 255, (len(unique_res_wtrshd), 3))
+    return tabla_colores[res_wtrshd]
 
 
-def guardar_resultados(nombre_imagen: str, imagen_original, imagen_gris, mask_binaria, imagen_distancia, imagen_coloreada, num_nucleos: int):
-    """Guarda imágenes intermedias y la coloreada en visualizaciones/<img>/"""
-    base_name = os.path.splitext(nombre_imagen)[0]
-    carpeta_imagen = Path(OUTPUT_DIR) / base_name
-    carpeta_imagen.mkdir(parents=True, exist_ok=True)
+def guardar_etiquetas(ruta: Path, res_wtrshd: np.ndarray):
+    #Guarda el mapa de labels en .npz comprimido con el dtype entero mínimo (uint16/uint32)
+    dtype = np.uint16 if res_wtrshd.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    np.savez_compressed(ruta, etiquetas=res_wtrshd.astype(dtype, copy=False))
+
+
+def cargar_etiquetas(ruta: Path) -> np.ndarray:
+    #Lee un mapa de labels guardado con guardar_etiquetas
+    with np.load(ruta) as datos:
+        return datos["etiquetas"]
+
 
+def preparar_intermedios(mask_binaria: np.ndarray, imagen_distancia: np.ndarray):
+    #Convierte máscara y mapa de distancia a las imágenes uint8 que se guardan/visualizan (máscara, JET)
     dist_vis = cv2.normalize(imagen_distancia, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
     dist_vis_color = cv2.applyColorMap(dist_vis, cv2.COLORMAP_JET)
     mask_vis = util.img_as_ubyte(mask_binaria)
+    return mask_vis, dist_vis_color
 
-    cv2.imwrite(str(carpeta_imagen / "1_original_gris.png"), imagen_gris)
-    cv2.imwrite(str(carpeta_imagen / "2_mascara_binaria.png"), mask_vis)
-    cv2.imwrite(str(carpeta_imagen / "3_mapa_distancia.png"), dist_vis_color)
-    cv2.imwrite(str(carpeta_imagen / "4_coloreada.png"), imagen_coloreada)
+
+def guardar_resultados(nombre_imagen: str, imagen_original, imagen_gris, mask_binaria, imagen_distancia, imagen_coloreada, etiquetas, num_nucleos: int):
+    """Guarda imágenes intermedias, la coloreada y el mapa de labels en visualizaciones/<img>/"""
+    base_name = os.path.splitext(nombre_imagen)[0]
+    carpeta_imagen = Path(OUTPUT_DIR) / base_name
+    carpeta_imagen.mkdir(parents=True, exist_ok=True)
+
+    mask_vis, dist_vis_color = preparar_intermedios(mask_binaria, imagen_distancia)
+
+    entrada_salida.escribir_png(carpeta_imagen / "1_original_gris.png", imagen_gris)
+    entrada_salida.escribir_png(carpeta_imagen / "2_mascara_binaria.png", mask_vis)
+    entrada_salida.escribir_png(carpeta_imagen / "3_mapa_distancia.png", dist_vis_color)
+    entrada_salida.escribir_png(carpeta_imagen / "4_coloreada.png", imagen_coloreada)
+    guardar_etiquetas(carpeta_imagen / "4_etiquetas.npz", etiquetas)
 
 
 def guardar_csv(resultados):
@@ -252,51 +604,419 @@ def guardar_csv(resultados):
             )
 
 
-def procesar_todas_imagenes():
+def segmentar_en_memoria(ruta: Path, imagenes=None, medir: bool = False) -> dict:
+    #Segmenta una imagen del lote sin escribir nada; devuelve los arrays intermedios y su fila para resultados.csv
+    # imagenes: (color, gris) ya leídas (p. ej. por adelantado en otro hilo); si es None se leen aquí
+    # medir: añade la tabla de morfometría por núcleo en "morfometria"
+    perfil.imagen(ruta.name)
+    #1) Cargar imagen
+    if imagenes is None:
+        with perfil.etapa("lectura"):
+            imagenes = cargar_imagen(str(ruta))
+    imagen_original, imagen_gris = imagenes
+    #2) Pipeline watershed
+    res_wtrshd, mask, distance, info_filtro = pipeline_watershed(imagen_gris)
+    #3) Post-procesado
+    with perfil.etapa("fusion"):
+        res_wtrshd = unir_fragmentos(res_wtrshd)
+    with perfil.etapa("relleno"):
+        # unir_fragmentos devuelve siempre un mapa nuevo: en baja memoria se rellena sin copiarlo otra vez
+        res_wtrshd = rellenar_por_contorno(res_wtrshd, en_sitio=BAJA_MEMORIA)
+
+    #4) Resultados
+    with perfil.etapa("coloreado"):
+        imagen_coloreada = crear_imagen_coloreada(res_wtrshd, imagen_original)
+    with perfil.etapa("medidas"):
+        # Área por label (mismo orden que regionprops) con un único bincount
+        areas = np.bincount(res_wtrshd.ravel())[1:]
+        areas = areas[areas > 0].astype(np.float64).tolist()
+    tabla = None
+    if medir:
+        with perfil.etapa("morfometria"):
+            tabla = morfometria.medir_nucleos(res_wtrshd, imagen_gris, ruta.name)
+
+    return {
+        "imagen_original": imagen_original,
+        "imagen_gris": imagen_gris,
+        "mask": mask,
+        "distance": distance,
+        "etiquetas": res_wtrshd,
+        "imagen_coloreada": imagen_coloreada,
+        "morfometria": tabla,
+        "fila": {
+            "nombre": ruta.name,
+            "num_nucleos": len(areas),
+            "area_media": np.mean(areas) if areas else 0,
+            "areas_individuales": areas,
+            "info": info_filtro,
+        },
+    }
+
+
+def segmentar_imagen(ruta: Path, carpeta_cache: Path | None = None, clave: str | None = None, imagenes=None, escritor=None, medir: bool = False) -> dict:
+    #Segmenta una imagen del lote y guarda sus pasos; devuelve su fila para resultados.csv
+    # Con caché (clave != None): si la entrada existe se reutilizan labels/áreas y se omite la segmentación
+    # imagenes: (color, gris) ya leídas o None; escritor: EscritorFondo para escribir los PNG en segundo plano
+    # medir: la fila lleva la tabla de morfometría por núcleo ("morfometria")
+    # Con --profile la fila lleva además los registros de las etapas de esta imagen ("perfil")
+    perfil.imagen(ruta.name)
+    with perfil.etapa("total"):
+        fila = _segmentar_imagen(ruta, carpeta_cache, clave, imagenes, escritor, medir)
+    if perfil.ACTIVO:
+        fila["perfil"] = perfil.recoger()
+    return fila
+
+
+def _segmentar_imagen(ruta: Path, carpeta_cache: Path | None, clave: str | None, imagenes, escritor, medir: bool) -> dict:
+    if clave is not None:
+        with perfil.etapa("cache"):
+            entrada = cache_segmentacion.leer_entrada(carpeta_cache, clave)
+        if entrada is not None:
+            areas, info_filtro = entrada
+            with perfil.etapa("escritura"):
+                restaurar_salidas(ruta, carpeta_cache, clave)
+            fila = {
+                "nombre": ruta.name,
+                "num_nucleos": len(areas),
+                "area_media": np.mean(areas) if areas else 0,
+                "areas_individuales": areas,
+                "info": info_filtro,
+                "cache_acierto": True,
+            }
+            if medir:
+                with perfil.etapa("morfometria"):
+                    etiquetas, _ = cache_segmentacion.leer_mapas(carpeta_cache, clave)
+                    imagen_gris = (imagenes or cargar_imagen(str(ruta)))[1]
+                    fila["morfometria"] = morfometria.medir_nucleos(etiquetas, imagen_gris, ruta.name)
+            return fila
+
+    seg = segmentar_en_memoria(ruta, imagenes, medir)
+    fila = seg["fila"]
+    if medir:
+        fila["morfometria"] = seg["morfometria"]
+    if clave is not None:
+        with perfil.etapa("cache"):
+            fila["cache_tamano"] = cache_segmentacion.escribir_entrada(
+                carpeta_cache, clave, seg["etiquetas"], seg["mask"], fila["areas_individuales"], fila["info"]
+            )
+    if escritor is None:
+        with perfil.etapa("escritura"):
+            _escribir_salidas(ruta, seg, clave)
+    else:
+        # Solo se mide la espera por contrapresión (cola de escritura llena)
+        with perfil.etapa("espera_escritura"):
+            escritor.enviar(ruta.name, _escribir_salidas, ruta, seg, clave)
+    return fila
+
+
+def _escribir_salidas(ruta: Path, seg: dict, clave: str | None):
+    #PNG intermedios + labels y, al final, el sello de caché (solo si todo lo anterior se escribió)
+    guardar_resultados(
+        ruta.name, seg["imagen_original"], seg["imagen_gris"], seg["mask"], seg["distance"],
+        seg["imagen_coloreada"], seg["etiquetas"], seg["fila"]["num_nucleos"],
+    )
+    if clave is not None:
+        (Path(OUTPUT_DIR) / ruta.stem / SELLO_CACHE).write_text(clave)
+
+
+def _segmentar_en_serie(imagenes, claves, carpeta_cache: Path | None, escritor, prefetch: int, medir: bool):
+    #Genera, por imagen y en orden, una función que la segmenta con la imagen ya leída por adelantado en otro hilo
+    def leer(par):
+        ruta, clave = par
+        if clave is not None and not medir and cache_segmentacion.existe_entrada(carpeta_cache, clave):
+            return None  # acierto de caché previsto: no hace falta decodificar la imagen
+        return cargar_imagen(str(ruta))
+
+    for (ruta, clave), leidas, error in entrada_salida.leer_por_adelantado(zip(imagenes, claves), leer, prefetch):
+        def segmentar_leida(ruta=ruta, clave=clave, leidas=leidas, error=error):
+            if error is not None:
+                raise error
+            return segmentar_imagen(ruta, carpeta_cache, clave, leidas, escritor, medir)
+        yield segmentar_leida
+
+
+def _segmentar_en_pool(imagenes, claves, carpeta_cache: Path | None, workers: int, medir: bool):
+    #Genera, por imagen y en orden, una función que devuelve su segmentación hecha en el pool de procesos
+    argumentos = [(ruta, carpeta_cache, clave, None, None, medir) for ruta, clave in zip(imagenes, claves)]
+    for res, error in mapear_en_pool(workers, segmentar_imagen, argumentos):
+        def obtener(res=res, error=error):
+            if error is not None:
+                raise error
+            return res
+        yield obtener
+
+
+def ajustes_worker() -> dict:
+    #Globales del pipeline que se fijan desde la línea de comandos (para pasarlos a inicializar_worker)
+    return {
+        "FACTOR_PIRAMIDE": FACTOR_PIRAMIDE, "DETECTOR_SEMILLAS": DETECTOR_SEMILLAS, "BAJA_MEMORIA": BAJA_MEMORIA,
+        "ENTRADA": ENTRADA, "CACHE_CANAL_H": CACHE_CANAL_H, "PAQUETE": PAQUETE,
+    }
+
+
+def inicializar_worker(perfil_activo: bool, compresion_png, ajustes: dict | None = None):
+    #Traslada a cada proceso del pool la configuración fijada desde la línea de comandos
+    # ajustes: globales de este módulo (ajustes_worker() del proceso principal)
+    entrada_salida.COMPRESION_PNG = compresion_png
+    globals().update(ajustes or {})
+    if perfil_activo:
+        perfil.activar()
+
+
+def crear_pool(workers: int) -> ProcessPoolExecutor:
+    #Pool de procesos con la configuración de este proceso (inicializar_worker + ajustes_worker)
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=inicializar_worker,
+        initargs=(perfil.ACTIVO, entrada_salida.COMPRESION_PNG, ajustes_worker()),
+    )
+
+
+def mapear_en_pool(workers: int, funcion, argumentos, en_vuelo: int | None = None):
+    #Genera (resultado, error) de funcion(*args) para cada args de `argumentos`, en orden, en un pool de `workers`
+    # procesos con como mucho `en_vuelo` tareas enviadas (None = 2 por worker); error es la excepción de la tarea.
+    # Si un worker muere (BrokenProcessPool) el pool se recrea como en servidor.Despachador: las tareas que estaban
+    # en vuelo se repiten de una en una y solo la que vuelve a tumbar el pool falla; el resto sigue en paralelo
+    argumentos = list(argumentos)
+    en_vuelo = en_vuelo or 2 * workers
+    pendientes = deque(range(len(argumentos)))
+    sospechosos = deque()   # en vuelo cuando murió un worker
+    en_curso = {}           # índice -> futuro
+    listos = {}             # índice -> (resultado, error), a la espera de salir en orden
+    aislado = None          # sospechoso que se está repitiendo solo
+    proximo = 0
+    pool = crear_pool(workers)
+    try:
+        while proximo < len(argumentos):
+            if proximo in listos:
+                yield listos.pop(proximo)
+                proximo += 1
+                continue
+
+            try:
+                if sospechosos or aislado is not None:
+                    if aislado is None:
+                        aislado = sospechosos.popleft()
+                        en_curso[aislado] = pool.submit(funcion, *argumentos[aislado])
+                else:
+                    while pendientes and len(en_curso) < en_vuelo:
+                        en_curso[pendientes[0]] = pool.submit(funcion, *argumentos[pendientes[0]])
+                        pendientes.popleft()
+                i = min(en_curso)
+                listos[i] = (en_curso[i].result(), None)
+                del en_curso[i]
+            except BrokenProcessPool:
+                if aislado is not None:
+                    en_curso.clear()
+                    listos[aislado] = (None, RuntimeError("el proceso del worker terminó de forma inesperada"))
+                for i, futuro in en_curso.items():
+                    if futuro.done() and not isinstance(futuro.exception(), BrokenProcessPool):
+                        listos[i] = (None, futuro.exception()) if futuro.exception() else (futuro.result(), None)
+                    else:
+                        sospechosos.append(i)
+                sospechosos = deque(sorted(sospechosos))
+                en_curso.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = crear_pool(workers)
+            except Exception as e:
+                listos[i] = (None, e)
+                del en_curso[i]
+            if aislado is not None and aislado in listos:
+                aislado = None
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def restaurar_salidas(ruta: Path, carpeta_cache: Path, clave: str):
+    #Reescribe visualizaciones/<img>/ desde la caché salvo que ya correspondan a esta clave
+    carpeta_imagen = Path(OUTPUT_DIR) / ruta.stem
+    sello = carpeta_imagen / SELLO_CACHE
+    archivos = ["1_original_gris.png", "2_mascara_binaria.png", "3_mapa_distancia.png", "4_coloreada.png", "4_etiquetas.npz"]
+    if sello.exists() and sello.read_text() == clave and all((carpeta_imagen / a).exists() for a in archivos):
+        return
+
+    # El mapa de distancia se recalcula desde la máscara por el mismo camino que la segmentación (pirámide y baja
+    # memoria forman parte de la clave, así que coinciden con los de la entrada): mucho más barato que segmentar
+    etiquetas, mask = cache_segmentacion.leer_mapas(carpeta_cache, clave)
+    imagen_original, imagen_gris = cargar_imagen(str(ruta))
+    distance = distancia_de_mascara(mask)
+    imagen_coloreada = crear_imagen_coloreada(etiquetas, imagen_original)
+    guardar_resultados(
+        ruta.name, imagen_original, imagen_gris, mask, distance, imagen_coloreada, etiquetas, int(etiquetas.max(initial=0))
+    )
+    sello.write_text(clave)
+
+
+def procesar_todas_imagenes(workers: int = 1, carpeta_cache: Path | None = None, cache_max_mb: int = cache_segmentacion.CACHE_MAX_MB, traza: Path | None = None, prefetch: int = entrada_salida.PREFETCH, salida_morfometria: Path | None = None):
     #hace la segmentación de todo el lote H y guarda imágenes/CSV.
-    imagenes = sorted(Path(INPUT_DIR).glob("*.png"))
+    # Con workers > 1 cada imagen va a un proceso del pool; se recogen en orden de entrada
+    # Con workers = 1 la E/S se solapa con el cálculo: `prefetch` imágenes se leen por adelantado en hilos y los
+    # PNG se escriben en segundo plano (cola acotada)
+    # Con salida_morfometria las propiedades de cada núcleo se añaden a ese archivo imagen a imagen
+    # Con carpeta_cache las imágenes sin cambios (mismos bytes, parámetros y versión) no se vuelven a segmentar
+    # Con la instrumentación activa (perfil.activar) escribe la traza por etapa en `traza` y muestra el resumen
+    imagenes = listar_entradas()
     if not imagenes:
-        print(f"ERROR: No se encontraron imágenes en {INPUT_DIR}")
+        print(f"ERROR: No se encontraron imágenes en {PAQUETE or INPUT_DIR}")
         return
 
     print(f"Procesando {len(imagenes)} imágenes para evaluación posterior...")
     resultados = []
+    inicio = time.perf_counter()
+
+    indice = cache_segmentacion.cargar_indice(carpeta_cache) if carpeta_cache is not None else None
+    if indice is not None:
+        parametros = parametros_efectivos()
+        claves = [
+            cache_segmentacion.clave_entrada(hash_entrada(ruta, indice), parametros, VERSION_PIPELINE)
+            for ruta in imagenes
+        ]
+    else:
+        claves = [None] * len(imagenes)
+    aciertos = 0
+    registros = []
+
+    escritor = entrada_salida.EscritorFondo() if workers <= 1 else None
+    medir = salida_morfometria is not None
+    tabla_nucleos = morfometria.EscritorTabla(salida_morfometria) if medir else None
+    fallos = 0
+    if workers > 1:
+        obtenedores = _segmentar_en_pool(imagenes, claves, carpeta_cache, workers, medir)
+    else:
+        obtenedores = _segmentar_en_serie(imagenes, claves, carpeta_cache, escritor, prefetch, medir)
+    try:
+        for i, ((ruta, clave), obtener) in enumerate(zip(zip(imagenes, claves), obtenedores), 1):
+            print(f"[{i}/{len(imagenes)}] {ruta.name}...", end=" ", flush=True)
+            try:
+                res = obtener()
+                info_filtro = res.pop("info")
+                acierto = res.pop("cache_acierto", False)
+                registros.extend(res.pop("perfil", []))
+                if medir:
+                    tabla_nucleos.escribir(res.pop("morfometria"))
+                if indice is not None:
+                    cache_segmentacion.registrar_uso(indice, clave, res.pop("cache_tamano", None))
+                    aciertos += acierto
+                resultados.append(res)
+                origen = " [caché]" if acierto else ""
+                print(f"OK (filtro={info_filtro['metodo']} modas={info_filtro['modas']} thr={info_filtro['filtro']:.1f}){origen}")
+
+            except Exception as e:
+                fallos += 1
+                print(f"ERROR: {e}")
+    finally:
+        obtenedores.close()
+        if escritor is not None:
+            with perfil.etapa("espera_escritura"):
+                for etiqueta, error in escritor.cerrar():
+                    print(f"ERROR escribiendo {etiqueta}: {error}")
+        if tabla_nucleos is not None:
+            tabla_nucleos.cerrar()
+
+    perfil.imagen("")
+    if resultados:
+        with perfil.etapa("escritura_csv"):
+            guardar_csv(resultados)
+    else:
+        print(f"Ninguna imagen se segmentó: no se reescribe {RESULTADOS_CSV}")
+
+    if tabla_nucleos is not None:
+        print(f"Morfometría: {tabla_nucleos.filas} núcleos en {tabla_nucleos.ruta}")
+
+    if indice is not None:
+        expulsadas = cache_segmentacion.podar(carpeta_cache, indice, cache_max_mb * 1024 * 1024)
+        cache_segmentacion.guardar_indice(carpeta_cache, indice)
+        print(f"Caché: {aciertos}/{len(imagenes)} aciertos, {expulsadas} entradas expulsadas ({carpeta_cache})")
+
+    # Rendimiento del lote (para dimensionar nodos)
+    duracion = time.perf_counter() - inicio
+    print(f"{len(resultados)} imágenes en {duracion:.1f}s ({len(resultados) / duracion:.2f} img/s, workers={workers}), {fallos} fallidas")
+
+    if perfil.ACTIVO:
+        registros.extend(perfil.recoger())
+        perfil.escribir_traza(registros, traza or perfil.TRAZA_POR_DEFECTO)
+        perfil.mostrar_resumen(registros)
+        print(f"Traza por etapa guardada en: {traza or perfil.TRAZA_POR_DEFECTO}")
+
+
+def main():
+    global FACTOR_PIRAMIDE, DETECTOR_SEMILLAS, BAJA_MEMORIA, ENTRADA, CACHE_CANAL_H, INPUT_DIR
+    parser = argparse.ArgumentParser(description="Segmenta los núcleos de todas las imágenes H del lote")
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1,
+        help="Procesos en paralelo (1 = secuencial, 0 = todos los núcleos de CPU)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Segmenta todas las imágenes sin usar la caché")
+    parser.add_argument("--cache-dir", default=cache_segmentacion.CACHE_DIR, help="Carpeta de la caché de resultados")
+    parser.add_argument(
+        "--cache-max-mb", type=int, default=cache_segmentacion.CACHE_MAX_MB,
+        help="Tamaño máximo de la caché (MB); se expulsan las entradas menos usadas",
+    )
+    parser.add_argument(
+        "--profile", nargs="?", const=perfil.TRAZA_POR_DEFECTO, metavar="TRAZA",
+        help=f"Mide tiempo/CPU/memoria por etapa e imagen y los escribe en TRAZA (.jsonl o .csv; por defecto {perfil.TRAZA_POR_DEFECTO})",
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=entrada_salida.PREFETCH,
+        help="Imágenes leídas por adelantado con --workers 1 (0 = sin lectura en segundo plano)",
+    )
+    parser.add_argument(
+        "--png-compresion", type=int, choices=range(10), default=entrada_salida.COMPRESION_PNG, metavar="0-9",
+        help="Nivel de compresión de los PNG (0 = rápido y grande, 9 = lento y pequeño; por defecto el de OpenCV)",
+    )
+    parser.add_argument(
+        "--morfometria", nargs="?", const=morfometria.SALIDA_POR_DEFECTO, metavar="ARCHIVO",
+        help="Exporta las propiedades de cada núcleo (.parquet/.feather con pyarrow, si no .csv; "
+             f"por defecto {morfometria.SALIDA_POR_DEFECTO})",
+    )
+    parser.add_argument(
+        "--piramide", type=int, default=FACTOR_PIRAMIDE, metavar="FACTOR",
+        help="Modo grueso a fino: umbral, distancia y semillas sobre la imagen reducida FACTOR veces y watershed a "
+             "resolución completa (1 = desactivado; `evaluar.py --piramide` compara factores)",
+    )
+    parser.add_argument(
+        "--semillas", choices=list(semillas.DETECTORES), default=DETECTOR_SEMILLAS,
+        help="Detector de semillas del watershed (`python semillas.py` compara tiempos y equivalencia)",
+    )
+    parser.add_argument(
+        "--baja-memoria", action="store_true",
+        help="Distancias float32, labels con el dtype entero mínimo y sin copias intermedias (menos RAM por worker)",
+    )
+    parser.add_argument(
+        "--entrada", choices=ENTRADAS, default=ENTRADA,
+        help="h: imágenes del canal H ya extraído; he: escaneos H&E en RGB (canal H por deconvolución de color)",
+    )
+    parser.add_argument("--carpeta-entrada", default=INPUT_DIR, help="Carpeta con las imágenes de entrada (*.png)")
+    parser.add_argument(
+        "--cache-h", nargs="?", const=deconvolucion.CACHE_DIR, metavar="CARPETA",
+        help=f"Con --entrada he, guarda el canal H de cada imagen como memmap para reutilizarlo (por defecto {deconvolucion.CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--paquete", nargs="?", const=paquete.PAQUETE_DIR, metavar="CARPETA",
+        help=f"Lee las imágenes del paquete del lote (`python paquete.py`; por defecto {paquete.PAQUETE_DIR}) en lugar de los PNG",
+    )
+    args = parser.parse_args()
+    if args.piramide < 1:
+        parser.error("--piramide debe ser >= 1")
+
+    FACTOR_PIRAMIDE = args.piramide
+    DETECTOR_SEMILLAS = args.semillas
+    BAJA_MEMORIA = args.baja_memoria
+    ENTRADA = args.entrada
+    CACHE_CANAL_H = args.cache_h
+    INPUT_DIR = args.carpeta_entrada
+    if args.paquete:
+        usar_paquete(args.paquete)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    carpeta_cache = None if args.no_cache else Path(args.cache_dir)
+    if args.profile:
+        perfil.activar()
+    entrada_salida.COMPRESION_PNG = args.png_compresion
+    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    procesar_todas_imagenes(
+        workers, carpeta_cache, args.cache_max_mb, args.profile, args.prefetch,
+        Path(args.morfometria) if args.morfometria else None,
+    )
 
-    for i, ruta in enumerate(imagenes, 1):
-        print(f"[{i}/{len(imagenes)}] {ruta.name}...", end=" ", flush=True)
-        try:
-            #1) Cargar imagen
-            imagen_original, imagen_gris = cargar_imagen(str(ruta))
-            #2) Pipeline watershed
-            res_wtrshd, mask, distance, info_filtro = pipeline_watershed(imagen_gris)
-            #3) Post-procesado
-            res_wtrshd = unir_fragmentos(res_wtrshd)
-            res_wtrshd = rellenar_por_contorno(res_wtrshd)
-
-            #4) Resultados y guardado
-            imagen_coloreada = crear_imagen_coloreada(res_wtrshd, imagen_original)
-            props = measure.regionprops(res_wtrshd)
-            areas = [p.area for p in props]
-
-            guardar_resultados(
-                ruta.name, imagen_original, imagen_gris, mask, distance, imagen_coloreada, len(areas)
-            )
-
-            resultados.append(
-                {
-                    "nombre": ruta.name,
-                    "num_nucleos": len(areas),
-                    "area_media": np.mean(areas) if areas else 0,
-                    "areas_individuales": areas,
-                }
-            )
-            print(f"OK (filtro={info_filtro['metodo']} modas={info_filtro['modas']} thr={info_filtro['filtro']:.1f})")
-
-        except Exception as e:
-            print(f"ERROR: {e}")
-
-    guardar_csv(resultados)
 
 if __name__ == "__main__":
-    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
-    procesar_todas_imagenes()
+    main()
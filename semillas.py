@@ -0,0 +1,193 @@
+"""
+Detección de semillas (marcadores del watershed) con detectores intercambiables.
+
+Detectores (DETECTORES; se elige con segmentar.DETECTOR_SEMILLAS / `segmentar.py --semillas`):
+  picos    feature.peak_local_max sobre el mapa de distancia suavizado (el de siempre): máximos locales en una
+           ventana (2·min_distance+1)², separados al menos min_distance y lejos del borde. Los picos se escriben en la
+           máscara de marcadores de una vez (indexado con las coordenadas) en lugar de píxel a píxel.
+  maximo   filtro de máximo: semilla = píxel igual al máximo de su ventana (2·min_distance+1)², sobre el mismo
+           recorte (caja de la máscara sin el borde) que usa peak_local_max. Sin ordenación ni árbol de distancias:
+           una meseta de máximos (componente 8-conexa) da una semilla, su primer píxel. Coincide con `picos` salvo
+           cuando dos máximos de igual altura quedan a menos de min_distance sin tocarse, o una meseta es más
+           larga que min_distance (`picos` la parte en varias semillas).
+  hmaxima  h-máximos (morphology.h_maxima): máximos regionales con prominencia >= h; descarta los picos poco
+           marcados por altura en lugar de por distancia.
+Todos devuelven un mapa de marcadores int32 (0 = sin semilla, 1..n) con el mismo contrato.
+
+`python semillas.py`: equivalencia y tiempos sobre las imágenes de entrada. Para cada detector, tiempo de detección
+(mínimo de REPETICIONES), nº de semillas, parecido de la segmentación final con la de `picos` (AJI) y métricas
+frente al GT; marca como equivalente al detector que mantiene F1 (píxel y detección) dentro de TOLERANCIA_F1 del de
+`picos`, y recomienda el más rápido de ellos.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import diferido
+
+np = diferido.modulo("numpy")
+ndimage = diferido.modulo("scipy.ndimage")
+feature = diferido.modulo("skimage.feature")
+morphology = diferido.modulo("skimage.morphology")
+
+REPETICIONES = 5
+TOLERANCIA_F1 = 0.01                # Equivalente si |ΔF1| <= TOLERANCIA_F1 frente a `picos` (píxel y detección)
+REFERENCIA = "picos"
+
+
+def _marcadores(mask_semillas):
+    #Una semilla por componente 8-conexa (su primer píxel en orden de barrido), etiquetadas 1..n en ese orden
+    componentes, n = ndimage.label(mask_semillas, structure=np.ones((3, 3), dtype=bool))
+    pixeles = np.flatnonzero(componentes)
+    _, primeros = np.unique(componentes.ravel()[pixeles], return_index=True)
+    markers = np.zeros(mask_semillas.size, dtype=np.int32)
+    markers[np.sort(pixeles[primeros])] = np.arange(1, n + 1, dtype=np.int32)
+    return markers.reshape(mask_semillas.shape)
+
+
+def _recorte_sin_borde(mask, ancho: int):
+    #Caja de la máscara tras quitar `ancho` píxeles de borde de la imagen (como exclude_border de peak_local_max);
+    # None si no queda nada
+    interior = mask.copy()
+    if ancho > 0:
+        interior[:ancho] = False
+        interior[-ancho:] = False
+        interior[:, :ancho] = False
+        interior[:, -ancho:] = False
+    objetos = ndimage.find_objects(interior.astype(np.uint8))
+    return objetos[0] if objetos else None
+
+
+def semillas_picos(distance_smooth, mask, min_distance: int, h: float):
+    #peak_local_max (el detector original); `h` no se usa
+    coords = feature.peak_local_max(distance_smooth, min_distance=min_distance, labels=mask)
+    mask_peaks = np.zeros(distance_smooth.shape, dtype=bool)
+    mask_peaks[tuple(np.atleast_2d(coords).T)] = True
+    # Etiquetar cada pico con un ID entero distinto (marcadores para watershed)
+    markers, _ = ndimage.label(mask_peaks)
+    return markers.astype(np.int32, copy=False)
+
+
+def semillas_maximo(distance_smooth, mask, min_distance: int, h: float):
+    #Píxeles iguales al máximo de su ventana dentro del recorte de la máscara; `h` no se usa
+    mask_semillas = np.zeros(distance_smooth.shape, dtype=bool)
+    recorte = _recorte_sin_borde(mask, min_distance)
+    if recorte is not None:
+        valores = np.where(mask[recorte], distance_smooth[recorte], np.finfo(distance_smooth.dtype).min)
+        maximo = ndimage.maximum_filter(valores, size=2 * min_distance + 1, mode="nearest")
+        mask_semillas[recorte] = (valores == maximo) & (valores > distance_smooth.min())
+    return _marcadores(mask_semillas)
+
+
+def semillas_hmaxima(distance_smooth, mask, min_distance: int, h: float):
+    #Máximos regionales de altura >= h dentro de la máscara; `min_distance` solo fija el borde excluido
+    mask_semillas = np.zeros(distance_smooth.shape, dtype=bool)
+    recorte = _recorte_sin_borde(mask, min_distance)
+    if recorte is not None:
+        valores = np.where(mask[recorte], distance_smooth[recorte], 0)
+        mask_semillas[recorte] = morphology.h_maxima(valores, h).astype(bool) & mask[recorte]
+    return _marcadores(mask_semillas)
+
+
+DETECTORES = {
+    "picos": semillas_picos,
+    "maximo": semillas_maximo,
+    "hmaxima": semillas_hmaxima,
+}
+
+
+def marcadores(detector: str, distance_smooth, mask, min_distance: int, h: float):
+    #Mapa de marcadores con el detector indicado
+    try:
+        funcion = DETECTORES[detector]
+    except KeyError:
+        raise ValueError(f"Detector de semillas desconocido: {detector!r} (opciones: {', '.join(DETECTORES)})") from None
+    return funcion(distance_smooth, mask, min_distance, h)
+
+
+def comparar_detectores(rutas, detectores, repeticiones: int = REPETICIONES) -> dict:
+    #Tiempos y métricas por detector e imagen: {detector: [fila por imagen]}
+    import evaluar
+    import segmentar
+
+    filas = {d: [] for d in dict.fromkeys([REFERENCIA, *detectores])}  # la referencia va siempre la primera
+    for i, ruta in enumerate(rutas, 1):
+        print(f"[{i}/{len(rutas)}] {ruta.name}")
+        _, imagen_gris = segmentar.cargar_imagen(str(ruta))
+        _, umbral, _ = segmentar.detectar_modas_hist(imagen_gris)
+        mask = segmentar.mascara_limpia(imagen_gris, umbral, segmentar.AREA_MIN_NUCLEO)
+        distance = ndimage.distance_transform_edt(mask)
+        distance_smooth = ndimage.gaussian_filter(distance, sigma=segmentar.DIST_SMOOTH_SIGMA)
+
+        referencia = None
+        for detector in filas:
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                markers = marcadores(detector, distance_smooth, mask, segmentar.MIN_DISTANCE, segmentar.H_MAXIMA)
+                tiempos.append(time.perf_counter() - inicio)
+            res_wtrshd = segmentar.segmentation.watershed(-distance, markers, mask=mask)
+            etiquetas = segmentar.rellenar_por_contorno(segmentar.unir_fragmentos(res_wtrshd))
+            if referencia is None:
+                referencia = etiquetas
+            pred_binaria = np.where(etiquetas > 0, 255, 0).astype(np.uint8)
+            frente_gt = evaluar.evaluar_prediccion(ruta.name, pred_binaria, etiquetas, umbrales_iou=(0.5,))
+            filas[detector].append({
+                "tiempo_ms": min(tiempos) * 1000,
+                "semillas": int(markers.max(initial=0)),
+                "aji_vs_ref": evaluar.calcular_metricas_instancia(etiquetas, referencia, (0.5,))["aji"],
+                "f1": frente_gt["f1"] if frente_gt else float("nan"),
+                "det_f1": frente_gt["det_f1_50"] if frente_gt else float("nan"),
+                "aji": frente_gt["aji"] if frente_gt else float("nan"),
+            })
+    return filas
+
+
+def mostrar_comparacion(filas: dict, tolerancia: float = TOLERANCIA_F1):
+    #Tabla por detector y recomendación: el más rápido que mantiene F1 dentro de la tolerancia frente a `picos`
+    medias = {d: {k: float(np.mean([f[k] for f in lista])) for k in lista[0]} for d, lista in filas.items() if lista}
+    ref = medias.get(REFERENCIA)
+    print(f"\n{'detector':<9} {'ms semillas':>11} {'semillas':>9} {'AJI vs ref':>10} {'F1':>7} {'F1 det':>7} {'AJI':>7}  estado")
+    equivalentes = []
+    for detector, m in medias.items():
+        estado = "referencia" if detector == REFERENCIA else "-"
+        if ref is not None and detector != REFERENCIA:
+            dentro = abs(m["f1"] - ref["f1"]) <= tolerancia and abs(m["det_f1"] - ref["det_f1"]) <= tolerancia
+            estado = "equivalente" if dentro else f"fuera de tolerancia (±{tolerancia:.3f})"
+        if estado in ("referencia", "equivalente"):
+            equivalentes.append(detector)
+        print(
+            f"{detector:<9} {m['tiempo_ms']:>11.2f} {m['semillas']:>9.1f} {m['aji_vs_ref']:>10.4f} "
+            f"{m['f1']:>7.4f} {m['det_f1']:>7.4f} {m['aji']:>7.4f}  {estado}"
+        )
+    if equivalentes:
+        mejor = min(equivalentes, key=lambda d: medias[d]["tiempo_ms"])
+        print(f"\nDetector recomendado (el más rápido dentro de tolerancia): {mejor}")
+
+
+def main():
+    import segmentar
+
+    parser = argparse.ArgumentParser(description="Equivalencia y tiempos de los detectores de semillas")
+    parser.add_argument(
+        "--detectores", nargs="+", choices=list(DETECTORES), default=list(DETECTORES),
+        help="Detectores a comparar (la referencia es siempre picos)",
+    )
+    parser.add_argument("--imagenes", type=int, default=None, help="Usa solo las N primeras imágenes")
+    parser.add_argument("--repeticiones", "-n", type=int, default=REPETICIONES)
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_F1, help="|ΔF1| máximo frente a picos")
+    parser.add_argument("--h", type=float, default=segmentar.H_MAXIMA, help="Altura mínima de los h-máximos")
+    args = parser.parse_args()
+
+    segmentar.H_MAXIMA = args.h
+    rutas = sorted(Path(segmentar.INPUT_DIR).glob("*.png"))[:args.imagenes]
+    if not rutas:
+        print(f"ERROR: No se encontraron imágenes en {segmentar.INPUT_DIR}")
+        sys.exit(1)
+    mostrar_comparacion(comparar_detectores(rutas, args.detectores, args.repeticiones), args.tolerancia)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Servicio local de segmentación con procesos "calientes" (HTTP en localhost o en un socket Unix).
+
+Flujo:
+1) Arranca un pool de WORKERS procesos que importan numpy/scipy/scikit-image/OpenCV y segmentan una imagen
+   sintética pequeña antes de aceptar peticiones (así la primera petición no paga el arranque).
+2) Cada petición HTTP (un hilo por conexión) deja su imagen en una cola. Un hilo despachador junta las peticiones
+   que llegan dentro de VENTANA_LOTE_MS (hasta LOTE_MAX por worker) y las reparte en lotes entre los workers:
+   una tarea del pool por lote, no por imagen.
+3) El worker segmenta (pipeline_watershed + unir_fragmentos + rellenar_por_contorno) y devuelve el mapa de labels.
+   Si un worker muere (pool roto), las peticiones de ese reparto fallan con 500 y el pool se recrea (y se calienta)
+   antes del siguiente; ninguna petición se queda esperando.
+4) Respuesta: el mapa de labels como `.npy` (uint16/uint32) y el nº de núcleos + info del umbral en cabeceras.
+
+API:
+  POST /segmentar   cuerpo = bytes de la imagen (PNG/TIFF/...)                       -> 200 .npy
+                    o JSON {"ruta": "imagen.png"} (la lee el worker, sin copiar bytes)
+  GET  /estado      -> JSON con workers, peticiones atendidas, lotes enviados y reinicios del pool
+Cabeceras de respuesta: X-Num-Nucleos, X-Info (JSON). Errores: 400/500 con {"error": ...}.
+
+`python servidor.py --una IMAGEN` segmenta una sola imagen sin servidor (arranque en frío; lo usa cliente.py
+--benchmark para comparar).
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import segmentar
+
+PUERTO = 8765
+WORKERS = 2
+LOTE_MAX = 4                # Imágenes por lote y worker como máximo
+VENTANA_LOTE_MS = 5         # Espera para juntar peticiones concurrentes en un mismo reparto
+
+
+def segmentar_gris(imagen_gris: np.ndarray):
+    #Pipeline completo sobre una imagen en gris; devuelve (etiquetas con dtype mínimo, nº núcleos, info)
+    res_wtrshd, _, _, info = segmentar.pipeline_watershed(imagen_gris)
+    etiquetas = segmentar.rellenar_por_contorno(segmentar.unir_fragmentos(res_wtrshd))
+    num_nucleos = int(np.count_nonzero(np.bincount(etiquetas.ravel())[1:]))
+    dtype = np.uint16 if etiquetas.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    return etiquetas.astype(dtype, copy=False), num_nucleos, info
+
+
+def _decodificar(entrada) -> np.ndarray:
+    #Imagen en gris desde bytes codificados o desde una ruta (mismo criterio que segmentar.cargar_imagen)
+    if isinstance(entrada, (bytes, bytearray)):
+        imagen_color = cv2.imdecode(np.frombuffer(entrada, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if imagen_color is None:
+            raise ValueError("No se pudo decodificar la imagen recibida")
+        return cv2.cvtColor(imagen_color, cv2.COLOR_BGR2GRAY)
+    return segmentar.cargar_imagen(str(entrada))[1]
+
+
+def segmentar_lote(entradas: list):
+    #Tarea del worker: segmenta un lote; devuelve por imagen ("ok", resultado), ("entrada", mensaje) si la imagen
+    # no se puede leer, o ("error", mensaje) si falla la segmentación
+    resultados = []
+    for entrada in entradas:
+        try:
+            imagen_gris = _decodificar(entrada)
+        except (ValueError, FileNotFoundError) as e:
+            resultados.append(("entrada", str(e)))
+            continue
+        try:
+            resultados.append(("ok", segmentar_gris(imagen_gris)))
+        except Exception as e:
+            resultados.append(("error", f"{type(e).__name__}: {e}"))
+    return resultados
+
+
+def calentar_worker():
+    #Initializer del pool: importa y ejercita el pipeline con una imagen sintética pequeña
+    from sinteticas import generar_imagen_h
+    imagen, _ = generar_imagen_h(128, 128, 10)
+    segmentar_gris(imagen)
+
+
+class Despachador:
+    #Junta peticiones concurrentes en lotes y las reparte entre los workers del pool
+
+    def __init__(self, workers: int = WORKERS, lote_max: int = LOTE_MAX, ventana_ms: float = VENTANA_LOTE_MS):
+        self.workers = workers
+        self.lote_max = lote_max
+        self.ventana = ventana_ms / 1000
+        self.pool = self._crear_pool()
+        self.cola = queue.Queue()
+        self.atendidas = 0
+        self.lotes = 0
+        self.reinicios = 0
+        self._roto = False          # un worker murió: el pool no admite más tareas y se recrea antes del siguiente lote
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+        self._hilo.start()
+
+    def _crear_pool(self) -> ProcessPoolExecutor:
+        #Pool con los workers ya arrancados y calentados
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=calentar_worker)
+        # Forzar el arranque (y el calentamiento) de todos los workers antes de aceptar peticiones
+        for futuro in [pool.submit(time.sleep, 0.05) for _ in range(self.workers)]:
+            futuro.result()
+        return pool
+
+    def _reiniciar_pool(self):
+        #Sustituye un pool roto por uno nuevo; si no se puede crear, el despachador queda cerrado
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.pool = self._crear_pool()
+            self.reinicios += 1
+            print(f"Pool de workers recreado ({self.reinicios})", flush=True)
+        except Exception as e:
+            print(f"ERROR: no se pudo recrear el pool de workers ({type(e).__name__}: {e}); el servicio no acepta más imágenes", flush=True)
+            self._cerrado = True
+        self._roto = False
+
+    def enviar(self, entrada) -> Future:
+        #Encola una imagen (bytes o ruta); el futuro se resuelve con (etiquetas, num_nucleos, info)
+        futuro = Future()
+        self.cola.put((entrada, futuro))
+        return futuro
+
+    def _bucle(self):
+        while True:
+            pendientes = [self.cola.get()]
+            limite = time.monotonic() + self.ventana
+            while len(pendientes) < self.lote_max * self.workers:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    pendientes.append(self.cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            if self._roto and not self._cerrado:
+                self._reiniciar_pool()
+            # Reparto en como mucho `workers` lotes de tamaño parecido
+            num_lotes = min(self.workers, len(pendientes))
+            lotes = [pendientes[i::num_lotes] for i in range(num_lotes)]
+            for i, lote in enumerate(lotes):
+                try:
+                    if self._cerrado:
+                        raise RuntimeError("el servicio se está cerrando")
+                    tarea = self.pool.submit(segmentar_lote, [entrada for entrada, _ in lote])
+                except Exception as e:
+                    # Pool roto o cerrado: las peticiones sin enviar fallan (500) en lugar de quedarse esperando
+                    error = f"{type(e).__name__}: {e}"
+                    for resto in lotes[i:]:
+                        self._resolver(resto, [("error", error)] * len(resto))
+                    self._roto = isinstance(e, BrokenProcessPool)
+                    break
+                tarea.add_done_callback(lambda t, lote=lote: self._repartir(lote, t))
+                self.lotes += 1
+
+    def _repartir(self, lote, tarea):
+        #Resuelve el futuro de cada petición del lote con su resultado
+        try:
+            resultados = tarea.result()
+        except Exception as e:
+            # Un worker murió a mitad (BrokenProcessPool): el pool se recrea antes del siguiente lote
+            self._roto = self._roto or isinstance(e, BrokenProcessPool)
+            resultados = [("error", f"{type(e).__name__}: {e}")] * len(lote)
+        self._resolver(lote, resultados)
+
+    def _resolver(self, lote, resultados):
+        for (_, futuro), (estado, valor) in zip(lote, resultados):
+            if estado == "ok":
+                futuro.set_result(valor)
+            else:
+                futuro.set_exception(ValueError(valor) if estado == "entrada" else RuntimeError(valor))
+        self.atendidas += len(lote)
+
+    def cerrar(self):
+        self._cerrado = True
+        self.pool.shutdown(cancel_futures=True)
+
+
+class ManejadorSegmentacion(BaseHTTPRequestHandler):
+    despachador: Despachador = None
+
+    def do_GET(self):
+        if self.path != "/estado":
+            return self._json(404, {"error": "ruta desconocida"})
+        d = self.despachador
+        self._json(200, {"workers": d.workers, "atendidas": d.atendidas, "lotes": d.lotes, "reinicios": d.reinicios})
+
+    def do_POST(self):
+        if self.path != "/segmentar":
+            return self._json(404, {"error": "ruta desconocida"})
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not cuerpo:
+            return self._json(400, {"error": "cuerpo vacío"})
+        entrada = cuerpo
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                entrada = Path(json.loads(cuerpo)["ruta"])
+            except (ValueError, KeyError) as e:
+                return self._json(400, {"error": f"JSON no válido: {e}"})
+            if not entrada.exists():
+                return self._json(400, {"error": f"No existe: {entrada}"})
+
+        try:
+            etiquetas, num_nucleos, info = self.despachador.enviar(entrada).result()
+        except ValueError as e:
+            return self._json(400, {"error": str(e)})
+        except RuntimeError as e:
+            return self._json(500, {"error": str(e)})
+
+        salida = io.BytesIO()
+        np.save(salida, etiquetas)
+        datos = salida.getvalue()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-npy")
+        self.send_header("Content-Length", str(len(datos)))
+        self.send_header("X-Num-Nucleos", str(num_nucleos))
+        self.send_header("X-Info", json.dumps({**info, "filtro": float(info["filtro"])}))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _json(self, codigo: int, contenido: dict):
+        datos = json.dumps(contenido).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, formato, *args):
+        pass  # sin una línea por petición
+
+
+class ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # Los sockets Unix no tienen dirección de cliente; BaseHTTPRequestHandler espera una tupla
+        conexion, _ = super().get_request()
+        return conexion, ("unix", 0)
+
+
+def servir(socket_unix: str | None, puerto: int, workers: int, lote_max: int, ventana_ms: float):
+    print(f"Arrancando {workers} workers...", flush=True)
+    ManejadorSegmentacion.despachador = Despachador(workers, lote_max, ventana_ms)
+    if socket_unix:
+        Path(socket_unix).unlink(missing_ok=True)
+        servidor = ServidorUnix(socket_unix, ManejadorSegmentacion)
+        direccion = f"unix:{socket_unix}"
+    else:
+        servidor = ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorSegmentacion)
+        direccion = f"http://127.0.0.1:{puerto}"
+    print(f"Servicio de segmentación en {direccion} (Ctrl+C para parar)", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        ManejadorSegmentacion.despachador.cerrar()
+        if socket_unix:
+            Path(socket_unix).unlink(missing_ok=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio local de segmentación con workers precalentados")
+    parser.add_argument("--socket", help="Escucha en este socket Unix en vez de en localhost")
+    parser.add_argument("--puerto", type=int, default=PUERTO, help="Puerto HTTP en 127.0.0.1")
+    parser.add_argument(
+        "--workers", "-w", type=int, default=WORKERS,
+        help="Procesos de segmentación (0 = todos los núcleos de CPU)",
+    )
+    parser.add_argument("--lote", type=int, default=LOTE_MAX, help="Imágenes por lote y worker como máximo")
+    parser.add_argument("--ventana-ms", type=float, default=VENTANA_LOTE_MS, help="Espera para agrupar peticiones (ms)")
+    parser.add_argument("--una", metavar="IMAGEN", help="Segmenta una imagen sin servidor (arranque en frío) y sale")
+    args = parser.parse_args()
+
+    if args.una:
+        etiquetas, num_nucleos, info = segmentar_gris(_decodificar(Path(args.una)))
+        print(f"{Path(args.una).name}: {num_nucleos} núcleos (filtro={info['metodo']} thr={float(info['filtro']):.1f})")
+        return
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    servir(args.socket, args.puerto, workers, args.lote, args.ventana_ms)
+
+
+if __name__ == "__main__":
+    main()
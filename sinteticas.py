@@ -0,0 +1,75 @@
+"""
+Generador determinista de imágenes sintéticas del canal H (núcleos oscuros sobre fondo claro).
+
+Flujo:
+1) Fondo claro uniforme.
+2) Núcleos = elipses rellenas con tamaño, orientación e intensidad aleatorios (pueden solaparse).
+3) Ruido gaussiano + desenfoque ligero, recorte a uint8.
+4) Devuelve la imagen en gris y el mapa de labels verdadero (la última elipse pintada gana en los solapes).
+
+La misma semilla produce siempre la misma imagen, así que sirve para medir rendimiento sin los datos reales.
+"""
+
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+RADIO_NUCLEO = (6, 14)      # Semiejes mínimo/máximo de cada elipse (px)
+INTENSIDAD_NUCLEO = (40, 110)
+INTENSIDAD_FONDO = 200
+RUIDO_SIGMA = 12
+
+
+def nucleos_para_densidad(alto: int, ancho: int, densidad: float) -> int:
+    #Nº de núcleos para una densidad en núcleos por megapíxel
+    return max(int(round(densidad * alto * ancho / 1e6)), 0)
+
+
+def generar_imagen_h(alto: int, ancho: int, num_nucleos: int, semilla: int = 0, radio=RADIO_NUCLEO, ruido: float = RUIDO_SIGMA):
+    #Devuelve (imagen_gris uint8, etiquetas_gt int32) de una imagen H sintética
+    rng = np.random.default_rng(semilla)
+    imagen = np.full((alto, ancho), INTENSIDAD_FONDO, dtype=np.float32)
+    etiquetas = np.zeros((alto, ancho), dtype=np.int32)
+
+    centros_y = rng.integers(0, alto, num_nucleos)
+    centros_x = rng.integers(0, ancho, num_nucleos)
+    semiejes = rng.uniform(*radio, (num_nucleos, 2))
+    angulos = rng.uniform(0, 180, num_nucleos)
+    intensidades = rng.uniform(*INTENSIDAD_NUCLEO, num_nucleos)
+
+    for i in range(num_nucleos):
+        centro = (int(centros_x[i]), int(centros_y[i]))
+        ejes = (int(semiejes[i, 0]), int(semiejes[i, 1]))
+        cv2.ellipse(imagen, centro, ejes, float(angulos[i]), 0, 360, float(intensidades[i]), -1)
+        cv2.ellipse(etiquetas, centro, ejes, float(angulos[i]), 0, 360, i + 1, -1)
+
+    imagen += rng.normal(0, ruido, imagen.shape).astype(np.float32)
+    imagen = cv2.GaussianBlur(imagen, (3, 3), 0)
+    return np.clip(imagen, 0, 255).astype(np.uint8), etiquetas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera imágenes H sintéticas (PNG) y su mapa de labels verdadero")
+    parser.add_argument("carpeta", help="Carpeta de salida")
+    parser.add_argument("--num", type=int, default=5, help="Nº de imágenes")
+    parser.add_argument("--alto", type=int, default=512)
+    parser.add_argument("--ancho", type=int, default=512)
+    parser.add_argument("--densidad", type=float, default=800, help="Núcleos por megapíxel")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla de la primera imagen (las siguientes suman 1)")
+    args = parser.parse_args()
+
+    carpeta = Path(args.carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    num_nucleos = nucleos_para_densidad(args.alto, args.ancho, args.densidad)
+    for i in range(args.num):
+        imagen, etiquetas = generar_imagen_h(args.alto, args.ancho, num_nucleos, args.semilla + i)
+        nombre = f"sintetica_{args.semilla + i:03d}"
+        cv2.imwrite(str(carpeta / f"{nombre}.png"), cv2.cvtColor(imagen, cv2.COLOR_GRAY2BGR))
+        np.savez_compressed(carpeta / f"{nombre}_gt.npz", etiquetas=etiquetas)
+    print(f"{args.num} imágenes {args.ancho}x{args.alto} ({num_nucleos} núcleos) en {carpeta}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Segmentación por teselas para imágenes muy grandes (whole-slide).
+
+Flujo:
+1) Abre la imagen H en gris como array de solo lectura (memmap si es `.npy`; PNG/TIFF se decodifican a uint8).
+2) Primera pasada: acumula el histograma tesela a tesela -> umbral por modas global (igual que en una sola pasada).
+3) Segunda pasada: segmenta cada tesela ampliada SOLAPE píxeles por lado (watershed + fusión + relleno).
+4) Cosido: cada grupo de núcleos conectados pertenece a la tesela cuyo interior (sin solape) contiene su primer
+   píxel (orden raster); solo esa tesela lo escribe, con IDs globales consecutivos.
+5) Escribe los labels en `<salida>/<img>/4_etiquetas.npy` (memmap) y las áreas en `nucleos.csv` a medida que avanza.
+
+La memoria pico depende de TAMANO_TESELA + 2*SOLAPE, no del tamaño de la imagen. El resultado coincide con el de
+una sola pasada (segmentar_ventana sobre la imagen entera) mientras el SOLAPE supere el tamaño del mayor grupo de
+núcleos en contacto (+ ~8 px de margen). Para ello la fusión usa unir_fragmentos(orden_ascendente=True), que no
+depende del valor absoluto de los labels de cada ventana; con el orden por defecto de segmentar.py, alguna fusión
+ambigua (contacto por encima del umbral con varios vecinos) puede resolverse de otra forma (~0.2% de los núcleos).
+"""
+
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from scipy import ndimage
+
+from segmentar import detectar_modas_conteos, pipeline_watershed, rellenar_por_contorno, unir_fragmentos
+
+TAMANO_TESELA = 1024        # Lado del interior de cada tesela (px)
+SOLAPE = 128                # Margen extra por lado (px); debe superar el mayor grupo de núcleos
+OUTPUT_DIR = "visualizaciones"
+
+
+def abrir_imagen_gris(ruta: Path) -> np.ndarray:
+    #Devuelve la imagen en gris sin copiarla a memoria si es .npy (memmap); si no, la decodifica a uint8
+    if ruta.suffix == ".npy":
+        imagen = np.load(ruta, mmap_mode="r")
+        if imagen.ndim != 2 or imagen.dtype != np.uint8:
+            raise ValueError(f"Se esperaba un .npy 2D uint8: {ruta} ({imagen.dtype}, {imagen.shape})")
+        return imagen
+    imagen_color = cv2.imread(str(ruta))
+    if imagen_color is None:
+        raise FileNotFoundError(f"No se pudo leer la imagen: {ruta}")
+    return cv2.cvtColor(imagen_color, cv2.COLOR_BGR2GRAY)
+
+
+def iterar_teselas(forma, tamano: int):
+    #Genera (r0, r1, c0, c1) del interior de cada tesela en orden raster
+    h, w = forma
+    for r0 in range(0, h, tamano):
+        for c0 in range(0, w, tamano):
+            yield r0, min(r0 + tamano, h), c0, min(c0 + tamano, w)
+
+
+def modas_globales(imagen: np.ndarray, tamano: int = TAMANO_TESELA):
+    #Umbral por modas de toda la imagen acumulando el histograma tesela a tesela
+    conteos = np.zeros(256, dtype=np.int64)
+    for r0, r1, c0, c1 in iterar_teselas(imagen.shape, tamano):
+        conteos += np.bincount(np.asarray(imagen[r0:r1, c0:c1]).ravel(), minlength=256)
+    return detectar_modas_conteos(conteos)
+
+
+def segmentar_ventana(ventana: np.ndarray, modas) -> np.ndarray:
+    #Pipeline completo (watershed + fusión + relleno) sobre una ventana con el umbral global
+    res_wtrshd, _, _, _ = pipeline_watershed(ventana, modas)
+    res_wtrshd = unir_fragmentos(res_wtrshd, orden_ascendente=True)
+    return rellenar_por_contorno(res_wtrshd)
+
+
+def grupos_propios(etiquetas: np.ndarray, interior):
+    #Agrupa labels conectados (8-conexos) y devuelve (grupos, ids de los grupos cuyo primer píxel cae en el interior)
+    grupos, num_grupos = ndimage.label(etiquetas > 0, structure=np.ones((3, 3), dtype=bool))
+    if num_grupos == 0:
+        return grupos, np.empty(0, dtype=grupos.dtype)
+    planos = grupos.ravel()
+    pixeles = np.flatnonzero(planos)
+    ids, primeros = np.unique(planos[pixeles], return_index=True)
+    filas, cols = np.divmod(pixeles[primeros], grupos.shape[1])
+    (f0, f1), (k0, k1) = interior
+    propio = (filas >= f0) & (filas < f1) & (cols >= k0) & (cols < k1)
+    return grupos, ids[propio]
+
+
+def segmentar_por_teselas(imagen: np.ndarray, carpeta_salida: Path, tamano: int = TAMANO_TESELA, solape: int = SOLAPE):
+    #Segmenta la imagen por teselas con solape, cose los núcleos y escribe labels/áreas en disco
+    h, w = imagen.shape
+    carpeta_salida.mkdir(parents=True, exist_ok=True)
+    modas = modas_globales(imagen, tamano)
+
+    salida = np.lib.format.open_memmap(carpeta_salida / "4_etiquetas.npy", mode="w+", dtype=np.uint32, shape=(h, w))
+    siguiente_id = 1
+    truncados = 0
+
+    with open(carpeta_salida / "nucleos.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Nucleo", "Area_px2", "Fila", "Columna"])
+
+        for r0, r1, c0, c1 in iterar_teselas((h, w), tamano):
+            # Ventana = interior + solape (recortado a la imagen)
+            v0, v1 = max(r0 - solape, 0), min(r1 + solape, h)
+            u0, u1 = max(c0 - solape, 0), min(c1 + solape, w)
+            etiquetas = segmentar_ventana(np.asarray(imagen[v0:v1, u0:u1]), modas)
+
+            grupos, propios = grupos_propios(etiquetas, ((r0 - v0, r1 - v0), (c0 - u0, c1 - u0)))
+            if propios.size == 0:
+                continue
+            mask_propia = np.isin(grupos, propios)
+
+            # Grupos propios que tocan un borde interior de la ventana: el solape no basta para ellos
+            bordes = [grupos[0] if v0 > 0 else None, grupos[-1] if v1 < h else None,
+                      grupos[:, 0] if u0 > 0 else None, grupos[:, -1] if u1 < w else None]
+            en_borde = np.concatenate([b for b in bordes if b is not None] or [np.empty(0, grupos.dtype)])
+            truncados += int(np.isin(propios, en_borde).sum())
+
+            # Renumerar los labels propios a IDs globales consecutivos (orden de label dentro de la tesela)
+            labels_propios = np.unique(etiquetas[mask_propia])
+            tabla = np.zeros(int(etiquetas.max()) + 1, dtype=np.uint32)
+            tabla[labels_propios] = np.arange(siguiente_id, siguiente_id + labels_propios.size, dtype=np.uint32)
+            siguiente_id += labels_propios.size
+
+            bloque = salida[v0:v1, u0:u1]
+            escribir = mask_propia & (bloque == 0)
+            bloque[escribir] = tabla[etiquetas[escribir]]
+
+            # Área y primer píxel de cada núcleo escrito
+            pixeles = np.flatnonzero(escribir)
+            ids, primeros, areas = np.unique(tabla[etiquetas.ravel()[pixeles]], return_index=True, return_counts=True)
+            filas, cols = np.divmod(pixeles[primeros], u1 - u0)
+            writer.writerows(zip(ids.tolist(), areas.tolist(), (filas + v0).tolist(), (cols + u0).tolist()))
+
+    salida.flush()
+    if truncados:
+        print(f"AVISO: {truncados} grupos de núcleos superan el solape ({solape} px); pueden quedar cortados")
+    return salida, siguiente_id - 1, modas
+
+
+def misma_particion(a: np.ndarray, b: np.ndarray) -> bool:
+    #True si dos mapas de labels definen los mismos núcleos (salvo renumeración)
+    if not np.array_equal(a > 0, b > 0):
+        return False
+    pares = np.unique(np.stack([a[a > 0], b[b > 0]]).astype(np.int64), axis=1)
+    return pares.shape[1] == np.unique(a[a > 0]).size == np.unique(b[b > 0]).size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segmentación por teselas con solape para imágenes muy grandes")
+    parser.add_argument("imagen", help="Imagen H en gris (.npy uint8 para memmap, o PNG/TIFF)")
+    parser.add_argument("--tesela", type=int, default=TAMANO_TESELA, help="Lado del interior de cada tesela (px)")
+    parser.add_argument("--solape", type=int, default=SOLAPE, help="Solape por lado (px)")
+    parser.add_argument("--salida", default=OUTPUT_DIR, help="Carpeta de salida")
+    parser.add_argument(
+        "--comprobar", action="store_true",
+        help="Segmenta también la imagen entera y compara (solo para imágenes que caben en memoria)",
+    )
+    args = parser.parse_args()
+
+    ruta = Path(args.imagen)
+    imagen = abrir_imagen_gris(ruta)
+    carpeta = Path(args.salida) / ruta.stem
+    print(f"Segmentando {ruta.name} ({imagen.shape[1]}x{imagen.shape[0]}) en teselas de {args.tesela} px (+{args.solape})...")
+
+    inicio = time.perf_counter()
+    etiquetas, num_nucleos, modas = segmentar_por_teselas(imagen, carpeta, args.tesela, args.solape)
+    duracion = time.perf_counter() - inicio
+    print(f"OK (filtro={modas[2]} modas={modas[0]} thr={float(modas[1]):.1f}) {num_nucleos} núcleos en {duracion:.1f}s")
+    print(f"Salida: {carpeta}/4_etiquetas.npy y {carpeta}/nucleos.csv")
+
+    if args.comprobar:
+        completa = segmentar_ventana(np.asarray(imagen), modas)
+        if misma_particion(np.asarray(etiquetas), completa):
+            print("Comprobación: igual que la segmentación en una sola pasada")
+        else:
+            print("Comprobación: DIFIERE de la segmentación en una sola pasada")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
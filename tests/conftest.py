@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Los módulos del proyecto son scripts sueltos en la raíz del repositorio
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+import sinteticas  # noqa: E402
+
+
+def escribir_xml(ruta: Path, etiquetas: np.ndarray):
+    #XML de anotaciones con una Region (Area + Vertices del contorno) por label
+    regiones = []
+    for label in range(1, int(etiquetas.max()) + 1):
+        contornos, _ = cv2.findContours((etiquetas == label).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        if not contornos:
+            continue
+        contorno = max(contornos, key=len).reshape(-1, 2)
+        vertices = "".join(f'<Vertex X="{x}" Y="{y}" Z="0"/>' for x, y in contorno)
+        regiones.append(f'<Region Id="{label}" Area="{int((etiquetas == label).sum())}"><Vertices>{vertices}</Vertices></Region>')
+    ruta.write_text(f"<Annotations><Annotation><Regions>{''.join(regiones)}</Regions></Annotation></Annotations>")
+
+
+def crear_material(carpeta: Path, num: int, lado: int = 192, nucleos: int = 40) -> list[Path]:
+    #Lote sintético con la estructura de "Material Celulas" (H/, gt_colors/, xml/) dentro de `carpeta`
+    material = carpeta / "Material Celulas"
+    for sub in ("H", "gt_colors", "xml"):
+        (material / sub).mkdir(parents=True, exist_ok=True)
+    rutas = []
+    for i in range(num):
+        imagen, etiquetas = sinteticas.generar_imagen_h(lado, lado, nucleos, semilla=i)
+        nombre = f"img_{i:03d}"
+        ruta = material / "H" / f"{nombre}.png"
+        cv2.imwrite(str(ruta), cv2.cvtColor(imagen, cv2.COLOR_GRAY2BGR))
+        colores = np.random.default_rng(i).integers(64, 256, (int(etiquetas.max()) + 1, 3), dtype=np.uint8)
+        colores[0] = 0
+        cv2.imwrite(str(material / "gt_colors" / f"{nombre}.png"), colores[etiquetas])
+        escribir_xml(material / "xml" / f"{nombre}.xml", etiquetas)
+        rutas.append(ruta)
+    return rutas
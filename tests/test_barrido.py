@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import barrido
+import evaluar
+import gt_xml
+import segmentar
+from conftest import crear_material
+
+
+@pytest.fixture
+def ruta(tmp_path, monkeypatch):
+    # Una imagen con XML pero sin GT coloreado
+    monkeypatch.chdir(tmp_path)
+    ruta, = crear_material(tmp_path, 1)
+    (tmp_path / "Material Celulas" / "gt_colors" / ruta.name).unlink()
+    return ruta
+
+
+def test_gt_solo_xml_cargado_una_vez(ruta, monkeypatch):
+    cargas = []
+    cargar_gt = gt_xml.cargar_gt
+    monkeypatch.setattr(gt_xml, "cargar_gt", lambda *args, **kw: cargas.append(args) or cargar_gt(*args, **kw))
+
+    rejilla = barrido.rejilla_desde_argumentos(["MIN_DISTANCE=5,7", "THRESHOLD_CONTACTO=0.1,0.3"])
+    filas, contadores = barrido.barrer_imagen(ruta, rejilla)
+
+    assert len(filas) == 4 and contadores["fusion"] == 4
+    assert len(cargas) == 1
+    assert all(metricas["f1"] > 0.5 for _, metricas in filas)
+
+
+@pytest.mark.parametrize("detector, baja_memoria", [("picos", False), ("picos", True), ("hmaxima", False)])
+def test_valores_globales_igual_que_segmentar(ruta, monkeypatch, detector, baja_memoria):
+    # La combinación con los valores globales reproduce la segmentación de segmentar.py con los mismos ajustes
+    monkeypatch.setattr(segmentar, "DETECTOR_SEMILLAS", detector)
+    monkeypatch.setattr(segmentar, "BAJA_MEMORIA", baja_memoria)
+    evaluadas = []
+    evaluar_prediccion = evaluar.evaluar_prediccion
+    monkeypatch.setattr(
+        evaluar, "evaluar_prediccion", lambda nombre, pred, etiquetas, *args: evaluadas.append(etiquetas.copy())
+        or evaluar_prediccion(nombre, pred, etiquetas, *args),
+    )
+
+    filas, _ = barrido.barrer_imagen(ruta, barrido.rejilla_desde_argumentos([]))
+
+    assert len(filas) == 1
+    esperadas = segmentar.segmentar_en_memoria(ruta)["etiquetas"]
+    assert evaluadas[0].dtype == esperadas.dtype
+    assert np.array_equal(evaluadas[0], esperadas)
+
+
+def test_sin_gt_no_evalua(ruta, tmp_path):
+    (tmp_path / "Material Celulas" / "xml" / f"{ruta.stem}.xml").unlink()
+    assert barrido.barrer_imagen(ruta, barrido.rejilla_desde_argumentos([])) == ([], {})
+
+
+def test_rejilla_desde_argumentos():
+    rejilla = barrido.rejilla_desde_argumentos(["min_distance=3, 5", "THRESHOLD_CONTACTO=0.1,0.3,"])
+    assert rejilla["MIN_DISTANCE"] == [3, 5]
+    assert rejilla["THRESHOLD_CONTACTO"] == [0.1, 0.3]
+
+
+@pytest.mark.parametrize("param", ["MIN_DISTANCE", "MIN_DISTANCE=", "MIN_DISTANCE=3,x", "MIN_DISTANCE=3.5", "NO_EXISTE=1"])
+def test_rejilla_mal_escrita(param):
+    with pytest.raises(ValueError):
+        barrido.rejilla_desde_argumentos([param])
+
+
+def test_rejilla_mal_escrita_es_error_de_uso(monkeypatch, capsys):
+    monkeypatch.setattr("sys.argv", ["barrido.py", "-p", "MIN_DISTANCE=tres"])
+    with pytest.raises(SystemExit) as salida:
+        barrido.main()
+    assert salida.value.code == 2
+    assert "MIN_DISTANCE" in capsys.readouterr().err
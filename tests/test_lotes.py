@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from conftest import RAIZ, crear_material
+
+# Worker que se cuelga en la segunda imagen de su primer lote (la primera ya queda en la caché) hasta que lo matan
+WORKER_COLGADO = """
+import sys, time
+from pathlib import Path
+import lotes, segmentar
+
+segmentar_imagen = segmentar.segmentar_imagen
+llamadas = []
+
+def segmentar_y_colgar(*args, **kwargs):
+    llamadas.append(args[0])
+    if len(llamadas) > 1:
+        Path("colgado").touch()
+        time.sleep(600)
+    return segmentar_imagen(*args, **kwargs)
+
+segmentar.segmentar_imagen = segmentar_y_colgar
+lotes.trabajar(Path(sys.argv[1]), carpeta_cache=Path(sys.argv[2]))
+"""
+
+
+def ejecutar(carpeta, *argumentos):
+    entorno = {**os.environ, "PYTHONPATH": str(RAIZ), "PYTHONWARNINGS": "ignore"}
+    return subprocess.run([sys.executable, *argumentos], cwd=carpeta, env=entorno, check=True, capture_output=True, text=True)
+
+
+def test_worker_caido_se_recupera_y_fusiona_como_un_proceso(tmp_path):
+    referencia, distribuido = tmp_path / "referencia", tmp_path / "distribuido"
+    crear_material(referencia, 6)
+    shutil.copytree(referencia, distribuido)
+
+    # Referencia: segmentar.py + evaluar.py en un solo proceso
+    ejecutar(referencia, str(RAIZ / "segmentar.py"), "--no-cache")
+    ejecutar(referencia, str(RAIZ / "evaluar.py"))
+
+    # Cola de 3 lotes; un worker reclama uno y muere a mitad
+    lotes = str(RAIZ / "lotes.py")
+    ejecutar(distribuido, lotes, "--cola", "cola", "preparar", "--por-lote", "2")
+    entorno = {**os.environ, "PYTHONPATH": str(RAIZ), "PYTHONWARNINGS": "ignore"}
+    colgado = subprocess.Popen(
+        [sys.executable, "-c", WORKER_COLGADO, "cola", "cache"], cwd=distribuido, env=entorno,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        limite = time.monotonic() + 60
+        while not (distribuido / "colgado").exists():
+            assert colgado.poll() is None and time.monotonic() < limite
+            time.sleep(0.05)
+    finally:
+        colgado.kill()
+        colgado.wait()
+    en_curso = list((distribuido / "cola" / "en_curso").iterdir())
+    assert len(en_curso) == 1 and en_curso[0].name.endswith(f"-{colgado.pid}")
+
+    # Dos workers más terminan la cola (recuperando el lote del caído) y se fusionan los parciales
+    salida = ejecutar(distribuido, lotes, "--cola", "cola", "trabajar", "-w", "2", "--cache-dir", "cache").stdout
+    assert "vuelve a la cola" in salida and "[caché]" in salida
+    ejecutar(distribuido, lotes, "--cola", "cola", "fusionar")
+
+    for csv in ("resultados.csv", "evaluacion.csv"):
+        assert (distribuido / csv).read_text() == (referencia / csv).read_text()
+
+    # Índice de la caché guardado por los workers: una entrada y un hash por imagen
+    indice = json.loads((distribuido / "cache" / "indice.json").read_text())
+    assert len(indice["entradas"]) == 6 and len(indice["archivos"]) == 6
+    assert all(entrada["tamano"] > 0 for entrada in indice["entradas"].values())
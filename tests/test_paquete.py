@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import entrada_salida
+import paquete
+from conftest import crear_material
+
+
+def test_ventana_acotada_con_pool_externo():
+    # Con un pool propio, leer_por_adelantado nunca tiene más de `prefetch` resultados sin consumir
+    lanzadas, consumidas, maximo = [], [], [0]
+    cerrojo = threading.Lock()
+
+    def leer(i):
+        with cerrojo:
+            lanzadas.append(i)
+            maximo[0] = max(maximo[0], len(lanzadas) - len(consumidas))
+        return i * 2
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for i, (elemento, resultado, error) in enumerate(entrada_salida.leer_por_adelantado(range(50), leer, 4, pool)):
+            assert (elemento, resultado, error) == (i, 2 * i, None)
+            with cerrojo:
+                consumidas.append(elemento)
+        assert not pool._shutdown  # el pool sigue siendo del llamador
+    assert maximo[0] <= 4
+
+
+def test_empaquetar_en_paralelo_igual_que_en_serie(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    crear_material(tmp_path, 5, lado=128, nucleos=15)
+    serie = paquete.empaquetar(tmp_path / "serie", workers=1)
+    paralelo = paquete.empaquetar(tmp_path / "paralelo", workers=2, tamano_fragmento=1 << 17)
+    assert list(serie["imagenes"]) == list(paralelo["imagenes"])
+
+    a, b = paquete.abrir(tmp_path / "serie"), paquete.abrir(tmp_path / "paralelo")
+    for nombre, entrada in serie["imagenes"].items():
+        assert paralelo["imagenes"][nombre]["sha256"] == entrada["sha256"]
+        for campo in entrada["campos"]:
+            assert np.array_equal(a.leer(nombre, campo), b.leer(nombre, campo))
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+import evaluar
+import segmentar
+import sinteticas
+
+AJI_MINIMO_BAJA_MEMORIA = 0.9999  # tolerancia documentada en segmentar.BAJA_MEMORIA (empates aislados)
+
+
+@pytest.mark.parametrize("factor, baja_memoria", [(1, False), (1, True), (2, False), (2, True)])
+def test_distancia_de_mascara_igual_que_pipeline(monkeypatch, factor, baja_memoria):
+    # restaurar_salidas rehace 3_mapa_distancia.png desde la máscara de la caché: debe coincidir con la segmentación
+    monkeypatch.setattr(segmentar, "BAJA_MEMORIA", baja_memoria)
+    imagen, _ = sinteticas.generar_imagen_h(256, 320, 80, semilla=3)
+    _, mask, distance, _ = segmentar.pipeline_watershed(imagen, factor=factor)
+
+    assert np.array_equal(segmentar.distancia_de_mascara(mask, factor), distance)
+
+
+def segmentar_sintetica(imagen, baja_memoria, monkeypatch, factor=1):
+    monkeypatch.setattr(segmentar, "BAJA_MEMORIA", baja_memoria)
+    res_wtrshd, _, _, _ = segmentar.pipeline_watershed(imagen, factor=factor)
+    res_wtrshd = segmentar.unir_fragmentos(res_wtrshd)
+    return segmentar.rellenar_por_contorno(res_wtrshd, en_sitio=baja_memoria)
+
+
+@pytest.mark.parametrize("factor", [1, 2])
+@pytest.mark.parametrize("semilla", range(4))
+def test_baja_memoria_dentro_de_tolerancia(monkeypatch, semilla, factor):
+    # Alto > FILAS_FRANJA para que el watershed de baja memoria se haga en varias franjas
+    alto, ancho = 640, 448
+    imagen, _ = sinteticas.generar_imagen_h(alto, ancho, sinteticas.nucleos_para_densidad(alto, ancho, 800), semilla)
+    normal = segmentar_sintetica(imagen, False, monkeypatch, factor)
+    baja = segmentar_sintetica(imagen, True, monkeypatch, factor)
+
+    assert baja.dtype == segmentar.tipo_etiquetas(int(baja.max()))
+    aji = evaluar.calcular_metricas_instancia(baja, normal, (0.5,))["aji"]
+    assert aji >= AJI_MINIMO_BAJA_MEMORIA, aji
+
+
+def morir(*args):
+    os._exit(1)
+
+
+def cuadrado_o_muere(x):
+    if x < 0:
+        morir()
+    return x * x
+
+
+def test_mapear_en_pool_worker_muerto():
+    # Solo falla la tarea que tumba su worker; las que estaban en vuelo con ella se repiten en el pool recreado
+    salida = list(segmentar.mapear_en_pool(2, cuadrado_o_muere, [(x,) for x in [1, 2, -3, 4, 5, -6, 7]]))
+
+    assert [res for res, _ in salida] == [1, 4, None, 16, 25, None, 49]
+    assert [error is not None for _, error in salida] == [False, False, True, False, False, True, False]
+
+
+def test_sin_resultados_no_reescribe_csv(tmp_path, monkeypatch):
+    (tmp_path / "H").mkdir()
+    for i in range(3):
+        (tmp_path / "H" / f"img_{i}.png").write_bytes(b"")
+    (tmp_path / segmentar.RESULTADOS_CSV).write_text("previo\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(segmentar, "INPUT_DIR", str(tmp_path / "H"))
+    monkeypatch.setattr(segmentar, "OUTPUT_DIR", str(tmp_path / "salida"))
+    monkeypatch.setattr(segmentar, "segmentar_imagen", morir)
+
+    segmentar.procesar_todas_imagenes(workers=2)
+
+    assert (tmp_path / segmentar.RESULTADOS_CSV).read_text() == "previo\n"
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+from skimage import feature
+
+import comparacion
+import evaluar
+import segmentar
+import semillas
+import sinteticas
+
+LADO = 384
+SEMILLAS_IMAGEN = range(6)
+
+
+def marcadores_referencia(distance_smooth, mask, min_distance):
+    #marcadores_por_picos antes de los detectores intercambiables (pico a pico)
+    coords = feature.peak_local_max(distance_smooth, min_distance=min_distance, labels=mask)
+    mask_peaks = np.zeros(distance_smooth.shape, dtype=bool)
+    if hasattr(coords, "size") and coords.size > 0:
+        for (r, c) in np.atleast_2d(coords):
+            mask_peaks[int(r), int(c)] = True
+    markers, _ = ndimage.label(mask_peaks)
+    return markers
+
+
+def distancia_suavizada(imagen):
+    _, umbral, _ = segmentar.detectar_modas_hist(imagen)
+    mask = segmentar.mascara_limpia(imagen, umbral, segmentar.AREA_MIN_NUCLEO)
+    distance = ndimage.distance_transform_edt(mask)
+    return mask, distance, ndimage.gaussian_filter(distance, sigma=segmentar.DIST_SMOOTH_SIGMA)
+
+
+@pytest.fixture(scope="module", params=[400, 800, 1350], ids=lambda densidad: f"{densidad}/MP")
+def casos(request):
+    #(máscara, distancia, distancia suavizada) y GT de imágenes sintéticas con `densidad` núcleos por megapíxel
+    nucleos = sinteticas.nucleos_para_densidad(LADO, LADO, request.param)
+    casos = []
+    for semilla in SEMILLAS_IMAGEN:
+        imagen, etiquetas_gt = sinteticas.generar_imagen_h(LADO, LADO, nucleos, semilla)
+        casos.append((distancia_suavizada(imagen), etiquetas_gt))
+    return casos
+
+
+@pytest.mark.parametrize("min_distance", [1, 3, segmentar.MIN_DISTANCE, 9])
+def test_picos_igual_que_antes(casos, min_distance):
+    for (mask, _, distance_smooth), _ in casos:
+        esperado = marcadores_referencia(distance_smooth, mask, min_distance)
+        obtenido = semillas.marcadores("picos", distance_smooth, mask, min_distance, segmentar.H_MAXIMA)
+        assert obtenido.dtype == np.int32
+        assert np.array_equal(obtenido, esperado)
+
+
+def test_picos_sin_mascara():
+    distance_smooth = np.zeros((32, 32))
+    mask = np.zeros((32, 32), dtype=bool)
+    assert not semillas.marcadores("picos", distance_smooth, mask, 5, 1.0).any()
+
+
+def f1_medios(casos, detector):
+    #F1 píxel y de detección (IoU 0.5) frente al GT sintético, medios sobre las imágenes
+    f1, det_f1 = [], []
+    for (mask, distance, distance_smooth), etiquetas_gt in casos:
+        markers = semillas.marcadores(detector, distance_smooth, mask, segmentar.MIN_DISTANCE, segmentar.H_MAXIMA)
+        res_wtrshd = segmentar.segmentation.watershed(-distance, markers, mask=mask)
+        etiquetas = segmentar.rellenar_por_contorno(segmentar.unir_fragmentos(res_wtrshd))
+        codigo = comparacion.codificar(etiquetas > 0, etiquetas_gt > 0)
+        f1.append(evaluar.calcular_metricas_pixel(codigo)["f1"])
+        det_f1.append(evaluar.calcular_metricas_instancia(etiquetas, etiquetas_gt, (0.5,))["det_f1_50"])
+    return np.mean(f1), np.mean(det_f1)
+
+
+@pytest.mark.parametrize("detector", ["maximo", "hmaxima"])
+def test_detector_dentro_de_tolerancia(casos, detector):
+    f1_ref, det_f1_ref = f1_medios(casos, semillas.REFERENCIA)
+    f1, det_f1 = f1_medios(casos, detector)
+    assert abs(f1 - f1_ref) <= semillas.TOLERANCIA_F1
+    assert abs(det_f1 - det_f1_ref) <= semillas.TOLERANCIA_F1
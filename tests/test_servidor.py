@@ -0,0 +1,52 @@
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import servidor
+import sinteticas
+
+
+@pytest.fixture(scope="module")
+def despachador():
+    despachador = servidor.Despachador(workers=1, ventana_ms=1)
+    yield despachador
+    despachador.cerrar()
+
+
+@pytest.fixture(scope="module")
+def imagen_png():
+    import cv2
+    imagen, _ = sinteticas.generar_imagen_h(96, 96, 8)
+    return cv2.imencode(".png", imagen)[1].tobytes()
+
+
+def test_segmenta(despachador, imagen_png):
+    _, num_nucleos, _ = despachador.enviar(imagen_png).result(timeout=60)
+    assert num_nucleos > 0
+
+
+def test_submit_fallido_no_deja_peticiones_colgadas(despachador, imagen_png, monkeypatch):
+    def submit_roto(*args, **kwargs):
+        raise BrokenProcessPool("pool roto")
+
+    monkeypatch.setattr(despachador.pool, "submit", submit_roto)
+    with pytest.raises(RuntimeError, match="BrokenProcessPool"):
+        despachador.enviar(imagen_png).result(timeout=60)
+
+    # El pool se recrea antes del siguiente reparto
+    reinicios = despachador.reinicios
+    assert despachador.enviar(imagen_png).result(timeout=60)[1] > 0
+    assert despachador.reinicios == reinicios + 1
+
+
+def test_worker_muerto(despachador, imagen_png):
+    for proceso in list(despachador.pool._processes.values()):
+        os.kill(proceso.pid, signal.SIGKILL)
+    # La primera petición puede fallar (el pool se rompe con ella) pero ninguna se queda esperando
+    try:
+        despachador.enviar(imagen_png).result(timeout=60)
+    except RuntimeError:
+        pass
+    assert despachador.enviar(imagen_png).result(timeout=60)[1] > 0
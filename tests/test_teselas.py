@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+import sinteticas
+import teselas
+
+
+@pytest.mark.parametrize("semilla", [0, 1, 2])
+def test_teselas_igual_que_una_pasada(tmp_path, semilla):
+    imagen, _ = sinteticas.generar_imagen_h(384, 384, 150, semilla)
+    etiquetas, num_nucleos, modas = teselas.segmentar_por_teselas(imagen, tmp_path, tamano=128, solape=64)
+    completa = teselas.segmentar_ventana(imagen, modas)
+
+    assert num_nucleos == np.unique(completa[completa > 0]).size
+    assert teselas.misma_particion(np.asarray(etiquetas), completa)
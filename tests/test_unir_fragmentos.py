@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+import pytest
+from skimage import measure
+
+import segmentar
+import sinteticas
+
+
+def unir_fragmentos_referencia(res_wtrshd: np.ndarray, umbral_contacto: float):
+    #Implementación original (antes del grafo de adyacencia + union-find), con el umbral como argumento
+    res_wtrshd_copia = res_wtrshd.copy()
+    kernel = np.ones((3, 3), np.uint8)
+    unique_res_wtrshd = np.unique(res_wtrshd_copia)
+    unique_res_wtrshd = unique_res_wtrshd[unique_res_wtrshd != 0]
+
+    vecinos = {label: set() for label in unique_res_wtrshd}
+    for label in unique_res_wtrshd:
+        mask = (res_wtrshd_copia == label).astype(np.uint8)
+        mask_dil = cv2.dilate(mask, kernel, iterations=1)
+        mask_borde = mask_dil - mask
+        res_wtrshd_vecinos = res_wtrshd_copia[mask_borde > 0]
+        for vecino in np.unique(res_wtrshd_vecinos):
+            if vecino != 0 and vecino != label:
+                vecinos[label].add(vecino)
+
+    props_dict = {prop.label: prop for prop in measure.regionprops(res_wtrshd_copia)}
+    pares_procesados = set()
+    fusiones_realizadas = True
+
+    while fusiones_realizadas:
+        fusiones_realizadas = False
+        for label_i in list(unique_res_wtrshd):
+            current_label_i = res_wtrshd_copia[res_wtrshd_copia == label_i]
+            if current_label_i.size == 0:
+                continue
+            current_label_i = current_label_i[0]
+
+            for label_j in vecinos[label_i]:
+                current_label_j = res_wtrshd_copia[res_wtrshd_copia == label_j]
+                if current_label_j.size == 0:
+                    continue
+                current_label_j = current_label_j[0]
+                if current_label_i == current_label_j:
+                    continue
+
+                par = tuple(sorted([current_label_i, current_label_j]))
+                if par in pares_procesados:
+                    continue
+                pares_procesados.add(par)
+
+                if current_label_i not in props_dict or current_label_j not in props_dict:
+                    continue
+
+                prop_i = props_dict[current_label_i]
+                prop_j = props_dict[current_label_j]
+                mask_i = res_wtrshd_copia == current_label_i
+                mask_j = res_wtrshd_copia == current_label_j
+                mask_i_dil = cv2.dilate(mask_i.astype(np.uint8), kernel, iterations=1)
+                pixeles_contacto = np.sum(mask_i_dil & mask_j)
+                if pixeles_contacto == 0:
+                    continue
+
+                perimetro_min = min(prop_i.perimeter, prop_j.perimeter)
+                if perimetro_min == 0:
+                    continue
+                ratio_contacto = pixeles_contacto / perimetro_min
+
+                if ratio_contacto > umbral_contacto:
+                    res_wtrshd_copia[mask_j] = current_label_i
+                    fusiones_realizadas = True
+                    props_fusionado = measure.regionprops((res_wtrshd_copia == current_label_i).astype(int))
+                    if props_fusionado:
+                        props_dict[current_label_i] = props_fusionado[0]
+                    if current_label_j in props_dict:
+                        del props_dict[current_label_j]
+
+        if fusiones_realizadas:
+            pares_procesados.clear()
+
+    return res_wtrshd_copia
+
+
+@pytest.fixture(scope="module", params=[0, 1, 2, 3])
+def watershed_sintetico(request):
+    imagen, _ = sinteticas.generar_imagen_h(384, 384, 260, request.param)
+    res_wtrshd, _, _, _ = segmentar.pipeline_watershed(imagen, factor=1)
+    return res_wtrshd
+
+
+@pytest.mark.parametrize("umbral", [0.05, 0.2, 0.4])
+def test_igual_que_referencia(watershed_sintetico, umbral):
+    esperado = unir_fragmentos_referencia(watershed_sintetico, umbral)
+    assert np.array_equal(segmentar.unir_fragmentos(watershed_sintetico, umbral), esperado)
+
+
+def test_umbral_por_defecto(monkeypatch, watershed_sintetico):
+    monkeypatch.setattr(segmentar, "THRESHOLD_CONTACTO", 0.4)
+    assert np.array_equal(segmentar.unir_fragmentos(watershed_sintetico), unir_fragmentos_referencia(watershed_sintetico, 0.4))
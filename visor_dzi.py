@@ -0,0 +1,360 @@
+"""
+Salida multiescala de las visualizaciones: pirámides de teselas DeepZoom (.dzi) y un visor HTML estático.
+
+Flujo por imagen (`python visualizar.py --dzi [imagen]`):
+1) Fuentes: gris (1_original_gris.png o, para las salidas de teselas.py, la imagen de entrada; los .npy se abren como
+   memmap), labels de la predicción (4_etiquetas.npz, o 4_etiquetas.npy de teselas.py como memmap) y GT: el mapa de
+   códigos de comparacion.py si está en caché; si no, el GT coloreado (sin GT solo se dibuja la predicción).
+2) Recorre la imagen en franjas de TAMANO_TESELA filas y dibuja en cada una las capas (CAPAS):
+     contornos    gris + bordes del GT (rojo, 2 px) y de la predicción (verde, 1 px). Son bordes morfológicos
+                  (máscara menos su erosión) calculados con MARGEN filas de contexto, así que cada franja se dibuja
+                  sin el resto de la imagen; a diferencia de findContours también marcan los huecos interiores.
+     diferencias  FN / FP / TP con los colores de comparacion.py
+3) Cada franja alimenta el nivel de resolución máxima de su pirámide: en cuanto junta una fila de teselas la escribe
+   y pasa esa fila reducida 2×2 (media) al nivel inferior, que hace lo mismo, hasta el nivel 0 (1×1 px). En memoria
+   solo hay, por nivel, la fila de teselas que se está completando (≈ 2·TAMANO_TESELA·ancho·3 bytes por capa en
+   total), nunca el mosaico completo ni ninguna capa a tamaño completo.
+4) Escribe `<capa>.dzi` (descriptor DeepZoom: TileSize=TAMANO_TESELA, Overlap=0) y `visor.html`, un visor sin
+   dependencias que se abre directamente desde el disco: rueda = zoom, arrastrar = mover, selector de capa y
+   deslizador para superponer las diferencias sobre los contornos.
+Salida en `visualizaciones/<img>/dzi/`: `<capa>.dzi`, `<capa>_files/<nivel>/<col>_<fila>.<formato>` y `visor.html`.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import comparacion
+import diferido
+import entrada_salida
+import segmentar
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
+
+OUTPUT_DIR = "visualizaciones"
+GT_COLORS_DIR = "Material Celulas/gt_colors"
+CARPETA_DZI = "dzi"                 # en visualizaciones/<img>/
+TAMANO_TESELA = 256                 # Lado de las teselas (px); par, para que cada fila se reduzca 2×2 por sí sola
+FORMATOS = ("png", "jpg")
+FORMATO = "png"
+CALIDAD_JPG = 90
+MARGEN = 2                          # Filas de contexto por encima y por debajo de cada franja para los bordes
+CAPAS = ("contornos", "diferencias")
+COLOR_GT = (0, 0, 255)              # BGR, como visualizar.generar_contornos_superpuestos
+COLOR_PRED = (0, 255, 0)
+
+DESCRIPTOR = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tesela}" Overlap="0" Format="{formato}">\n'
+    '  <Size Width="{ancho}" Height="{alto}"/>\n'
+    '</Image>\n'
+)
+
+PLANTILLA_VISOR = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>__TITULO__</title>
+<style>
+  html, body { margin: 0; height: 100%; overflow: hidden; background: #202020; color: #eee; font: 13px sans-serif; }
+  #barra { position: absolute; top: 0; left: 0; right: 0; padding: 6px 10px; background: rgba(0, 0, 0, .65); }
+  #lienzo { display: block; width: 100%; height: 100%; cursor: grab; }
+</style>
+</head>
+<body>
+<canvas id="lienzo"></canvas>
+<div id="barra">
+  <b>__TITULO__</b> &middot; capa <select id="capa"></select>
+  &middot; diferencias encima <input id="mezcla" type="range" min="0" max="100" value="0">
+  &middot; <span id="zoom"></span> &middot; rueda: zoom, arrastrar: mover, doble clic: ajustar
+</div>
+<script>
+const CONFIG = __CONFIG__;
+const lienzo = document.getElementById("lienzo");
+const ctx = lienzo.getContext("2d");
+const selector = document.getElementById("capa");
+const mezcla = document.getElementById("mezcla");
+const teselas = new Map();
+const nivelMax = CONFIG.niveles - 1;
+let escala = 1, x0 = 0, y0 = 0;  // px de pantalla por px de imagen; esquina superior izquierda en px de imagen
+
+for (const capa of CONFIG.capas) selector.add(new Option(capa, capa));
+
+function tesela(capa, nivel, col, fila) {
+  // Imagen de la tesela si ya se ha cargado; si no, la pide y redibuja al llegar
+  const url = `${capa}_files/${nivel}/${col}_${fila}.${CONFIG.formato}`;
+  let img = teselas.get(url);
+  if (!img) {
+    img = new Image();
+    img.onload = dibujar;
+    img.src = url;
+    teselas.set(url, img);
+  }
+  return img.complete && img.naturalWidth ? img : null;
+}
+
+function dibujarNivel(capa, nivel) {
+  const factor = 2 ** (nivelMax - nivel), lado = CONFIG.tesela * factor;  // lado de la tesela en px de imagen
+  const c0 = Math.max(0, Math.floor(x0 / lado)), f0 = Math.max(0, Math.floor(y0 / lado));
+  const c1 = Math.min(Math.ceil(CONFIG.ancho / lado), Math.ceil((x0 + lienzo.width / escala) / lado));
+  const f1 = Math.min(Math.ceil(CONFIG.alto / lado), Math.ceil((y0 + lienzo.height / escala) / lado));
+  for (let fila = f0; fila < f1; fila++) {
+    for (let col = c0; col < c1; col++) {
+      const img = tesela(capa, nivel, col, fila);
+      if (img) {
+        ctx.drawImage(img, (col * lado - x0) * escala, (fila * lado - y0) * escala,
+                      img.naturalWidth * factor * escala, img.naturalHeight * factor * escala);
+      }
+    }
+  }
+}
+
+function dibujarCapa(capa, alfa) {
+  // Nivel con al menos un px de tesela por px de pantalla; debajo, niveles más gruesos mientras cargan las teselas
+  const nivel = Math.max(0, Math.min(nivelMax, Math.ceil(nivelMax + Math.log2(escala))));
+  ctx.globalAlpha = alfa;
+  for (let n = Math.max(0, nivel - 3); n <= nivel; n++) dibujarNivel(capa, n);
+  ctx.globalAlpha = 1;
+}
+
+function dibujar() {
+  ctx.imageSmoothingEnabled = escala < 1;
+  ctx.clearRect(0, 0, lienzo.width, lienzo.height);
+  dibujarCapa(selector.value, 1);
+  const alfa = mezcla.value / 100;
+  if (alfa > 0 && selector.value !== "diferencias" && CONFIG.capas.includes("diferencias")) {
+    dibujarCapa("diferencias", alfa);
+  }
+  document.getElementById("zoom").textContent = `${Math.round(escala * 100)} %`;
+}
+
+function ajustar() {
+  lienzo.width = lienzo.clientWidth;
+  lienzo.height = lienzo.clientHeight;
+  escala = Math.min(lienzo.width / CONFIG.ancho, lienzo.height / CONFIG.alto);
+  x0 = (CONFIG.ancho - lienzo.width / escala) / 2;
+  y0 = (CONFIG.alto - lienzo.height / escala) / 2;
+  dibujar();
+}
+
+lienzo.addEventListener("wheel", (e) => {
+  e.preventDefault();
+  const ix = x0 + e.offsetX / escala, iy = y0 + e.offsetY / escala;  // el punto bajo el cursor no se mueve
+  escala = Math.min(32, Math.max(1e-4, escala * (e.deltaY < 0 ? 1.25 : 0.8)));
+  x0 = ix - e.offsetX / escala;
+  y0 = iy - e.offsetY / escala;
+  dibujar();
+}, { passive: false });
+let arrastre = null;
+lienzo.addEventListener("mousedown", (e) => { arrastre = [e.clientX, e.clientY]; lienzo.style.cursor = "grabbing"; });
+window.addEventListener("mouseup", () => { arrastre = null; lienzo.style.cursor = "grab"; });
+window.addEventListener("mousemove", (e) => {
+  if (!arrastre) return;
+  x0 -= (e.clientX - arrastre[0]) / escala;
+  y0 -= (e.clientY - arrastre[1]) / escala;
+  arrastre = [e.clientX, e.clientY];
+  dibujar();
+});
+lienzo.addEventListener("dblclick", ajustar);
+window.addEventListener("resize", () => {
+  lienzo.width = lienzo.clientWidth;
+  lienzo.height = lienzo.clientHeight;
+  dibujar();
+});
+selector.addEventListener("change", dibujar);
+mezcla.addEventListener("input", dibujar);
+ajustar();
+</script>
+</body>
+</html>
+"""
+
+
+def niveles_dzi(ancho: int, alto: int) -> int:
+    #Número de niveles DeepZoom: del 0 (1×1 px) al de resolución completa, ceil(log2(lado mayor))
+    return (max(ancho, alto) - 1).bit_length() + 1
+
+
+def reducir(franja: np.ndarray) -> np.ndarray:
+    #Reducción 2×2 por media; una fila / columna impar final se duplica (tamaño ceil(h/2) × ceil(w/2))
+    alto, ancho = franja.shape[:2]
+    if alto % 2 or ancho % 2:
+        franja = np.pad(franja, ((0, alto % 2), (0, ancho % 2), (0, 0)), mode="edge")
+    return cv2.resize(franja, (franja.shape[1] // 2, franja.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
+
+def escribir_tesela(ruta: Path, tesela: np.ndarray):
+    #PNG con la compresión de entrada_salida o JPEG con CALIDAD_JPG, según la extensión
+    if ruta.suffix == ".png":
+        entrada_salida.escribir_png(ruta, tesela)
+    elif not cv2.imwrite(str(ruta), tesela, [cv2.IMWRITE_JPEG_QUALITY, CALIDAD_JPG]):
+        raise OSError(f"No se pudo escribir: {ruta}")
+
+
+class NivelDZI:
+    #Un nivel de la pirámide: recibe franjas en orden de filas, escribe cada fila de teselas en cuanto la completa y
+    # pasa su reducción 2×2 al nivel inferior (None en el nivel 0)
+
+    def __init__(self, carpeta: Path, nivel: int, ancho: int, formato: str, inferior: NivelDZI | None, escritor=None):
+        self.carpeta = carpeta / str(nivel)
+        self.carpeta.mkdir(parents=True, exist_ok=True)
+        self.ancho = ancho
+        self.formato = formato
+        self.inferior = inferior
+        self.escritor = escritor
+        self.pendientes = []        # franjas recibidas que aún no completan una fila de teselas
+        self.filas_pendientes = 0
+        self.fila_teselas = 0
+
+    def agregar(self, franja: np.ndarray):
+        self.pendientes.append(franja)
+        self.filas_pendientes += len(franja)
+        while self.filas_pendientes >= TAMANO_TESELA:
+            self._emitir(TAMANO_TESELA)
+
+    def cerrar(self):
+        #Escribe la última fila de teselas (incompleta) y cierra los niveles inferiores
+        if self.filas_pendientes:
+            self._emitir(self.filas_pendientes)
+        if self.inferior is not None:
+            self.inferior.cerrar()
+
+    def _emitir(self, filas: int):
+        bloque = self.pendientes[0] if len(self.pendientes) == 1 else np.concatenate(self.pendientes)
+        fila, resto = bloque[:filas], bloque[filas:]
+        self.pendientes = [resto] if len(resto) else []
+        self.filas_pendientes = len(resto)
+        for col, c0 in enumerate(range(0, self.ancho, TAMANO_TESELA)):
+            tesela = np.ascontiguousarray(fila[:, c0:c0 + TAMANO_TESELA])
+            ruta = self.carpeta / f"{col}_{self.fila_teselas}.{self.formato}"
+            if self.escritor is None:
+                escribir_tesela(ruta, tesela)
+            else:
+                self.escritor.enviar(str(ruta), escribir_tesela, ruta, tesela)
+        self.fila_teselas += 1
+        if self.inferior is not None:
+            self.inferior.agregar(reducir(fila))
+
+
+def crear_piramide(carpeta: Path, ancho: int, alto: int, formato: str = FORMATO, escritor=None) -> NivelDZI:
+    #Niveles 0..n-1 encadenados; devuelve el de resolución completa (el que recibe las franjas)
+    nivel = None
+    n = niveles_dzi(ancho, alto)
+    for indice in range(n):
+        factor = 1 << (n - 1 - indice)
+        nivel = NivelDZI(carpeta, indice, -(-ancho // factor), formato, nivel, escritor)
+    return nivel
+
+
+def _borde(binaria: np.ndarray, grosor: int) -> np.ndarray:
+    #Píxeles de borde de una binaria 0/255: máscara menos su erosión (grosor 1) o dilatación menos erosión (grosor 2)
+    nucleo = np.ones((3, 3), np.uint8)
+    # Fuera de la imagen cuenta como fondo: los objetos que tocan el borde también se cierran
+    erosion = cv2.erode(binaria, nucleo, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    exterior = binaria if grosor == 1 else cv2.dilate(binaria, nucleo)
+    return exterior > erosion
+
+
+def franjas_capas(gris, codigo_franja, tamano: int = TAMANO_TESELA):
+    #Genera {capa: franja BGR} de `tamano` filas; codigo_franja(f0, f1) da el mapa de códigos de esas filas
+    alto = gris.shape[0]
+    for r0 in range(0, alto, tamano):
+        r1 = min(r0 + tamano, alto)
+        a0, a1 = max(r0 - MARGEN, 0), min(r1 + MARGEN, alto)
+        codigo = codigo_franja(a0, a1)
+        pred_bin, gt_bin = comparacion.binarias(codigo)
+        dentro = slice(r0 - a0, r1 - a0)
+
+        contornos = cv2.cvtColor(np.ascontiguousarray(gris[r0:r1]), cv2.COLOR_GRAY2BGR)
+        contornos[_borde(gt_bin, 2)[dentro]] = COLOR_GT
+        contornos[_borde(pred_bin, 1)[dentro]] = COLOR_PRED
+        yield {
+            "contornos": contornos,
+            "diferencias": comparacion.imagen_diferencias(codigo[dentro]),
+        }
+
+
+def _buscar_gris(carpeta: Path, nombre_base: str) -> np.ndarray:
+    #1_original_gris.png de segmentar.py o, si no está (salidas de teselas.py), la imagen de entrada
+    import teselas
+
+    candidatos = [carpeta / "1_original_gris.png"]
+    candidatos += [Path(segmentar.INPUT_DIR) / f"{nombre_base}{ext}" for ext in (".npy", ".png", ".tif", ".tiff")]
+    for ruta in candidatos:
+        if ruta.exists():
+            return teselas.abrir_imagen_gris(ruta)
+    raise FileNotFoundError(f"Falta la imagen en gris de {nombre_base}: {candidatos[0]}")
+
+
+def leer_fuentes(nombre_imagen: str):
+    #(gris, codigo_franja) de una imagen; lanza FileNotFoundError si falta la imagen o la predicción
+    nombre_base = Path(nombre_imagen).stem
+    carpeta = Path(OUTPUT_DIR) / nombre_base
+    gris = _buscar_gris(carpeta, nombre_base)
+
+    codigo = comparacion.cargar(nombre_imagen)
+    if codigo is not None and codigo.shape == gris.shape:
+        return gris, lambda f0, f1: codigo[f0:f1]
+
+    if (carpeta / "4_etiquetas.npy").exists():
+        etiquetas = np.load(carpeta / "4_etiquetas.npy", mmap_mode="r")
+    elif (carpeta / "4_etiquetas.npz").exists():
+        etiquetas = segmentar.cargar_etiquetas(carpeta / "4_etiquetas.npz")
+    else:
+        raise FileNotFoundError(f"Falta: {carpeta / '4_etiquetas.npz'}")
+    if etiquetas.shape != gris.shape:
+        raise ValueError(f"{nombre_imagen}: labels {etiquetas.shape} y gris {gris.shape} no coinciden")
+
+    ruta_gt = Path(GT_COLORS_DIR) / f"{nombre_base}.png"
+    gt_color = cv2.imread(str(ruta_gt)) if ruta_gt.exists() else None
+    if gt_color is not None and gt_color.shape[:2] != gris.shape:
+        gt_color = cv2.resize(gt_color, (gris.shape[1], gris.shape[0]), interpolation=cv2.INTER_NEAREST)
+
+    def codigo_franja(f0, f1):
+        pred = np.asarray(etiquetas[f0:f1])
+        gt = comparacion.binarizar_imagen(gt_color[f0:f1]) if gt_color is not None else np.zeros(pred.shape, np.uint8)
+        return comparacion.codificar(pred, gt)
+
+    return gris, codigo_franja
+
+
+def escribir_visor(carpeta: Path, titulo: str, ancho: int, alto: int, formato: str) -> Path:
+    #Descriptores .dzi de cada capa y visor.html con la configuración incrustada (sin fetch: funciona con file://)
+    for capa in CAPAS:
+        descriptor = DESCRIPTOR.format(tesela=TAMANO_TESELA, formato=formato, ancho=ancho, alto=alto)
+        (carpeta / f"{capa}.dzi").write_text(descriptor, encoding="utf-8")
+    config = {
+        "ancho": ancho, "alto": alto, "tesela": TAMANO_TESELA, "niveles": niveles_dzi(ancho, alto),
+        "formato": formato, "capas": list(CAPAS),
+    }
+    html = PLANTILLA_VISOR.replace("__TITULO__", titulo).replace("__CONFIG__", json.dumps(config))
+    ruta = carpeta / "visor.html"
+    ruta.write_text(html, encoding="utf-8")
+    return ruta
+
+
+def generar_dzi(nombre_imagen: str, formato: str = FORMATO, escritor=None) -> Path:
+    #Pirámides DeepZoom de todas las capas de una imagen y su visor; devuelve la ruta de visor.html
+    gris, codigo_franja = leer_fuentes(nombre_imagen)
+    alto, ancho = gris.shape
+    carpeta = Path(OUTPUT_DIR) / Path(nombre_imagen).stem / CARPETA_DZI
+    piramides = {capa: crear_piramide(carpeta / f"{capa}_files", ancho, alto, formato, escritor) for capa in CAPAS}
+    for franjas in franjas_capas(gris, codigo_franja):
+        for capa, franja in franjas.items():
+            piramides[capa].agregar(franja)
+    for piramide in piramides.values():
+        piramide.cerrar()
+    return escribir_visor(carpeta, Path(nombre_imagen).stem, ancho, alto, formato)
+
+
+def imagenes_con_etiquetas() -> list[str]:
+    #Imágenes con predicción en visualizaciones/ (segmentar.py: 4_etiquetas.npz; teselas.py: 4_etiquetas.npy)
+    salida = Path(OUTPUT_DIR)
+    if not salida.exists():
+        return []
+    return sorted(
+        carpeta.name + ".png" for carpeta in salida.iterdir()
+        if carpeta.is_dir() and any((carpeta / f"4_etiquetas{ext}").exists() for ext in (".npz", ".npy"))
+    )
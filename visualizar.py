@@ -2,56 +2,48 @@
 Visualización de resultados de segmentación.
 
 Flujo por imagen:
-1) Carga pasos intermedios generados por segmentar.py (gris, máscara, mapa de distancia, coloreada).
-2) Carga GT coloreado y los binariza ambos.
-3) Genera: mapa de diferencias FP/FN/TP, contornos GT vs pred, comparativa lado a lado y grid 2×2.
+1) Carga pasos intermedios generados por segmentar.py (gris, máscara, mapa de distancia, coloreada y labels si existen).
+   El GT coloreado sale de gt_colors o, con --paquete, del paquete del lote (paquete.py) sin decodificar el PNG.
+2) Comparación predicción / GT (mapa de códigos pred*2+gt, comparacion.py): la que dejó evaluar.py en
+   `comparacion.npz` si la predicción y el GT no han cambiado; si no, binariza la predicción (desde el mapa de labels
+   si existe) y el GT coloreado y los compara.
+3) Genera: mapa de diferencias FP/FN/TP (tabla de colores), contornos GT vs pred, comparativa lado a lado y grid 2×2.
 4) Guarda salidas en `visualizaciones/<img>/` y copia del grid en `visualizaciones/RESULTADOS/`.
+En el lote, las lecturas de las imágenes siguientes y la escritura de los PNG van en hilos (entrada_salida.py).
+Con `--dzi`, en lugar de los PNG a tamaño completo genera pirámides de teselas DeepZoom de los contornos y las
+diferencias con un visor HTML estático, por franjas y sin cargar ninguna capa entera en memoria (visor_dzi.py).
 """
 
+from __future__ import annotations
+
 import argparse
 from pathlib import Path
 import sys
 
-import cv2
-import numpy as np
+import comparacion
+import diferido
+import entrada_salida
+import paquete
+import perfil
+import segmentar
+import visor_dzi
+
+cv2 = diferido.modulo("cv2")
+np = diferido.modulo("numpy")
 
 OUTPUT_DIR = "visualizaciones"
 GT_COLORS_DIR = "Material Celulas/gt_colors"
 VISUALIZACIONES_DIR = "visualizaciones"
 RESULTADOS_DIR = Path(VISUALIZACIONES_DIR) / "RESULTADOS"
+PAQUETE = None              # Carpeta del paquete del lote (paquete.py) del que leer el GT; None = gt_colors
 
 
-def binarizar_imagen(imagen: np.ndarray) -> np.ndarray:
-    #Convierte imagen coloreada a binaria (255 núcleos / 0 fondo)
-    # Convertir a escala de grises si es necesario
-    gray = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY) if imagen.ndim == 3 else imagen
-    # Umbral: cualquier píxel >1 se considera núcleo (255), resto fondo (0)
-    _, binaria = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-    return binaria
-
-
-def generar_imagen_diferencias(pred_binaria: np.ndarray, gt_binaria: np.ndarray) -> np.ndarray:
-    #Devuelve mapa RGB: FN=azul, TP=verde, FP=rojo
-    # Convertir a booleano
-    pred = (pred_binaria > 0).astype(bool)
-    gt = (gt_binaria > 0).astype(bool)
-    # Crear imagen RGB vacía (negra)
-    h, w = pred.shape
-    diff = np.zeros((h, w, 3), dtype=np.uint8)
-    # Asignar colores según tipo de píxel
-    diff[(~pred) & gt] = [0, 0, 255]    # FN: no detectado pero es núcleo (azul)
-    diff[pred & gt] = [0, 255, 0]       # TP: detectado y es núcleo (verde)
-    diff[pred & (~gt)] = [255, 0, 0]    # FP: detectado pero es fondo (rojo)
-    return diff
-
-
-def generar_contornos_superpuestos(imagen_original, pred_color, gt_color) -> np.ndarray:
+def generar_contornos_superpuestos(imagen_original, codigo) -> np.ndarray:
     #Dibuja contornos GT (rojo) y pred (verde) sobre la imagen original
     # Preparar imagen base (convertir a color si es gris)
     base = cv2.cvtColor(imagen_original, cv2.COLOR_GRAY2BGR) if imagen_original.ndim == 2 else imagen_original.copy()
-    # Binarizar predicción y GT
-    pred_bin = binarizar_imagen(pred_color)
-    gt_bin = binarizar_imagen(gt_color)
+    # Binarias de predicción y GT: bits del mapa de códigos
+    pred_bin, gt_bin = comparacion.binarias(codigo)
     # Encontrar contornos de ambos
     contours_pred, _ = cv2.findContours(pred_bin, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     contours_gt, _ = cv2.findContours(gt_bin, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -119,56 +111,103 @@ def generar_grid_completo(imagen_gris, mascara_binaria, mapa_distancia, pred_col
 
 def procesar_imagen(nombre_imagen: str) -> bool:
     """Genera todas las visualizaciones para una imagen concreta."""
+    try:
+        entradas = leer_entradas(nombre_imagen)
+    except FileNotFoundError as e:
+        print(e)
+        return False
+    generar_visualizaciones(nombre_imagen, *entradas)
+    return True
+
+
+def leer_entradas(nombre_imagen: str):
+    #Lee los pasos de segmentar.py y el GT de una imagen; devuelve los argumentos de generar_visualizaciones
+    # (sin el nombre). Lanza FileNotFoundError si falta alguno. Se puede llamar desde un hilo de lectura
     nombre_base = Path(nombre_imagen).stem
-    # Crear directorios de salida
     carpeta_out = Path(OUTPUT_DIR) / nombre_base
-    carpeta_vis = Path(VISUALIZACIONES_DIR) / nombre_base
-    carpeta_vis.mkdir(parents=True, exist_ok=True)
-    RESULTADOS_DIR.mkdir(parents=True, exist_ok=True)
 
     # Rutas de archivos necesarios (generados por segmentar.py)
     ruta_gris = carpeta_out / "1_original_gris.png"
     ruta_mascara = carpeta_out / "2_mascara_binaria.png"
     ruta_distancia = carpeta_out / "3_mapa_distancia.png"
     ruta_pred = carpeta_out / "4_coloreada.png"
+    ruta_etiquetas = carpeta_out / "4_etiquetas.npz"
     ruta_gt = Path(GT_COLORS_DIR) / nombre_imagen
 
+    # GT del paquete (vista sin copia) si está activo y tiene la imagen
+    gt_color = paquete.abrir(PAQUETE).leer(nombre_imagen, "gt") if PAQUETE is not None else None
+
     # Verificar que existen todos los archivos
-    for ruta in [ruta_gris, ruta_mascara, ruta_distancia, ruta_pred, ruta_gt]:
+    for ruta in [ruta_gris, ruta_mascara, ruta_distancia, ruta_pred, *([ruta_gt] if gt_color is None else [])]:
         if not ruta.exists():
-            print(f"Falta: {ruta}")
-            return False
+            raise FileNotFoundError(f"Falta: {ruta}")
 
     # Cargar todas las imágenes
     imagen_gris = cv2.imread(str(ruta_gris), cv2.IMREAD_GRAYSCALE)
     mascara_binaria = cv2.imread(str(ruta_mascara), cv2.IMREAD_GRAYSCALE)
     mapa_distancia = cv2.imread(str(ruta_distancia))
     pred_color = cv2.imread(str(ruta_pred))
-    gt_color = cv2.imread(str(ruta_gt))
+    if gt_color is None:
+        gt_color = cv2.imread(str(ruta_gt))
+
+    # Comparación de evaluar.py (caché) o, si no es válida, predicción binaria (directa desde los labels si existen)
+    codigo = comparacion.cargar(nombre_imagen)
+    if codigo is not None:
+        pred_binaria = None
+    elif ruta_etiquetas.exists():
+        pred_binaria = np.where(segmentar.cargar_etiquetas(ruta_etiquetas) > 0, 255, 0).astype(np.uint8)
+    else:
+        pred_binaria = comparacion.binarizar_imagen(pred_color)
+
+    return imagen_gris, mascara_binaria, mapa_distancia, pred_color, pred_binaria, gt_color, codigo
+
+
+def generar_visualizaciones(nombre_imagen: str, imagen_gris, mascara_binaria, mapa_distancia, pred_color, pred_binaria, gt_color, codigo=None, escritor=None):
+    #Genera y guarda las visualizaciones a partir de imágenes ya en memoria (leídas de disco o pasadas por ejecutar.py)
+    # codigo: mapa de códigos pred*2+gt ya calculado (caché o evaluar_prediccion); si es None se compara aquí
+    # escritor: EscritorFondo para escribir los PNG en segundo plano (None = escritura inmediata)
+    perfil.imagen(nombre_imagen)
+    nombre_base = Path(nombre_imagen).stem
+    carpeta_vis = Path(VISUALIZACIONES_DIR) / nombre_base
+    carpeta_vis.mkdir(parents=True, exist_ok=True)
+    RESULTADOS_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Binarizar predicción y GT
-    pred_binaria = binarizar_imagen(pred_color)
-    gt_binaria = binarizar_imagen(gt_color)
-    # Ajustar tamaño si difiere
-    if pred_binaria.shape != gt_binaria.shape:
-        pred_binaria = cv2.resize(pred_binaria, (gt_binaria.shape[1], gt_binaria.shape[0]))
-        pred_color = cv2.resize(pred_color, (gt_binaria.shape[1], gt_binaria.shape[0]))
+    if codigo is None:
+        with perfil.etapa("comparacion"):
+            gt_binaria = comparacion.binarizar_imagen(gt_color)
+            # Ajustar tamaño si difiere
+            if pred_binaria.shape != gt_binaria.shape:
+                pred_binaria = cv2.resize(pred_binaria, (gt_binaria.shape[1], gt_binaria.shape[0]))
+            codigo = comparacion.codificar(pred_binaria, gt_binaria)
+    if pred_color.shape[:2] != codigo.shape:
+        pred_color = cv2.resize(pred_color, (codigo.shape[1], codigo.shape[0]))
 
     # Generar todas las visualizaciones
-    imagen_diferencias = generar_imagen_diferencias(pred_binaria, gt_binaria)
-    contornos_super = generar_contornos_superpuestos(imagen_gris, pred_color, gt_color)
-    comparativa = generar_comparativa_lado_a_lado(pred_color, gt_color)
-    grid = generar_grid_completo(imagen_gris, mascara_binaria, mapa_distancia, pred_color, gt_color, imagen_diferencias)
-
-    # Guardar visualizaciones en carpeta de la imagen
-    cv2.imwrite(str(carpeta_vis / "diferencias.png"), imagen_diferencias)
-    cv2.imwrite(str(carpeta_vis / "contornos_superpuestos.png"), contornos_super)
-    cv2.imwrite(str(carpeta_vis / "comparativa_lado_a_lado.png"), comparativa)
-    cv2.imwrite(str(carpeta_vis / "grid_completo.png"), grid)
-    # Copia del grid en RESULTADOS para acceso rápido
-    cv2.imwrite(str(RESULTADOS_DIR / f"{nombre_base}_grid.png"), grid)
-
-    return True
+    with perfil.etapa("diferencias"):
+        imagen_diferencias = comparacion.imagen_diferencias(codigo)
+    with perfil.etapa("contornos"):
+        contornos_super = generar_contornos_superpuestos(imagen_gris, codigo)
+    with perfil.etapa("comparativa"):
+        comparativa = generar_comparativa_lado_a_lado(pred_color, gt_color)
+    with perfil.etapa("grid"):
+        grid = generar_grid_completo(imagen_gris, mascara_binaria, mapa_distancia, pred_color, gt_color, imagen_diferencias)
+
+    # Guardar visualizaciones en carpeta de la imagen (+ copia del grid en RESULTADOS para acceso rápido)
+    salidas = [
+        (carpeta_vis / "diferencias.png", imagen_diferencias),
+        (carpeta_vis / "contornos_superpuestos.png", contornos_super),
+        (carpeta_vis / "comparativa_lado_a_lado.png", comparativa),
+        (carpeta_vis / "grid_completo.png", grid),
+        (RESULTADOS_DIR / f"{nombre_base}_grid.png", grid),
+    ]
+    if escritor is None:
+        with perfil.etapa("escritura"):
+            for ruta, imagen in salidas:
+                entrada_salida.escribir_png(ruta, imagen)
+    else:
+        with perfil.etapa("espera_escritura"):
+            for ruta, imagen in salidas:
+                escritor.enviar(str(ruta), entrada_salida.escribir_png, ruta, imagen)
 
 
 def listar_imagenes_disponibles():
@@ -184,11 +223,61 @@ def listar_imagenes_disponibles():
     return sorted(imagenes)
 
 
+def generar_visores(imagen: str | None, formato: str):
+    #Modo --dzi: pirámides DeepZoom y visor de una imagen o de todas las que tienen labels
+    imagenes = [imagen] if imagen else visor_dzi.imagenes_con_etiquetas()
+    if not imagenes:
+        print("No hay imágenes con labels en visualizaciones/")
+        print("   Ejecuta primero: make segmentar")
+        sys.exit(1)
+    print(f"\nGenerando pirámides DeepZoom para {len(imagenes)} imágenes...")
+    exitosos = 0
+    with entrada_salida.EscritorFondo() as escritor:
+        for i, nombre in enumerate(imagenes, 1):
+            print(f"[{i}/{len(imagenes)}] {nombre}", end="")
+            try:
+                visor = visor_dzi.generar_dzi(nombre, formato, escritor)
+            except (FileNotFoundError, ValueError) as e:
+                print(f" ✗ ({e})")
+                continue
+            print(f" ✓ {visor}")
+            exitosos += 1
+    print(f"\n Visores generados: {exitosos}")
+    if exitosos < len(imagenes):
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Genera visualizaciones de análisis a partir de resultados de segmentación")
     parser.add_argument("imagen", nargs="?", help="Nombre de imagen específica a procesar")
     parser.add_argument("--listar", "-l", action="store_true", help="Lista imágenes disponibles")
+    parser.add_argument(
+        "--prefetch", type=int, default=entrada_salida.PREFETCH,
+        help="Imágenes leídas por adelantado (0 = sin lectura en segundo plano)",
+    )
+    parser.add_argument(
+        "--png-compresion", type=int, choices=range(10), default=entrada_salida.COMPRESION_PNG, metavar="0-9",
+        help="Nivel de compresión de los PNG (0 = rápido y grande, 9 = lento y pequeño; por defecto el de OpenCV)",
+    )
+    parser.add_argument(
+        "--profile", nargs="?", const=perfil.TRAZA_POR_DEFECTO, metavar="TRAZA",
+        help=f"Mide tiempo/CPU/memoria por etapa e imagen y los escribe en TRAZA (.jsonl o .csv; por defecto {perfil.TRAZA_POR_DEFECTO})",
+    )
+    parser.add_argument(
+        "--dzi", action="store_true",
+        help="Genera pirámides de teselas DeepZoom y un visor HTML (visualizaciones/<img>/dzi/visor.html)",
+    )
+    parser.add_argument("--dzi-formato", choices=visor_dzi.FORMATOS, default=visor_dzi.FORMATO, help="Formato de las teselas")
+    parser.add_argument(
+        "--paquete", nargs="?", const=paquete.PAQUETE_DIR, metavar="CARPETA",
+        help=f"Lee el GT del paquete del lote (`python paquete.py`; por defecto {paquete.PAQUETE_DIR}) en lugar de gt_colors",
+    )
     args = parser.parse_args()
+    global PAQUETE
+    PAQUETE = args.paquete
+    if args.profile:
+        perfil.activar()
+    entrada_salida.COMPRESION_PNG = args.png_compresion
 
     if args.listar:
         imagenes = listar_imagenes_disponibles()
@@ -200,6 +289,10 @@ def main():
             print("No hay imágenes procesadas en visualizaciones/")
         return
 
+    if args.dzi:
+        generar_visores(args.imagen, args.dzi_formato)
+        return
+
     if args.imagen:
         print(f"\nGenerando visualizaciones para: {args.imagen}")
         if not procesar_imagen(args.imagen):
@@ -213,16 +306,25 @@ def main():
         sys.exit(1)
 
     print(f"\nGenerando visualizaciones para {len(imagenes)} imágenes...")
+    # Lectura por adelantado en hilos -> visualizaciones -> escritura de PNG en segundo plano
     exitosos = 0
-    for i, imagen in enumerate(imagenes, 1):
-        print(f"\n[{i}/{len(imagenes)}] {imagen}", end="")
-        if procesar_imagen(imagen):
+    with entrada_salida.EscritorFondo() as escritor:
+        lecturas = entrada_salida.leer_por_adelantado(imagenes, leer_entradas, args.prefetch)
+        for i, (imagen, entradas, error) in enumerate(lecturas, 1):
+            print(f"\n[{i}/{len(imagenes)}] {imagen}", end="")
+            if error is not None:
+                print(f" ✗ ({error})")
+                continue
+            generar_visualizaciones(imagen, *entradas, escritor=escritor)
             print(" ✓")
             exitosos += 1
-        else:
-            print(" ✗")
     print(f"\n Visualizaciones generadas: {exitosos}")
     print(f"Salida: {VISUALIZACIONES_DIR}/ y {RESULTADOS_DIR}/")
+    if perfil.ACTIVO:
+        registros = perfil.recoger()
+        perfil.escribir_traza(registros, args.profile)
+        perfil.mostrar_resumen(registros)
+        print(f"Traza por etapa guardada en: {args.profile}")
 
 
 if __name__ == "__main__":